@@ -0,0 +1,91 @@
+"""
+Reports where a cold start spends its time: importing main, building the
+bot application at startup, and the first non-webhook request. Each stage
+runs in a fresh interpreter, and `python -X importtime` gives the import
+breakdown, grouped by top-level package.
+
+Run from the repository root:
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start --top 25
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ENV = {"TELEGRAM_BOT_TOKEN": "123456:COLDSTART", "HOST_URL": "https://bot.example"}
+# Modules main should not import until the application is built
+DEFERRED_MODULES = ("telegram", "flask", "werkzeug", "todoist_api_python", "openai", "httpx")
+
+STAGES = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+loaded = [name for name in {deferred!r} if name in sys.modules]
+main.get_application()
+built = time.perf_counter()
+main.get_flask_asgi()
+flask = time.perf_counter()
+print(json.dumps({{
+    "import main": imported - started,
+    "get_application()": built - imported,
+    "get_flask_asgi()": flask - built,
+    "loaded": loaded,
+}}))
+"""
+
+
+def run_python(code: str, *flags):
+    env = dict(os.environ, **ENV)
+    return subprocess.run([sys.executable, *flags, "-c", code], env=env, capture_output=True, text=True, check=True)
+
+
+def import_breakdown(code: str):
+    """Returns {module: (self_us, cumulative_us, depth)} from `python -X importtime`."""
+    modules = {}
+    for line in run_python(code, "-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def report_imports(title: str, modules: dict, top: int) -> None:
+    by_package = {}
+    for name, (self_us, _, _) in modules.items():
+        package = name.split(".")[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+    total = sum(by_package.values())
+    print(f"\n{title}: {len(modules)} modules, {total / 1000:.1f} ms")
+    print(f"{'package':<28} {'self ms':>9} {'share':>7}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:<28} {self_us / 1000:>9.1f} {self_us / total:>7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="packages to list per stage")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time")
+    args = parser.parse_args()
+
+    runs = [json.loads(run_python(STAGES.format(deferred=DEFERRED_MODULES)).stdout) for _ in range(args.runs)]
+    print(f"stage timings, median of {args.runs} fresh interpreters:")
+    for stage in ("import main", "get_application()", "get_flask_asgi()"):
+        timings = sorted(run[stage] for run in runs)
+        print(f"  {stage:<20} {timings[len(timings) // 2] * 1000:8.1f} ms")
+    loaded = runs[0]["loaded"]
+    print(f"  deferred modules loaded by `import main`: {', '.join(loaded) if loaded else 'none'}")
+
+    before = import_breakdown("import main")
+    after = import_breakdown("import main; main.get_application()")
+    report_imports("interpreter start-up and import main", before, args.top)
+    report_imports("added by get_application()", {name: value for name, value in after.items() if name not in before},
+                   args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Reports how much of a sample corpus of /add messages the local rule-based
+parser handles without the LLM, and the latency that saves against a local
+OpenAI stub.
+
+Run from the repository root:
+    python -m benchmarks.fast_path
+"""
+import os
+import statistics
+import time
+
+from benchmarks.stubs import StubServer, OpenAIStubHandler
+
+LATENCY = 0.03
+GENERATION_TIME = 0.3
+
+CORPUS = [
+    "buy milk tomorrow",
+    "call mom next friday p1",
+    "finish report by friday, urgent",
+    "pay rent in 3 days",
+    "review budget 2026-11-01",
+    "gym on sat",
+    "book flights p2",
+    "water the plants today",
+    "renew passport next week",
+    "email the landlord about the leak",
+    "pick up dry cleaning tmrw",
+    "send invoice to client on monday high priority",
+    "fix the login bug asap",
+    "read chapter 4 in two days",
+    "buy groceries for the weekend",
+    "prepare slides for thursday",
+    "call the bank",
+    "schedule car service in a week",
+    "clean the garage this sunday",
+    "order printer ink p3",
+    "dentist every monday at 5pm",
+    "move friday's standup to monday",
+    "submit expense report before the end of the month",
+    "remind me to stretch every morning",
+    "plan birthday party for sarah in december",
+    "water plants daily until next month",
+    "follow up with the recruiter after the interview on wednesday",
+    "draft the quarterly newsletter and circulate it to the whole marketing team for comments before the review",
+    "team lunch at noon tomorrow",
+    "renew gym membership by march",
+]
+
+
+def run(parse, texts):
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        result = parse(text)
+        timings.append(time.perf_counter() - start)
+        assert result, f"no result for {text!r}"
+    return timings
+
+
+def report(name, timings):
+    print(f"{name:<22} {statistics.mean(timings) * 1000:>9.1f} {statistics.median(timings) * 1000:>9.2f} "
+          f"{sum(timings) * 1000:>10.0f}")
+
+
+def main():
+    server = StubServer(OpenAIStubHandler, latency=LATENCY, generation_time=GENERATION_TIME).start()
+    os.environ.update({"OPENAI_API_KEY": "stub-key", "OPENAI_BASE_URL": f"{server.url}/v1"})
+    from config.loader import load_project_mappings
+    from cursor_logic import parser, rules
+
+    mappings = load_project_mappings()
+    local = [text for text in CORPUS if rules.parse_task_locally(text, mappings)[1] >= rules.LOCAL_PARSE_THRESHOLD]
+    print(f"{len(local)}/{len(CORPUS)} messages ({len(local) / len(CORPUS):.0%}) parsed locally "
+          f"at confidence >= {rules.LOCAL_PARSE_THRESHOLD}")
+    print("sent to the LLM:")
+    for text in CORPUS:
+        if text not in local:
+            print(f"  {text}")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        for text in local:
+            rules.parse_task_locally(text, mappings)
+    per_parse = (time.perf_counter() - start) / (1000 * len(local))
+    print(f"local parse: {per_parse * 1e6:.1f} us per message")
+
+    print(f"\nstub latency {LATENCY * 1000:.0f} ms, generation time {GENERATION_TIME * 1000:.0f} ms")
+    print(f"{'path':<22} {'mean ms':>9} {'p50 ms':>9} {'total ms':>10}")
+    parser.PARSE_CACHE.clear()
+    server.calls.clear()
+    report("LLM only", run(parser.parse_task_with_ai, CORPUS))
+    llm_calls = sum(server.calls.values())
+    parser.PARSE_CACHE.clear()
+    server.calls.clear()
+    report("fast path + fallback", run(lambda text: parser.parse_task(text, mappings), CORPUS))
+    print(f"LLM requests: {llm_calls} -> {sum(server.calls.values())}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
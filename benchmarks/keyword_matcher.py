@@ -0,0 +1,67 @@
+"""
+Compares the compiled keyword matcher with the old linear keyword scan as the
+number of keywords in the project mappings grows.
+
+Run from the repository root:
+    python -m benchmarks.keyword_matcher
+"""
+import random
+import string
+import timeit
+
+from config.loader import find_project_section
+
+
+def linear_find_project_section(text_input, mappings):
+    """The original nested-loop implementation, kept here as the baseline."""
+    text_lower = text_input.lower()
+    for project_name, project_data in mappings.items():
+        if "sections" in project_data:
+            for section_name, section_keywords in project_data["sections"].items():
+                if any(keyword.lower() in text_lower for keyword in section_keywords):
+                    return project_name, section_name
+    for project_name, project_data in mappings.items():
+        if "keywords" in project_data and any(
+            keyword.lower() in text_lower for keyword in project_data["keywords"]
+        ):
+            return project_name, "General"
+    return "Inbox", None
+
+
+def build_mappings(projects: int, keywords_per_entry: int, rng: random.Random) -> dict:
+    word = lambda: "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+    return {
+        f"Project {p}": {
+            "keywords": [word() for _ in range(keywords_per_entry)],
+            "sections": {
+                f"Section {s}": [word() for _ in range(keywords_per_entry)] for s in range(3)
+            },
+        }
+        for p in range(projects)
+    }
+
+
+def main():
+    rng = random.Random(42)
+    messages = [
+        "Remember to call the plumber about the kitchen sink before friday",
+        "Draft the quarterly report and send it to the finance team",
+    ]
+    print(f"{'keywords':>9} {'linear us':>10} {'compiled us':>12} {'speedup':>8}")
+    for projects in (10, 50, 200, 1000):
+        mappings = build_mappings(projects, 5, rng)
+        keyword_count = projects * 5 * 4
+        # The unmatched path is the worst case for both: every keyword is checked
+        find_project_section(messages[0], mappings)
+        number = 200
+        linear = min(timeit.repeat(
+            lambda: [linear_find_project_section(m, mappings) for m in messages], number=number, repeat=3
+        )) / (number * len(messages)) * 1e6
+        compiled = min(timeit.repeat(
+            lambda: [find_project_section(m, mappings) for m in messages], number=number, repeat=3
+        )) / (number * len(messages)) * 1e6
+        print(f"{keyword_count:>9} {linear:>10.1f} {compiled:>12.1f} {linear / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+End-to-end load test: pushes synthetic webhook updates through the real
+main:app ASGI app at a controlled rate, with local stubs standing in for the
+Telegram Bot API, Todoist (REST and Sync) and OpenAI.
+
+An update's latency runs from posting it to the webhook until the Telegram
+stub receives the bot's reply for that chat. For each command the report
+gives p50/p95/p99 latency, throughput, webhook acknowledgement time and the
+upstream calls made per update.
+
+Run from the repository root:
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --rate 100 --updates 500 --todoist-latency 0.2 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.stubs import (
+    StubServer, TelegramStubHandler, TodoistStubHandler, TodoistState, OpenAIStubHandler,
+)
+
+HOST_URL = "https://bot.example"
+BOT_TOKEN = "123456:LOADTEST"
+SCENARIOS = {
+    "start": lambda i: "/start",
+    "add": lambda i: f"/add buy milk {i} - groceries",
+    "add_batch": lambda i: f"/add water plants {i}\nbook flights {i} - travel\nfix the bike {i} - home",
+    "complete": lambda i: f"/complete chore {i}",
+    "complete_batch": lambda i: f"/complete chore b{i}, chore c{i}",
+}
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+async def call_asgi(app, scope, body: bytes = b""):
+    messages = [{"type": "http.request", "body": body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+    await app(scope, receive, send)
+    return sent[0]["status"] if sent else None
+
+
+def webhook_scope() -> dict:
+    return {
+        "type": "http", "method": "POST", "path": "/webhook", "query_string": b"", "http_version": "1.1",
+        "headers": [(b"content-type", b"application/json")], "scheme": "https",
+        "server": ("bot.example", 443), "root_path": "",
+    }
+
+
+class Lifespan:
+    """Drives the app's ASGI lifespan events."""
+
+    def __init__(self, app):
+        self.app = app
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+
+    async def start(self):
+        self.task = asyncio.create_task(self.app({"type": "lifespan"}, self.inbox.get, self.outbox.put))
+        await self.inbox.put({"type": "lifespan.startup"})
+        message = await self.outbox.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Startup failed: {message}")
+
+    async def stop(self):
+        await self.inbox.put({"type": "lifespan.shutdown"})
+        await self.outbox.get()
+        await self.task
+
+
+async def run_scenario(main, stubs, name: str, updates: int, rate: float, timeout: float, first_id: int):
+    telegram, todoist, openai = stubs
+    for stub in stubs:
+        stub.calls.clear()
+    replies = telegram.handler.replies
+    posted, acks, statuses = {}, [], Counter()
+    chat_base = first_id * 10
+
+    start = time.monotonic()
+    for i in range(updates):
+        # Open-loop arrivals: each update goes out on schedule however slow the app is
+        delay = start + i / rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat_id = chat_base + i
+        body = json.dumps(make_update(first_id + i, chat_id, SCENARIOS[name](i))).encode()
+        posted[chat_id] = time.monotonic()
+        statuses[await call_asgi(main.app, webhook_scope(), body)] += 1
+        acks.append(time.monotonic() - posted[chat_id])
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and any(chat_id not in replies for chat_id in posted):
+        await asyncio.sleep(0.01)
+    finished = time.monotonic()
+
+    latencies = [replies[chat_id][0][0] - sent for chat_id, sent in posted.items() if chat_id in replies]
+    last_reply = max((replies[chat_id][0][0] for chat_id in posted if chat_id in replies), default=finished)
+    return {
+        "name": name,
+        "updates": updates,
+        "answered": len(latencies),
+        "statuses": dict(statuses),
+        "throughput": len(latencies) / max(last_reply - start, 1e-9),
+        "latencies": latencies,
+        "acks": acks,
+        "calls": {upstream: dict(stub.calls) for upstream, stub in zip(("telegram", "todoist", "openai"), stubs)},
+    }
+
+
+def report(result: dict) -> None:
+    latencies = result["latencies"]
+    print(f"\n== {result['name']}: {result['answered']}/{result['updates']} answered, "
+          f"webhook statuses {result['statuses']}")
+    if latencies:
+        print(f"   latency ms  p50 {percentile(latencies, 0.5) * 1000:8.1f}  p95 {percentile(latencies, 0.95) * 1000:8.1f}"
+              f"  p99 {percentile(latencies, 0.99) * 1000:8.1f}  max {max(latencies) * 1000:8.1f}")
+        print(f"   throughput  {result['throughput']:.1f} updates/s, "
+              f"webhook ack p50 {statistics.median(result['acks']) * 1000:.2f} ms")
+    for upstream, calls in result["calls"].items():
+        if calls:
+            per_update = ", ".join(f"{route} {count / result['updates']:.2f}" for route, count in sorted(calls.items()))
+            print(f"   {upstream:<9} calls/update: {per_update}")
+
+
+async def main_async(args):
+    state = TodoistState()
+    for i in range(args.updates):
+        for prefix in ("", "b", "c"):
+            state.add_task(f"chore {prefix}{i}")
+    telegram = StubServer(TelegramStubHandler, latency=args.telegram_latency, error_rate=args.error_rate,
+                          webhook_url=f"{HOST_URL}/webhook", replies={}).start()
+    todoist = StubServer(TodoistStubHandler, latency=args.todoist_latency, error_rate=args.error_rate,
+                         state=state).start()
+    openai = StubServer(OpenAIStubHandler, latency=args.openai_latency, error_rate=args.error_rate).start()
+    # The account registry, token key and journal are written here rather than into the repo
+    data_dir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "HOST_URL": HOST_URL,
+        "TELEGRAM_BASE_URL": telegram.url,
+        "TODOIST_API_TOKEN": "loadtest-token",
+        "TODOIST_BASE_URL": todoist.url,
+        "OPENAI_API_KEY": "stub-key",
+        "OPENAI_BASE_URL": f"{openai.url}/v1",
+        # Measure the app, not the production rate limits
+        "TODOIST_RATE_LIMIT": "10000,10000",
+        "TELEGRAM_RATE_LIMIT": "10000,10000",
+        "OPENAI_RATE_LIMIT": "10000,10000",
+        "BOT_DATA_DIR": data_dir,
+        "TODOIST_ACCOUNTS_PATH": os.path.join(data_dir, "accounts.db"),
+        "TODOIST_WRITE_BEHIND_PATH": os.path.join(data_dir, "write_behind.db"),
+    })
+    import main
+    # The app logs every injected failure; keep the report readable
+    logging.getLogger().setLevel(args.log_level)
+
+    lifespan = Lifespan(main.app)
+    await lifespan.start()
+    print(f"{args.updates} updates per command at {args.rate}/s; stub latency telegram {args.telegram_latency * 1000:.0f} ms, "
+          f"todoist {args.todoist_latency * 1000:.0f} ms, openai {args.openai_latency * 1000:.0f} ms, "
+          f"error rate {args.error_rate:.0%}")
+    stubs = (telegram, todoist, openai)
+    first_id = 1
+    for name in args.commands:
+        report(await run_scenario(main, stubs, name, args.updates, args.rate, args.timeout, first_id))
+        first_id += args.updates * 10
+    await lifespan.stop()
+    for stub in stubs:
+        stub.stop()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200, help="updates per command")
+    parser.add_argument("--rate", type=float, default=50, help="updates posted per second")
+    parser.add_argument("--commands", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--todoist-latency", type=float, default=0.05)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream requests that fail")
+    parser.add_argument("--log-level", default="CRITICAL", help="app log level during the run")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for replies after the last post")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compares parse latency and request counts for the parser modes against a
+local OpenAI stub: the original Assistant flow (five calls, fixed 1s polling),
+the Assistant flow with create_and_run and adaptive polling, and the single
+structured-output completion.
+
+Run from the repository root:
+    python -m benchmarks.parser_latency
+"""
+import os
+import statistics
+import time
+import warnings
+
+from benchmarks.stubs import StubServer, OpenAIStubHandler
+
+LATENCY = 0.03
+GENERATION_TIME = 0.4
+SAMPLES = 5
+
+
+def legacy_assistant_parse(client, assistant_id: str, text: str):
+    """The original polling loop, kept here as the baseline."""
+    thread = client.beta.threads.create()
+    client.beta.threads.messages.create(thread_id=thread.id, role="user", content=text)
+    run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id=assistant_id)
+    while run.status in ['queued', 'in_progress', 'cancelling']:
+        time.sleep(1)
+        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+    return client.beta.threads.messages.list(thread_id=thread.id)
+
+
+def measure(name, parse, server):
+    server.calls.clear()
+    timings = []
+    for _ in range(SAMPLES):
+        start = time.perf_counter()
+        result = parse("buy milk tomorrow")
+        timings.append(time.perf_counter() - start)
+        assert result is not None, f"{name} returned no result"
+    requests = sum(server.calls.values()) / SAMPLES
+    print(f"{name:<28} {statistics.median(timings) * 1000:>9.0f} {max(timings) * 1000:>9.0f} {requests:>9.1f}")
+
+
+def main():
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    server = StubServer(OpenAIStubHandler, latency=LATENCY, generation_time=GENERATION_TIME).start()
+    os.environ.update({
+        "OPENAI_API_KEY": "stub-key",
+        "OPENAI_ASSISTANT_ID": "asst_stub",
+        "OPENAI_BASE_URL": f"{server.url}/v1",
+    })
+    from cursor_logic import parser
+
+    client = parser.get_client("stub-key")
+    print(f"stub latency {LATENCY * 1000:.0f} ms per request, generation time {GENERATION_TIME * 1000:.0f} ms")
+    print(f"{'mode':<28} {'p50 ms':>9} {'max ms':>9} {'requests':>9}")
+    measure("assistant (original)", lambda text: legacy_assistant_parse(client, "asst_stub", text), server)
+    measure("assistant (adaptive poll)", parser.parse_task_with_openai_assistant, server)
+    measure("completion (single request)", parser.parse_task_with_completion, server)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
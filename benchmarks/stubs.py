@@ -0,0 +1,361 @@
+"""
+Local stub servers standing in for upstream APIs in benchmarks.
+
+Each stub answers after `latency` seconds and counts the requests it served
+per route, so benchmarks can report both timings and upstream call counts.
+Setting `error_rate` makes that fraction of requests fail with `error_status`.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PARSED_TASK = {
+    "title": "Buy milk",
+    "due_date": None,
+    "priority": 1,
+    "project": "Personal",
+    "section": "Groceries",
+}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops bursts of concurrent connects
+    request_queue_size = 512
+
+    def __init__(self, handler_class, **settings):
+        # Each server gets its own handler subclass so settings and counters don't leak
+        handler = type(handler_class.__name__, (handler_class,), dict(settings, calls=Counter(), lock=threading.Lock()))
+        super().__init__(("127.0.0.1", 0), handler)
+        self.handler = handler
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    @property
+    def calls(self) -> Counter:
+        return self.handler.calls
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Shared plumbing: latency, error injection, call counting and JSON replies."""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    error_rate = 0.0
+    error_status = 500
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def count(self, route: str) -> None:
+        with self.lock:
+            self.calls[route] += 1
+
+    def inject_error(self, route: str) -> bool:
+        """Fails the request with `error_status` at `error_rate`; returns True if it did."""
+        if not self.error_rate or random.random() >= self.error_rate:
+            return False
+        self.count(f"{route} (error {self.error_status})")
+        self.reply({"error": "injected", "ok": False, "error_code": self.error_status,
+                    "description": "Injected failure", "parameters": {"retry_after": 1}},
+                   status=self.error_status)
+        return True
+
+    def reply(self, payload, status: int = 200, delay: float = None) -> None:
+        time.sleep(self.latency if delay is None else delay)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OpenAIStubHandler(StubHandler):
+    """
+    Chat completions and the Assistant thread/run endpoints. A completion
+    takes `latency + generation_time`; an Assistant run reports in_progress
+    until `generation_time` has passed since it was created.
+    """
+    generation_time = 0.0
+    _ids = itertools.count()
+    _runs = {}
+
+    def do_POST(self):
+        self.read_body()
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            self.count("chat.completions")
+            self.reply({
+                "id": "chatcmpl-1", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": json.dumps(PARSED_TASK)}}],
+            }, delay=self.latency + self.generation_time)
+        elif path.endswith("/threads/runs") or re.search(r"/threads/[^/]+/runs$", path):
+            self.count("runs.create")
+            thread_id = path.split("/")[-2] if not path.endswith("/threads/runs") else f"thread_{next(self._ids)}"
+            run_id = f"run_{next(self._ids)}"
+            self._runs[run_id] = time.monotonic()
+            self.reply(self._run(thread_id, run_id))
+        elif re.search(r"/threads/[^/]+/messages$", path):
+            self.count("messages.create")
+            self.reply({"id": f"msg_{next(self._ids)}", "object": "thread.message", "role": "user", "content": []})
+        elif path.endswith("/cancel"):
+            self.count("runs.cancel")
+            parts = path.split("/")
+            self._runs.pop(parts[-2], None)
+            self.reply({"id": parts[-2], "object": "thread.run", "thread_id": parts[-4], "status": "cancelled"})
+        elif path.endswith("/threads"):
+            self.count("threads.create")
+            self.reply({"id": f"thread_{next(self._ids)}", "object": "thread"})
+        else:
+            self.reply({"error": "not found"}, status=404)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        parts = path.split("/")
+        if "/runs/" in path:
+            self.count("runs.retrieve")
+            self.reply(self._run(parts[-3], parts[-1]))
+        elif path.endswith("/messages"):
+            self.count("messages.list")
+            self.reply({"object": "list", "data": [{
+                "id": "msg_reply", "object": "thread.message", "role": "assistant",
+                "content": [{"type": "text", "text": {"value": json.dumps(PARSED_TASK), "annotations": []}}],
+            }]})
+        else:
+            self.reply({"error": "not found"}, status=404)
+
+    def _run(self, thread_id: str, run_id: str) -> dict:
+        created = self._runs.get(run_id)
+        done = created is not None and time.monotonic() - created >= self.generation_time
+        return {"id": run_id, "object": "thread.run", "thread_id": thread_id,
+                "status": "completed" if done else "in_progress"}
+
+
+class TelegramStubHandler(StubHandler):
+    """
+    The Bot API methods the bot calls. sendMessage records when each chat
+    got its reply in `replies`, which load tests use to time whole updates.
+    """
+    webhook_url = ""
+    replies = None  # chat_id -> list of (time.monotonic(), text)
+    _ids = itertools.count(1)
+
+    def do_POST(self):
+        body = self.read_body()
+        method = self.path.rsplit("/", 1)[-1]
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+        if self.inject_error(method):
+            return
+        self.count(method)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            with self.lock:
+                self.replies.setdefault(chat_id, []).append((time.monotonic(), params.get("text")))
+            result = {"message_id": next(self._ids), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "text": params.get("text")}
+        else:
+            result = True
+        self.reply({"ok": True, "result": result})
+
+
+class TodoistState:
+    """In-memory Todoist account data behind TodoistStubHandler."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.ids = itertools.count(1)
+        self.projects = {}
+        self.sections = {}
+        self.tasks = {}
+        # Command uuids already applied; Todoist acknowledges a repeat without applying it again
+        self.applied = set()
+        self.add_project("Inbox")
+
+    def _touch(self, entry: dict) -> dict:
+        self.version += 1
+        entry["_version"] = self.version
+        return entry
+
+    def add_project(self, name: str) -> dict:
+        project_id = f"p{next(self.ids)}"
+        self.projects[project_id] = self._touch({
+            "id": project_id, "name": name, "description": "", "child_order": 1, "color": "grey",
+            "collapsed": False, "shared": False, "is_favorite": False, "is_archived": False,
+            "can_assign_tasks": False, "view_style": "list", "created_at": "2025-01-01T00:00:00Z",
+            "updated_at": "2025-01-01T00:00:00Z", "inbox_project": name == "Inbox",
+        })
+        return self.projects[project_id]
+
+    def add_section(self, name: str, project_id: str) -> dict:
+        section_id = f"s{next(self.ids)}"
+        self.sections[section_id] = self._touch({
+            "id": section_id, "name": name, "project_id": project_id, "collapsed": False, "section_order": 1,
+        })
+        return self.sections[section_id]
+
+    def add_task(self, content: str, project_id: str = None, section_id: str = None) -> dict:
+        task_id = f"t{next(self.ids)}"
+        self.tasks[task_id] = self._touch({
+            "id": task_id, "content": content, "description": "", "project_id": project_id or "p1",
+            "section_id": section_id, "parent_id": None, "labels": [], "priority": 1, "due": None,
+            "deadline": None, "duration": None, "collapsed": False, "child_order": 1, "responsible_uid": None,
+            "assigned_by_uid": None, "completed_at": None, "added_by_uid": "u1", "checked": False,
+            "added_at": "2025-01-01T00:00:00Z", "updated_at": "2025-01-01T00:00:00Z",
+        })
+        return self.tasks[task_id]
+
+    def close_task(self, task_id: str) -> bool:
+        task = self.tasks.get(task_id)
+        if task is None or task["checked"]:
+            return False
+        task["checked"] = True
+        self._touch(task)
+        return True
+
+    @staticmethod
+    def public(entry: dict) -> dict:
+        return {key: value for key, value in entry.items() if not key.startswith("_")}
+
+    def changed_since(self, store: dict, version: int, active=lambda entry: True):
+        return [self.public(e) for e in store.values() if e["_version"] > version and (version or active(e))]
+
+
+class TodoistStubHandler(StubHandler):
+    """The REST and Sync API endpoints the bot uses, backed by a TodoistState."""
+    state = None
+
+    def _params(self, body: bytes) -> dict:
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+    def _route(self, method: str) -> str:
+        path = urllib.parse.urlparse(self.path).path
+        return f"{method} " + re.sub(r"/[ptsu]\d+", "/:id", path)
+
+    def do_GET(self):
+        route = self._route("GET")
+        if self.inject_error(route):
+            return
+        self.count(route)
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        with self.state.lock:
+            if route.endswith("/projects"):
+                results = [self.state.public(p) for p in self.state.projects.values()]
+            elif route.endswith("/sections"):
+                project_id = query.get("project_id", [None])[0]
+                results = [self.state.public(s) for s in self.state.sections.values()
+                           if project_id in (None, s["project_id"])]
+            elif route.endswith("/tasks"):
+                results = [self.state.public(t) for t in self.state.tasks.values() if not t["checked"]]
+            else:
+                self.reply({"error": "not found"}, status=404)
+                return
+        self.reply({"results": results, "next_cursor": None})
+
+    def do_HEAD(self):
+        self.count(self._route("HEAD"))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        params = self._params(self.read_body())
+        route = self._route("POST")
+        if self.inject_error(route):
+            return
+        self.count(route)
+        with self.state.lock:
+            if route.endswith("/sync"):
+                payload = self._sync(params)
+            elif route.endswith("/projects"):
+                payload = self.state.public(self.state.add_project(params["name"]))
+            elif route.endswith("/sections"):
+                payload = self.state.public(self.state.add_section(params["name"], params["project_id"]))
+            elif route.endswith("/tasks"):
+                payload = self.state.public(self.state.add_task(
+                    params["content"], params.get("project_id"), params.get("section_id")))
+            elif route.endswith("/close"):
+                self.state.close_task(self.path.split("/")[-2])
+                payload = None
+            else:
+                payload = {"error": "not found"}
+        if payload is None:
+            time.sleep(self.latency)
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self.reply(payload)
+
+    def _sync(self, params: dict) -> dict:
+        state = self.state
+        status, mapping = {}, {}
+        commands = json.loads(params.get("commands", "[]")) if isinstance(params.get("commands", "[]"), str) \
+            else params.get("commands", [])
+        for command in commands:
+            if command["uuid"] in state.applied:
+                status[command["uuid"]] = "ok"
+                continue
+            args = {key: mapping.get(value, value) if isinstance(value, str) else value
+                    for key, value in command["args"].items()}
+            kind = command["type"]
+            if kind == "project_add":
+                created = state.add_project(args["name"])
+            elif kind == "section_add":
+                created = state.add_section(args["name"], args["project_id"])
+            elif kind == "item_add":
+                created = state.add_task(args["content"], args.get("project_id"), args.get("section_id"))
+            elif kind == "item_close":
+                created = None
+                if not state.close_task(args["id"]):
+                    status[command["uuid"]] = {"error_code": 22, "error": "Item not found"}
+                    continue
+            else:
+                status[command["uuid"]] = {"error_code": 1, "error": f"Unknown command {kind}"}
+                continue
+            if created is not None and command.get("temp_id"):
+                mapping[command["temp_id"]] = created["id"]
+            state.applied.add(command["uuid"])
+            status[command["uuid"]] = "ok"
+
+        token = params.get("sync_token", "*")
+        version = 0 if token == "*" else int(token)
+        response = {
+            "full_sync": token == "*",
+            "sync_token": str(state.version),
+            "items": state.changed_since(state.tasks, version, lambda task: not task["checked"]),
+            "projects": state.changed_since(state.projects, version),
+            "sections": state.changed_since(state.sections, version),
+        }
+        if commands:
+            response.update(sync_status=status, temp_id_mapping=mapping)
+        return response
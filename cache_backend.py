@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps caches private to each worker process; "sqlite" shares them
+# between the workers on a host through one SQLite file in WAL mode
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_PATH = os.getenv("CACHE_PATH", "bot_cache.db")
+# Writes between evictions of a shared namespace down to its size
+CACHE_PRUNE_EVERY = 100
+
+_TAG_SEPARATOR = "\x1f"
+
+
+def account_key(api_token: str) -> str:
+    """Identifies an account in shared cache keys without writing its token to disk."""
+    return hashlib.sha256(str(api_token).encode()).hexdigest()[:16]
+
+
+class MemoryBackend:
+    """
+    A bounded LRU cache private to this process. Entries can expire after a
+    TTL and carry tags, so related entries can be dropped together.
+    """
+    shared = False
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns the value for a key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value, ttl: float = None, tags=()) -> None:
+        self.set_many([(key, value, tags)], ttl)
+
+    def set_many(self, entries, ttl: float = None) -> None:
+        """Stores (key, value, tags) entries sharing one TTL."""
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            for key, value, tags in entries:
+                self._entries[key] = (value, expires, frozenset(tags))
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_tag(self, tag: str) -> None:
+        """Drops every entry carrying the tag."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if tag in entry[2]]:
+                del self._entries[key]
+
+    def incr(self, name: str) -> int:
+        """Increments a counter, e.g. a generation other readers compare against."""
+        with self._lock:
+            value = self._counters[name] = self._counters.get(name, 0) + 1
+            return value
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _Connection:
+    """One SQLite connection per process and file, shared by that process's caches."""
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # A crash may lose the last writes, which is fine for a cache
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "namespace TEXT, key TEXT, value TEXT, expires REAL, written REAL, tags TEXT, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_entries_written ON cache_entries (namespace, written)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_counters (namespace TEXT, name TEXT, value INTEGER, "
+            "PRIMARY KEY (namespace, name))"
+        )
+        self.db.commit()
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _connect(path: str) -> _Connection:
+    # Keyed by pid too, so a worker forked after a connection was opened doesn't inherit it
+    key = (os.getpid(), os.path.abspath(path))
+    with _connections_lock:
+        connection = _connections.get(key)
+        if connection is None:
+            connection = _connections[key] = _Connection(path)
+        return connection
+
+
+class SQLiteBackend:
+    """
+    A cache namespace in a SQLite file shared by every worker on the host.
+    Reads and writes go straight to the file, so a value one worker stores,
+    or an entry it invalidates, is seen by the others on their next lookup.
+    The namespace is pruned back to `maxsize` entries, oldest writes first.
+    """
+    shared = True
+
+    def __init__(self, namespace: str, maxsize: int, path: str = CACHE_PATH):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.path = path
+        self._writes = 0
+
+    @property
+    def _connection(self) -> _Connection:
+        return _connect(self.path)
+
+    def get(self, key: str):
+        connection = self._connection
+        with connection.lock:
+            row = connection.db.execute(
+                "SELECT value, expires FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float = None, tags=()) -> None:
+        self.set_many([(key, value, tags)], ttl)
+
+    def set_many(self, entries, ttl: float = None) -> None:
+        """Stores (key, value, tags) entries sharing one TTL in a single transaction."""
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        rows = [
+            (self.namespace, key, json.dumps(value), expires, now,
+             _TAG_SEPARATOR + _TAG_SEPARATOR.join(tags) + _TAG_SEPARATOR if tags else "")
+            for key, value, tags in entries
+        ]
+        if not rows:
+            return
+        connection = self._connection
+        with connection.lock:
+            connection.db.executemany("INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+            writes, self._writes = self._writes, self._writes + len(rows)
+            if writes // CACHE_PRUNE_EVERY != self._writes // CACHE_PRUNE_EVERY:
+                self._prune(connection.db, now)
+            connection.db.commit()
+
+    def _prune(self, db, now: float) -> None:
+        db.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires < ?", (self.namespace, now))
+        db.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key IN (SELECT key FROM cache_entries "
+            "WHERE namespace = ? ORDER BY written DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.maxsize),
+        )
+
+    def delete(self, key: str) -> None:
+        connection = self._connection
+        with connection.lock:
+            connection.db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+            connection.db.commit()
+
+    def invalidate_tag(self, tag: str) -> None:
+        connection = self._connection
+        with connection.lock:
+            connection.db.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND instr(tags, ?) > 0",
+                (self.namespace, _TAG_SEPARATOR + tag + _TAG_SEPARATOR),
+            )
+            connection.db.commit()
+
+    def incr(self, name: str) -> int:
+        connection = self._connection
+        with connection.lock:
+            connection.db.execute(
+                "INSERT INTO cache_counters VALUES (?, ?, 1) "
+                "ON CONFLICT (namespace, name) DO UPDATE SET value = value + 1",
+                (self.namespace, name),
+            )
+            value = connection.db.execute(
+                "SELECT value FROM cache_counters WHERE namespace = ? AND name = ?", (self.namespace, name)
+            ).fetchone()[0]
+            connection.db.commit()
+        return value
+
+    def counter(self, name: str) -> int:
+        connection = self._connection
+        with connection.lock:
+            row = connection.db.execute(
+                "SELECT value FROM cache_counters WHERE namespace = ? AND name = ?", (self.namespace, name)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def clear(self) -> None:
+        connection = self._connection
+        with connection.lock:
+            connection.db.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            connection.db.commit()
+
+    def __len__(self) -> int:
+        connection = self._connection
+        with connection.lock:
+            return connection.db.execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+
+def open_cache(namespace: str, maxsize: int, backend: str = None):
+    """Returns a cache for the namespace on the configured backend."""
+    backend = backend or CACHE_BACKEND
+    if backend == "sqlite":
+        return SQLiteBackend(namespace, maxsize)
+    if backend != "memory":
+        logger.warning(f"Unknown CACHE_BACKEND '{backend}', using the in-process cache.")
+    return MemoryBackend(maxsize)
@@ -1,39 +1,109 @@
+import os
 import json
 import logging
+import threading
+from collections import OrderedDict
 from pathlib import Path
+from config.matcher import KeywordMatcher
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
-def load_project_mappings():
+# Compiled matchers for recently used mappings, keyed by the mappings' id().
+# Mappings are treated as read-only once they have been matched against.
+_MATCHER_CACHE_SIZE = 8
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+CONFIG_PATH = Path(__file__).parent / "projects.json"
+RELOAD_INTERVAL = float(os.getenv("PROJECT_MAPPINGS_RELOAD_INTERVAL", 5))
+
+def load_project_mappings(config_path=CONFIG_PATH):
     """Loads the project and section mappings from config/projects.json."""
-    config_path = Path(__file__).parent / "projects.json"
     with open(config_path, "r") as f:
         return json.load(f)
 
+class ProjectMappingsStore:
+    """
+    Holds the current project mappings and reloads them when projects.json changes.
+    A background thread polls the file's mtime, parses and compiles the new
+    mappings off the request path, then swaps them in with a single assignment,
+    so readers always see either the old or the new config in full.
+    """
+
+    def __init__(self, config_path=CONFIG_PATH):
+        self.config_path = Path(config_path)
+        self._mtime = self._stat()
+        self._mappings = load_project_mappings(self.config_path)
+        compile_mappings(self._mappings)
+        self._stop = threading.Event()
+        self._watcher = None
+
+    @property
+    def mappings(self):
+        return self._mappings
+
+    def _stat(self):
+        return self.config_path.stat().st_mtime_ns
+
+    def reload(self, force: bool = False) -> bool:
+        """Reloads the mappings if the file changed. Returns True when swapped."""
+        try:
+            mtime = self._stat()
+            if mtime == self._mtime and not force:
+                return False
+            mappings = load_project_mappings(self.config_path)
+            compile_mappings(mappings)
+        except Exception as e:
+            # Keep serving the last good config when the file is mid-write or invalid
+            logger.error(f"Failed to reload project mappings: {e}")
+            return False
+        self._mappings = mappings
+        self._mtime = mtime
+        logger.info(f"Reloaded project mappings from {self.config_path}.")
+        return True
+
+    def start_watching(self, interval: float = RELOAD_INTERVAL) -> None:
+        """Starts the background reload thread if it is not already running."""
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._stop.clear()
+
+        def watch():
+            while not self._stop.wait(interval):
+                self.reload()
+
+        self._watcher = threading.Thread(target=watch, name="project-mappings-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        self._stop.set()
+
+def compile_mappings(mappings) -> KeywordMatcher:
+    """Returns the compiled keyword matcher for a mappings dict, building it once."""
+    with _matchers_lock:
+        cached = _matchers.get(id(mappings))
+        if cached is not None and cached[0] is mappings:
+            _matchers.move_to_end(id(mappings))
+            return cached[1]
+    matcher = KeywordMatcher(mappings)
+    with _matchers_lock:
+        _matchers[id(mappings)] = (mappings, matcher)
+        while len(_matchers) > _MATCHER_CACHE_SIZE:
+            _matchers.popitem(last=False)
+    return matcher
+
+@span("find_project_section")
 def find_project_section(text_input, mappings):
     """
     Finds the project and section for a given text input based on keywords.
     It prioritizes section keywords over project keywords.
     """
-    text_lower = text_input.lower()
-    logger.debug(f"Searching for project/section in: '{text_lower}'")
-
-    # First, check for section keywords for a more specific match
-    for project_name, project_data in mappings.items():
-        if "sections" in project_data:
-            for section_name, section_keywords in project_data["sections"].items():
-                if any(keyword.lower() in text_lower for keyword in section_keywords):
-                    logger.debug(f"Found section keyword match: P='{project_name}', S='{section_name}'")
-                    return project_name, section_name
-
-    # If no section keywords match, check for project-level keywords
-    for project_name, project_data in mappings.items():
-        if "keywords" in project_data and any(
-            keyword.lower() in text_lower for keyword in project_data["keywords"]
-        ):
-            # Default to a general section if one is not specified
-            logger.debug(f"Found project keyword match: P='{project_name}'")
-            return project_name, "General"
+    logger.debug(f"Searching for project/section in: '{text_input}'")
+    match = compile_mappings(mappings).match(text_input)
+    if match:
+        logger.debug(f"Found keyword match: P='{match[0]}', S='{match[1]}'")
+        return match
 
     logger.debug("No keywords matched. Defaulting to Inbox.")
-    return "Inbox", None  # Default project if no keywords match 
\ No newline at end of file
+    return "Inbox", None  # Default project if no keywords match
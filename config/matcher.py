@@ -0,0 +1,82 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    An Aho-Corasick automaton over every project and section keyword, so a
+    message is matched in one pass regardless of how many keywords exist.
+
+    Each keyword carries the rank of the mapping it belongs to: sections in
+    config order first, then projects in config order. The match with the
+    lowest rank wins, which preserves find_project_section's priority rules.
+    """
+
+    def __init__(self, mappings: dict):
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+        self._results = []
+
+        for project_name, project_data in mappings.items():
+            if "sections" in project_data:
+                for section_name, section_keywords in project_data["sections"].items():
+                    self._add_rank(section_keywords, (project_name, section_name))
+        for project_name, project_data in mappings.items():
+            if "keywords" in project_data:
+                # Default to a general section if one is not specified
+                self._add_rank(project_data["keywords"], (project_name, "General"))
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self._goto)
+
+    def _add_rank(self, keywords, result):
+        rank = len(self._results)
+        self._results.append(result)
+        for keyword in keywords:
+            node = 0
+            for char in keyword.lower():
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(None)
+                node = next_node
+            if self._best[node] is None or rank < self._best[node]:
+                self._best[node] = rank
+
+    def _build_failure_links(self):
+        goto, fail_links, best_at = self._goto, self._fail, self._best
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                if node == 0:
+                    continue
+                fail = fail_links[node]
+                while fail and char not in goto[fail]:
+                    fail = fail_links[fail]
+                fail_links[child] = goto[fail].get(char, 0)
+                # A node also matches every keyword that ends at its failure target
+                inherited = best_at[fail_links[child]]
+                if inherited is not None and (best_at[child] is None or inherited < best_at[child]):
+                    best_at[child] = inherited
+
+    def match(self, text: str):
+        """Returns the (project, section) of the best keyword found in the text, or None."""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        best = best_at[0]
+        node = 0
+        for char in text.lower():
+            if best == 0:
+                break
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            rank = best_at[node]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+        return self._results[best] if best is not None else None
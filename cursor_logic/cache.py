@@ -0,0 +1,73 @@
+import os
+import re
+import datetime
+import logging
+import threading
+
+from cache_backend import SQLiteBackend, open_cache
+
+logger = logging.getLogger(__name__)
+
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", 1024))
+# Optional SQLite file that keeps parse results across restarts; with
+# CACHE_BACKEND=sqlite they already live in the shared cache file
+PARSE_CACHE_PATH = os.getenv("PARSE_CACHE_PATH")
+# Keys include the day, so an entry can't hit after a day anyway
+PARSE_CACHE_TTL = 24 * 60 * 60
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(' ', text).strip().lower()
+
+
+class ParseCache:
+    """
+    An LRU cache of parse results keyed on normalized input text plus today's
+    date, since the prompt resolves relative dates like "tomorrow" against it.
+    Entries from earlier days can never hit again and expire within a day.
+    """
+
+    def __init__(self, maxsize: int = PARSE_CACHE_SIZE, path: str = PARSE_CACHE_PATH, backend=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if backend is None:
+            backend = SQLiteBackend("parse", maxsize, path) if path else open_cache("parse", maxsize)
+        self.backend = backend
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return f"{datetime.date.today().isoformat()}:{normalize_text(text)}"
+
+    def get(self, text: str):
+        """Returns a copy of the cached result for the text, or None."""
+        result = self.backend.get(self._key(text))
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return dict(result)
+
+    def set(self, text: str, result: dict) -> None:
+        self.backend.set(self._key(text), dict(result), PARSE_CACHE_TTL)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            hits, misses = self.hits, self.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "size": len(self.backend),
+        }
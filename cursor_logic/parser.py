@@ -2,7 +2,114 @@ import json
 import datetime
 import os
 import time
-from openai import OpenAI
+import asyncio
+import logging
+import threading
+import weakref
+from cursor_logic.cache import ParseCache
+from ratelimit import get_limiter, RateLimitedTransport, AsyncRateLimitedTransport
+from metrics import register_collector
+from cursor_logic import rules
+
+logger = logging.getLogger(__name__)
+
+# "completion" makes one structured-output request per task; "assistant"
+# keeps the original OpenAI Assistant flow.
+OPENAI_PARSER_MODE = os.getenv("OPENAI_PARSER_MODE", "completion")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+# Assistant runs are polled starting at POLL_INITIAL_DELAY seconds, growing
+# by POLL_BACKOFF up to POLL_MAX_DELAY, instead of a fixed one-second sleep
+POLL_INITIAL_DELAY = 0.05
+POLL_BACKOFF = 1.5
+POLL_MAX_DELAY = 1.0
+
+# Limits for the async parser: how many LLM calls may be in flight at once
+# and how long a single parse may take, including time spent queued
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 4))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 20))
+
+class ParseError(Exception):
+    """Raised when a task could not be parsed."""
+
+class ParseTimeoutError(ParseError):
+    """Raised when parsing did not finish within its deadline."""
+
+TASK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "due_date": {"type": ["string", "null"]},
+        "priority": {"type": "integer"},
+        "project": {"type": ["string", "null"]},
+        "section": {"type": ["string", "null"]},
+    },
+    "required": ["title", "due_date", "priority", "project", "section"],
+    "additionalProperties": False,
+}
+
+PARSE_CACHE = ParseCache()
+
+def _collect():
+    stats = PARSE_CACHE.stats()
+    yield "bot_parse_cache_hits_total", "counter", "Parse cache hits.", [({}, stats["hits"])]
+    yield "bot_parse_cache_misses_total", "counter", "Parse cache misses.", [({}, stats["misses"])]
+    yield "bot_parse_cache_entries", "gauge", "Parse results held in memory.", [({}, stats["size"])]
+
+register_collector(_collect)
+
+_client = None
+_client_lock = threading.Lock()
+
+def _rate_limited(http_client, transport_class, api_key: str):
+    """
+    Routes an SDK http client through the shared OpenAI rate limiter. The
+    limiter's transport takes over retries, honoring Retry-After. A chat
+    completion has no side effects, so it is always retried; Assistant
+    requests that create threads or runs are not, so a retry can't bill twice.
+    """
+    http_client._transport = transport_class(
+        http_client._transport, get_limiter("openai", api_key), retry_paths=("/chat/completions",)
+    )
+    return http_client
+
+def get_client(api_key: str) -> "OpenAI":
+    """Returns the shared OpenAI client, so connections are reused across parses."""
+    global _client
+    with _client_lock:
+        if _client is None or _client.api_key != api_key:
+            # The SDK is slow to import, so it is loaded on the first parse that needs it
+            from openai import OpenAI, DefaultHttpxClient
+            _client = OpenAI(
+                api_key=api_key,
+                max_retries=0,
+                http_client=_rate_limited(DefaultHttpxClient(), RateLimitedTransport, api_key),
+            )
+        return _client
+
+# Async clients and semaphores are bound to the event loop that uses them
+_async_state = weakref.WeakKeyDictionary()
+# Keeps fire-and-forget run cancellations alive until they finish
+_background_tasks = set()
+
+def _get_async_state(api_key: str):
+    loop = asyncio.get_running_loop()
+    state = _async_state.get(loop)
+    if state is None or state[0].api_key != api_key:
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=_rate_limited(DefaultAsyncHttpxClient(), AsyncRateLimitedTransport, api_key),
+        )
+        state = _async_state[loop] = (client, asyncio.Semaphore(OPENAI_MAX_CONCURRENCY))
+    return state
+
+def _load_json(message: str):
+    """Decodes the model's JSON reply, tolerating a ```json fence."""
+    if message.startswith("```json"):
+        message = message.strip("```json\n").strip("```")
+    return json.loads(message)
 
 def get_ai_prompt(text: str) -> str:
     """
@@ -40,6 +147,30 @@ def get_ai_prompt(text: str) -> str:
     """
     return prompt
 
+def parse_task_with_completion(text: str):
+    """
+    Parses the task string with a single structured-output chat completion,
+    using the same prompt as the Assistant.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        logger.error("OPENAI_API_KEY not set in .env file.")
+        return None
+
+    try:
+        response = get_client(api_key).chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": get_ai_prompt(text)}],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "task", "schema": TASK_SCHEMA, "strict": True},
+            },
+        )
+        return _load_json(response.choices[0].message.content)
+    except Exception as e:
+        logger.error(f"An error occurred with the OpenAI API: {e}", exc_info=True)
+        return None
+
 def parse_task_with_openai_assistant(text: str):
     """
     Uses an OpenAI Assistant to parse the task string.
@@ -48,47 +179,146 @@ def parse_task_with_openai_assistant(text: str):
     assistant_id = os.getenv("OPENAI_ASSISTANT_ID")
 
     if not api_key or not assistant_id:
-        print("Error: OPENAI_API_KEY or OPENAI_ASSISTANT_ID not set in .env file.")
+        logger.error("OPENAI_API_KEY or OPENAI_ASSISTANT_ID not set in .env file.")
         return None
 
-    client = OpenAI(api_key=api_key)
+    client = get_client(api_key)
 
     try:
-        thread = client.beta.threads.create()
-
-        client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=text
-        )
-
-        run = client.beta.threads.runs.create(
-            thread_id=thread.id,
+        # Creates the thread, adds the message and starts the run in one request
+        run = client.beta.threads.create_and_run(
             assistant_id=assistant_id,
+            thread={"messages": [{"role": "user", "content": text}]},
         )
 
+        delay = POLL_INITIAL_DELAY
         while run.status in ['queued', 'in_progress', 'cancelling']:
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+            time.sleep(delay)
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+            run = client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id)
 
         if run.status == 'completed':
-            messages = client.beta.threads.messages.list(thread_id=thread.id)
-            assistant_message = messages.data[0].content[0].text.value
-            
-            if assistant_message.startswith("```json"):
-                assistant_message = assistant_message.strip("```json\n").strip("```")
-
-            return json.loads(assistant_message)
+            messages = client.beta.threads.messages.list(thread_id=run.thread_id, limit=1)
+            return _load_json(messages.data[0].content[0].text.value)
         else:
-            print(f"OpenAI run failed with status: {run.status}")
+            logger.error(f"OpenAI run failed with status: {run.status}")
             return None
 
     except Exception as e:
-        print(f"An error occurred with the OpenAI API: {e}")
+        logger.error(f"An error occurred with the OpenAI API: {e}", exc_info=True)
         return None
 
+def _validate(result) -> dict:
+    if not isinstance(result, dict) or not result.get("title"):
+        raise ParseError(f"Unexpected parse result: {result!r}")
+    return result
+
+async def _parse_with_completion_async(client: "AsyncOpenAI", text: str) -> dict:
+    response = await client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=[{"role": "user", "content": get_ai_prompt(text)}],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "task", "schema": TASK_SCHEMA, "strict": True},
+        },
+    )
+    return _load_json(response.choices[0].message.content)
+
+async def _cancel_run(client: "AsyncOpenAI", thread_id: str, run_id: str) -> None:
+    try:
+        await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        logger.info(f"Cancelled timed-out OpenAI run {run_id}.")
+    except Exception as e:
+        logger.warning(f"Failed to cancel OpenAI run {run_id}: {e}")
+
+async def _parse_with_assistant_async(client: "AsyncOpenAI", assistant_id: str, text: str) -> dict:
+    run = await client.beta.threads.create_and_run(
+        assistant_id=assistant_id,
+        thread={"messages": [{"role": "user", "content": text}]},
+    )
+    try:
+        delay = POLL_INITIAL_DELAY
+        while run.status in ['queued', 'in_progress', 'cancelling']:
+            await asyncio.sleep(delay)
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+            run = await client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id)
+    except asyncio.CancelledError:
+        # Stop the run server-side too, without holding up the caller
+        task = asyncio.create_task(_cancel_run(client, run.thread_id, run.id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        raise
+
+    if run.status != 'completed':
+        raise ParseError(f"OpenAI run failed with status: {run.status}")
+    messages = await client.beta.threads.messages.list(thread_id=run.thread_id, limit=1)
+    return _load_json(messages.data[0].content[0].text.value)
+
+async def parse_task_with_ai_async(text: str, timeout: float = None) -> dict:
+    """
+    Parses a task string without blocking the event loop. Raises
+    ParseTimeoutError if no result arrives within `timeout` seconds
+    (OPENAI_TIMEOUT by default) and ParseError for any other failure.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    assistant_id = os.getenv("OPENAI_ASSISTANT_ID")
+    if not api_key:
+        raise ParseError("OPENAI_API_KEY not set in .env file.")
+    if OPENAI_PARSER_MODE == "assistant" and not assistant_id:
+        raise ParseError("OPENAI_ASSISTANT_ID not set in .env file.")
+
+    client, semaphore = _get_async_state(api_key)
+
+    async def parse():
+        async with semaphore:
+            if OPENAI_PARSER_MODE == "assistant":
+                return await _parse_with_assistant_async(client, assistant_id, text)
+            return await _parse_with_completion_async(client, text)
+
+    cached = PARSE_CACHE.get(text)
+    if cached is not None:
+        return cached
+
+    try:
+        result = _validate(await asyncio.wait_for(parse(), timeout or OPENAI_TIMEOUT))
+        PARSE_CACHE.set(text, result)
+        return result
+    except asyncio.TimeoutError:
+        raise ParseTimeoutError(f"Parsing timed out after {timeout or OPENAI_TIMEOUT}s") from None
+    except ParseError:
+        raise
+    except Exception as e:
+        raise ParseError(f"An error occurred with the OpenAI API: {e}") from e
+
 def parse_task_with_ai(text: str):
     """
     Parses a task string using an AI model and returns a structured dictionary.
+    Results are cached per normalized text and day.
     """
-    return parse_task_with_openai_assistant(text) 
\ No newline at end of file
+    cached = PARSE_CACHE.get(text)
+    if cached is not None:
+        return cached
+    if OPENAI_PARSER_MODE == "assistant":
+        result = parse_task_with_openai_assistant(text)
+    else:
+        result = parse_task_with_completion(text)
+    if result:
+        PARSE_CACHE.set(text, result)
+    return result
+
+def parse_task(text: str, mappings: dict = None):
+    """
+    Parses a task string with the local rules when they are confident enough,
+    and with the AI model otherwise.
+    """
+    result, confidence = rules.parse_task_locally(text, mappings)
+    if confidence >= rules.LOCAL_PARSE_THRESHOLD:
+        return result
+    return parse_task_with_ai(text)
+
+async def parse_task_async(text: str, mappings: dict = None, timeout: float = None) -> dict:
+    """The async counterpart of parse_task; raises like parse_task_with_ai_async."""
+    result, confidence = rules.parse_task_locally(text, mappings)
+    if confidence >= rules.LOCAL_PARSE_THRESHOLD:
+        return result
+    return await parse_task_with_ai_async(text, timeout)
@@ -0,0 +1,143 @@
+import os
+import re
+import datetime
+
+from config.loader import find_project_section
+
+# Inputs scoring below this go to the LLM instead
+LOCAL_PARSE_THRESHOLD = float(os.getenv("LOCAL_PARSE_THRESHOLD", 0.8))
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_ABBREVIATION_PATTERN = "|".join(day[:3] for day in WEEKDAYS)
+_DATE_LEAD = r"(?:\b(?:by|on|due|for)\s+)?"
+
+# Todoist's "p1" is the most urgent, which the API calls priority 4
+_PRIORITY_PATTERNS = [
+    (re.compile(r"\bp([1-4])\b", re.I), lambda m: 5 - int(m.group(1))),
+    (re.compile(r",?\s*\b(?:urgent|asap|urgently)\b", re.I), lambda m: 4),
+    (re.compile(r",?\s*\bhigh priority\b", re.I), lambda m: 3),
+    (re.compile(r",?\s*\bmedium priority\b", re.I), lambda m: 2),
+    (re.compile(r",?\s*\blow priority\b", re.I), lambda m: 1),
+]
+
+_ISO_DATE = re.compile(_DATE_LEAD + r"\b(\d{4}-\d{2}-\d{2})\b", re.I)
+_RELATIVE_DAY = re.compile(_DATE_LEAD + r"\b(today|tonight|tomorrow|tmrw|day after tomorrow)\b", re.I)
+_IN_N = re.compile(_DATE_LEAD + r"\bin\s+(\d+|a|one|two|three)\s+(day|week)s?\b", re.I)
+_WEEKDAY = re.compile(_DATE_LEAD + r"\b(?:(this|next)\s+)?(" + "|".join(WEEKDAYS) + r")\b", re.I)
+# "sun", "sat" and "wed" are words too ("buy sun cream"), so an abbreviation is
+# only a date after "on/by/due" or with a trailing period
+_WEEKDAY_ABBREVIATIONS = [
+    re.compile(r"\b(?:by|on|due)\s+(?:(this|next)\s+)?(" + _ABBREVIATION_PATTERN + r")\b\.?", re.I),
+    re.compile(_DATE_LEAD + r"\b(?:(this|next)\s+)?(" + _ABBREVIATION_PATTERN + r")\.", re.I),
+]
+_NEXT_WEEK = re.compile(_DATE_LEAD + r"\bnext week\b", re.I)
+
+# Phrases the rules don't understand; their presence means the LLM should decide
+_HARD_PHRASES = re.compile(
+    r"\b(every|each|daily|weekly|monthly|until|before|after|end of|next month|next year|"
+    r"january|february|march|april|june|july|august|september|october|november|december|"
+    r"\d{1,2}(?::\d{2})?\s*(?:am|pm)|noon|midnight|morning|evening|afternoon)\b",
+    re.I,
+)
+_NUMBER_WORDS = {"a": 1, "one": 1, "two": 2, "three": 3}
+
+
+def _weekday_date(today: datetime.date, name: str, qualifier: str) -> datetime.date:
+    target = next(i for i, day in enumerate(WEEKDAYS) if day.startswith(name.lower()[:3]))
+    days_ahead = (target - today.weekday()) % 7 or 7
+    if qualifier and qualifier.lower() == "next" and today.weekday() + days_ahead < 7:
+        # "next friday" said on a Monday means the Friday of next week
+        days_ahead += 7
+    return today + datetime.timedelta(days=days_ahead)
+
+
+def _extract_due_date(text: str, today: datetime.date):
+    """Returns (due_date, text without the date phrase)."""
+    match = _ISO_DATE.search(text)
+    if match:
+        return datetime.date.fromisoformat(match.group(1)), _cut(text, match)
+    match = _RELATIVE_DAY.search(text)
+    if match:
+        word = match.group(1).lower()
+        offset = {"today": 0, "tonight": 0, "tomorrow": 1, "tmrw": 1}.get(word, 2)
+        return today + datetime.timedelta(days=offset), _cut(text, match)
+    match = _IN_N.search(text)
+    if match:
+        count = _NUMBER_WORDS.get(match.group(1).lower()) or int(match.group(1))
+        days = count * (7 if match.group(2).lower() == "week" else 1)
+        return today + datetime.timedelta(days=days), _cut(text, match)
+    match = _NEXT_WEEK.search(text)
+    if match:
+        return _weekday_date(today, "monday", None), _cut(text, match)
+    for pattern in [_WEEKDAY] + _WEEKDAY_ABBREVIATIONS:
+        match = pattern.search(text)
+        if match:
+            return _weekday_date(today, match.group(2), match.group(1)), _cut(text, match)
+    return None, text
+
+
+def _cut(text: str, match) -> str:
+    return text[:match.start()] + " " + text[match.end():]
+
+
+def _clean_title(text: str) -> str:
+    title = re.sub(r"\s+", " ", text).strip(" ,-;:")
+    # A cut-out phrase leaves a space before the punctuation that followed it
+    title = re.sub(r" ([,;:.!?])", r"\1", title)
+    return title[:1].upper() + title[1:]
+
+
+def parse_task_locally(text: str, mappings: dict = None, today: datetime.date = None):
+    """
+    Parses simple task messages without the LLM. Returns (result, confidence),
+    where result has the same keys as parse_task_with_ai and confidence runs
+    from 0 (leave it to the LLM) to 1.
+    """
+    today = today or datetime.date.today()
+    confidence = 1.0
+
+    priorities = []
+    remaining = text
+    for pattern, value in _PRIORITY_PATTERNS:
+        match = pattern.search(remaining)
+        while match:
+            priorities.append(value(match))
+            remaining = _cut(remaining, match)
+            match = pattern.search(remaining)
+    priority = priorities[0] if priorities else 1
+    if len(set(priorities)) > 1:
+        # Conflicting priorities, e.g. "urgent, low priority"
+        confidence -= 0.5
+
+    try:
+        due_date, remaining = _extract_due_date(remaining, today)
+        if _extract_due_date(remaining, today)[0] is not None:
+            # Two date phrases, e.g. "move friday's meeting to monday"
+            confidence -= 0.5
+    except ValueError:
+        # A well-formed but impossible date, e.g. "2026-02-30"
+        due_date, confidence = None, 0.0
+    if _HARD_PHRASES.search(remaining):
+        confidence -= 0.5
+
+    title = _clean_title(remaining)
+    words = len(title.split())
+    if not words:
+        confidence = 0.0
+    elif words > 12:
+        confidence -= 0.3
+
+    project, section = None, None
+    if mappings:
+        project, section = find_project_section(text, mappings)
+        if project == "Inbox":
+            project, section = None, None
+
+    result = {
+        "title": title,
+        "due_date": due_date.isoformat() if due_date else None,
+        "priority": priority,
+        "project": project,
+        "section": section,
+    }
+    return result, max(confidence, 0.0)
@@ -1,14 +1,20 @@
 import os
+import hmac
+import json
+import time
 import asyncio
 import logging
 from http import HTTPStatus
 
-from asgiref.wsgi import WsgiToAsgi
-from flask import Flask, request, Response
+_import_started = time.perf_counter()
+
+# Only what the webhook path needs is imported here. The telegram stack,
+# the Todoist SDK and Flask are imported when the application is built at
+# startup, or on the first non-webhook request; see benchmarks/cold_start.py.
 from dotenv import load_dotenv
-from telegram import Update
-from telegram.ext import Application, CommandHandler
-from telegram_bot.handlers import start, help_command, add_task_handler, complete_task_handler
+from telegram_bot.update_queue import UpdateQueue
+from metrics import ErrorCounter, register_collector, render
+from tracing import span
 
 # Set up logging
 logging.basicConfig(
@@ -16,57 +22,232 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+logging.getLogger().addHandler(ErrorCounter())
 
 # Load environment variables
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 PORT = int(os.environ.get('PORT', 8000))
 HOST_URL = os.environ.get('HOST_URL')
+# Optional shared secret Telegram echoes in the X-Telegram-Bot-Api-Secret-Token header
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+MAX_UPDATE_BYTES = 1024 * 1024
+# Points the bot at another Bot API server, e.g. a local stub in load tests
+TELEGRAM_BASE_URL = os.environ.get('TELEGRAM_BASE_URL')
+
+_application = None
+_flask_asgi = None
+
+def get_application():
+    """Builds the Telegram bot application and its handlers on first use."""
+    global _application
+    if _application is None:
+        from telegram.ext import Application, CommandHandler
+        from telegram_bot.handlers import (
+            start, help_command, add_task_handler, complete_task_handler, connect_handler, disconnect_handler,
+        )
+        from telegram_bot.request import RateLimitedRequest
+
+        request = RateLimitedRequest(TELEGRAM_BOT_TOKEN)
+        # The webhook never calls getUpdates, so it doesn't get an HTTP client of its own
+        builder = Application.builder().token(TELEGRAM_BOT_TOKEN).request(request).get_updates_request(request)
+        if TELEGRAM_BASE_URL:
+            builder = builder.base_url(f"{TELEGRAM_BASE_URL.rstrip('/')}/bot")
+        application = builder.build()
+        application.add_handler(CommandHandler("start", start))
+        application.add_handler(CommandHandler("help", help_command))
+        application.add_handler(CommandHandler("add", add_task_handler))
+        application.add_handler(CommandHandler("complete", complete_task_handler))
+        application.add_handler(CommandHandler("connect", connect_handler))
+        application.add_handler(CommandHandler("disconnect", disconnect_handler))
+        _application = application
+    return _application
 
-# Set up the Telegram bot application
-application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+def __getattr__(name):
+    # Keeps `main.application` working without building it at import time
+    if name == "application":
+        return get_application()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Add command handlers
-application.add_handler(CommandHandler("start", start))
-application.add_handler(CommandHandler("help", help_command))
-application.add_handler(CommandHandler("add", add_task_handler))
-application.add_handler(CommandHandler("complete", complete_task_handler))
+def get_flask_asgi():
+    """Builds the Flask app for the non-webhook routes, wrapped for ASGI, on first use."""
+    global _flask_asgi
+    if _flask_asgi is None:
+        from asgiref.wsgi import WsgiToAsgi
+        from flask import Flask
 
-# Set up the Flask app and wrap it for ASGI compatibility
-flask_app = Flask(__name__)
-app = WsgiToAsgi(flask_app)
+        flask_app = Flask(__name__)
+        flask_app.add_url_rule('/', view_func=index)
+        flask_app.add_url_rule('/metrics', view_func=metrics)
+        _flask_asgi = WsgiToAsgi(flask_app)
+    return _flask_asgi
+
+async def process_update(update_data: dict) -> None:
+    """Decodes a queued webhook payload and runs it through the bot's handlers."""
+    from telegram import Update
+
+    application = get_application()
+    update = Update.de_json(update_data, application.bot)
+    with span("process_update"):
+        await application.process_update(update)
 
-@flask_app.before_request
-async def initialize_bot():
-    """Initialize the bot before handling a request."""
-    await application.initialize()
+update_queue = UpdateQueue(process_update)
+
+def collect_queue_metrics():
+    stats = update_queue.stats()
+    yield "bot_update_queue_depth", "gauge", "Updates waiting to be processed.", [({}, stats["depth"])]
+    yield "bot_update_queue_busy", "gauge", "Updates being processed.", [({}, stats["busy"])]
+    yield "bot_update_queue_max_wait_seconds", "gauge", "Longest time an update waited in the queue.", [({}, stats["max_wait_seconds"])]
+    yield "bot_updates_total", "counter", "Webhook updates by outcome.", [
+        ({"outcome": outcome}, stats[outcome]) for outcome in ("enqueued", "duplicates", "rejected", "throttled", "processed", "failed")
+    ]
+    from todoist.journal import TODOIST_WRITE_BEHIND, get_journal
+
+    if TODOIST_WRITE_BEHIND:
+        journal = get_journal().stats()
+        yield "bot_write_behind_pending", "gauge", "Journaled tasks not yet in Todoist.", [({}, journal["pending"])]
+        yield "bot_write_behind_parked", "gauge", "Journaled tasks that ran out of attempts.", [({}, journal["parked"])]
+
+register_collector(collect_queue_metrics)
+
+async def startup():
+    """Initializes the bot and its dependencies once per worker."""
     if not HOST_URL:
         raise ValueError("HOST_URL environment variable not set.")
-    webhook_info = await application.bot.get_webhook_info()
-    webhook_url = f"{HOST_URL}/webhook"
-    if webhook_info.url != webhook_url:
-        await application.bot.set_webhook(url=webhook_url)
-        logger.info(f"Webhook set to {webhook_url}")
-
-@flask_app.route('/webhook', methods=['POST'])
-async def webhook() -> Response:
-    """Handle incoming Telegram updates."""
+    started = time.perf_counter()
+    application = get_application()
+    from telegram_bot.handlers import TODOIST_API_TOKEN, PROJECT_MAPPINGS
+    from todoist.api_async import sync_task_mirror
+    from todoist.client import prewarm
+    from todoist.journal import TODOIST_WRITE_BEHIND, get_flusher
+    built = time.perf_counter()
+
+    async def set_up_webhook():
+        await application.initialize()
+        webhook_url = f"{HOST_URL}/webhook"
+        # getWebhookInfo doesn't report the secret, so a webhook registered
+        # before WEBHOOK_SECRET was set would never receive it
+        if WEBHOOK_SECRET:
+            await application.bot.set_webhook(url=webhook_url, secret_token=WEBHOOK_SECRET)
+            logger.info(f"Webhook set to {webhook_url} with a secret token")
+            return
+        webhook_info = await application.bot.get_webhook_info()
+        if webhook_info.url != webhook_url:
+            await application.bot.set_webhook(url=webhook_url, secret_token=WEBHOOK_SECRET)
+            logger.info(f"Webhook set to {webhook_url}")
+        else:
+            logger.info(f"Webhook already set to {webhook_url}")
+
+    # The Telegram and Todoist round trips don't depend on each other
+    if TODOIST_API_TOKEN:
+        await asyncio.gather(set_up_webhook(), sync_task_mirror(TODOIST_API_TOKEN), prewarm(TODOIST_API_TOKEN))
+    else:
+        await set_up_webhook()
+    PROJECT_MAPPINGS.start_watching()
+    if TODOIST_WRITE_BEHIND:
+        get_flusher().start()
+    await update_queue.start()
+    logger.info(
+        f"Cold start: imports {(started - _import_started) * 1000:.0f} ms, "
+        f"application build {(built - started) * 1000:.0f} ms, "
+        f"initialization {(time.perf_counter() - built) * 1000:.0f} ms."
+    )
+
+async def shutdown():
+    """Releases the bot's resources when the worker stops."""
+    from telegram_bot.handlers import PROJECT_MAPPINGS
+    from todoist.client import close_all_async
+    from todoist.journal import TODOIST_WRITE_BEHIND, get_flusher
+
+    await update_queue.drain()
+    if TODOIST_WRITE_BEHIND:
+        # Anything not yet flushed stays journaled for the next start
+        await get_flusher().stop()
+    PROJECT_MAPPINGS.stop_watching()
+    await get_application().shutdown()
+    await close_all_async()
+
+async def lifespan(receive, send):
+    """Runs startup/shutdown from the ASGI server's lifespan events."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                logger.error(f"Error starting bot: {e}", exc_info=True)
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def send_status(send, status: HTTPStatus) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-length", b"0")]})
+    await send({"type": "http.response.body", "body": b""})
+
+async def webhook(scope, receive, send) -> None:
+    """
+    Handle incoming Telegram updates: validate, enqueue and acknowledge.
+    The update is processed in the background so Telegram never waits on
+    Todoist or OpenAI, and a slow update is not redelivered.
+    """
+    if WEBHOOK_SECRET:
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-telegram-bot-api-secret-token", b"")
+        if not hmac.compare_digest(token, WEBHOOK_SECRET.encode()):
+            await send_status(send, HTTPStatus.FORBIDDEN)
+            return
+
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_UPDATE_BYTES:
+            await send_status(send, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+        if not message.get("more_body"):
+            break
+
     try:
-        update_data = request.get_json(force=True)
-        update = Update.de_json(update_data, application.bot)
-        await application.process_update(update)
-        return Response(status=HTTPStatus.OK)
-    except Exception as e:
-        logger.error(f"Error processing update: {e}", exc_info=True)
-        return Response(status=HTTPStatus.INTERNAL_SERVER_ERROR)
+        update_data = json.loads(body)
+    except ValueError:
+        update_data = None
+    if not isinstance(update_data, dict) or not isinstance(update_data.get("update_id"), int):
+        logger.warning("Rejected malformed webhook payload.")
+        await send_status(send, HTTPStatus.BAD_REQUEST)
+        return
+
+    if not update_queue.put(update_data):
+        # Telegram retries non-2xx responses, which gives the consumers time to catch up
+        await send_status(send, HTTPStatus.SERVICE_UNAVAILABLE)
+        return
+    await send_status(send, HTTPStatus.OK)
+
+async def app(scope, receive, send):
+    """The ASGI entry point: lifespan events and the webhook here, other routes to Flask."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/webhook" and scope["method"] == "POST":
+        await webhook(scope, receive, send)
+    else:
+        await get_flask_asgi()(scope, receive, send)
 
-@flask_app.route('/')
 def index():
-    """A simple endpoint to confirm the server is running."""
+    """A liveness probe: confirms the server is running without any network I/O."""
     return "Bot is running!"
 
+def metrics():
+    """Prometheus metrics for handlers, upstream calls, caches and queues."""
+    from flask import Response
+
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == '__main__':
     # This block is for local development and won't be used by a production server like Gunicorn.
-    # For production, Gunicorn or another WSGI/ASGI server will import the `app` object.
+    # For production, Gunicorn or another ASGI server will import the `app` object.
+    import uvicorn
     logger.info(f"Starting bot locally on port {PORT}...")
-    flask_app.run(debug=True, host='0.0.0.0', port=PORT) 
\ No newline at end of file
+    uvicorn.run(app, host='0.0.0.0', port=PORT) 
\ No newline at end of file
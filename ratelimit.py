@@ -0,0 +1,328 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import email.utils
+
+import httpx
+
+from metrics import UPSTREAM_LATENCY, register_collector
+from tracing import record
+
+logger = logging.getLogger(__name__)
+
+# "<requests per second>,<burst>" per upstream, applied per API token
+RATE_LIMITS = {
+    # Todoist allows 1000 requests per user per 15 minutes
+    "todoist": os.getenv("TODOIST_RATE_LIMIT", "1.1,100"),
+    # Telegram allows about 30 messages per second per bot
+    "telegram": os.getenv("TELEGRAM_RATE_LIMIT", "30,30"),
+    "openai": os.getenv("OPENAI_RATE_LIMIT", "8,50"),
+}
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", 3))
+BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", 30))
+# A longer Retry-After is not waited out in-request; the response is returned
+# as is, and the bucket is paused for at most this long
+RETRY_AFTER_MAX = float(os.getenv("RATE_LIMIT_RETRY_AFTER_MAX", 60))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {429, 502, 503, 504}
+# Failures where the request never reached the upstream, so any method can be retried
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class TokenBucket:
+    """
+    A token bucket shared by threads and asyncio tasks. Callers reserve a
+    token and then wait out their place in line, so waiters are served in
+    arrival order and nobody spins. pause() stops the bucket until a
+    Retry-After deadline has passed.
+    """
+
+    def __init__(self, rate: float, burst: int, name: str = "", upstream: str = ""):
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self.upstream = upstream
+        self.acquired = 0
+        self.waited = 0
+        self.throttled = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token, possibly on credit, and returns how long to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, self._paused_until - now, 0.0)
+            self.acquired += 1
+            if wait > 0:
+                self.waited += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def acquire(self) -> float:
+        """Blocks until a request may go out; returns the time spent waiting."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Holds every caller back for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"Rate limited by {self.name or 'upstream'}, pausing for {seconds:.1f}s.")
+
+    def stats(self) -> dict:
+        """Returns queue wait and throttling counters for logging and metrics."""
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "max_wait_seconds": self.max_wait,
+                "avg_wait_seconds": self.total_wait / self.acquired if self.acquired else 0.0,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(upstream: str, api_token: str) -> TokenBucket:
+    """Returns the process-wide bucket for an upstream and API token."""
+    key = (upstream, api_token)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            rate, burst = RATE_LIMITS[upstream].split(",")
+            name = f"{upstream}:...{str(api_token)[-4:]}"
+            limiter = _limiters[key] = TokenBucket(float(rate), int(burst), name, upstream)
+        return limiter
+
+
+def drop_limiter(limiter: TokenBucket) -> None:
+    """Forgets a bucket, e.g. when the account it belongs to is evicted."""
+    with _limiters_lock:
+        for key in [key for key, value in _limiters.items() if value is limiter]:
+            del _limiters[key]
+
+
+def limiter_stats() -> dict:
+    """Returns stats() for every bucket, keyed by upstream and token suffix."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+def _collect():
+    stats = limiter_stats()
+    for field, metric_type, help in (
+        ("acquired", "counter", "Requests that took a rate-limit token."),
+        ("waited", "counter", "Requests that had to wait for a token."),
+        ("throttled", "counter", "429 responses that paused the bucket."),
+        ("retries", "counter", "Requests retried after a throttled or failed response."),
+        ("max_wait_seconds", "gauge", "Longest wait for a token."),
+        ("avg_wait_seconds", "gauge", "Average wait for a token."),
+    ):
+        name = f"bot_rate_limit_{field}" + ("_total" if metric_type == "counter" else "")
+        yield name, metric_type, help, [({"limiter": limiter}, values[field]) for limiter, values in stats.items()]
+
+
+register_collector(_collect)
+
+
+# Path segments following one of these are resource IDs; Todoist IDs don't
+# always contain a digit, so they can't be told apart by their characters
+_ID_COLLECTIONS = {"tasks", "projects", "sections", "comments", "labels", "threads", "runs", "messages", "assistants"}
+
+
+def endpoint_label(path: str) -> str:
+    """Collapses IDs (and tokens) in a URL path so it can be used as a metric label."""
+    segments = path.split("/")
+    return "/".join(
+        ":id" if (index and segments[index - 1] in _ID_COLLECTIONS and segment)
+        or (len(segment) > 4 and any(char.isdigit() for char in segment)) else segment
+        for index, segment in enumerate(segments)
+    )
+
+
+def parse_retry_after(value):
+    """Reads a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_delay(limiter: TokenBucket, status: int, retry_after, attempt: int):
+    """
+    Decides how long to wait before retrying a throttled or failed response,
+    or returns None if it shouldn't be retried. A 429 pauses the whole bucket,
+    so other callers stop hitting the upstream too.
+    """
+    if attempt >= RATE_LIMIT_RETRIES:
+        return None
+    if status == 429:
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        # Every caller of the bucket waits out the pause, so a huge Retry-After must not stall them all
+        limiter.pause(min(delay, RETRY_AFTER_MAX))
+        if delay > RETRY_AFTER_MAX:
+            return None
+        # The paused bucket does the waiting; add jitter so retries don't land together
+        return random.uniform(0, BACKOFF_BASE)
+    return retry_after if retry_after is not None else backoff_delay(attempt)
+
+
+class RateLimitedTransport:
+    """
+    Wraps an httpx-style transport: every request first takes a token from
+    the limiter, and throttled or failed responses are retried with jittered
+    exponential backoff, honoring Retry-After. A 429 is always retried, since
+    the upstream did not act on the request; 5xx responses only for
+    idempotent requests and those whose path ends with one of `retry_paths`.
+    Transport errors are retried the same way, except that failures to
+    connect are retried for any request, since it was never sent.
+    """
+
+    def __init__(self, transport, limiter: TokenBucket, retry_paths: tuple = ()):
+        self.transport = transport
+        self.limiter = limiter
+        self.retry_paths = tuple(retry_paths)
+
+    def _observe(self, request, response, start: float, wait: float, attempt: int, error=None) -> None:
+        end = time.monotonic()
+        endpoint = f"{request.method} {endpoint_label(request.url.path)}"
+        status = response.status_code if response is not None else type(error).__name__
+        UPSTREAM_LATENCY.observe(end - start, upstream=self.limiter.upstream, endpoint=endpoint, status=status)
+        record(f"{self.limiter.upstream} {endpoint}", start, end, status=status, attempt=attempt,
+               rate_limit_wait_ms=round(wait * 1000, 3))
+
+    def _retryable(self, request) -> bool:
+        return (request.method in IDEMPOTENT_METHODS or "X-Request-Id" in request.headers
+                or request.url.path.endswith(self.retry_paths))
+
+    def _delay(self, request, response, attempt: int):
+        if response.status_code not in RETRY_STATUSES:
+            return None
+        if response.status_code != 429 and not self._retryable(request):
+            return None
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        return retry_delay(self.limiter, response.status_code, retry_after, attempt)
+
+    def _error_delay(self, request, error: httpx.TransportError, attempt: int):
+        """How long to wait before retrying after a transport error, or None to raise it."""
+        if attempt >= RATE_LIMIT_RETRIES:
+            return None
+        if not isinstance(error, UNSENT_ERRORS) and not self._retryable(request):
+            return None
+        logger.warning(f"{self.limiter.name or 'Upstream'} request failed ({type(error).__name__}), retrying.")
+        return backoff_delay(attempt)
+
+    def handle_request(self, request):
+        attempt = 0
+        while True:
+            wait = self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                self._observe(request, None, start, wait, attempt, e)
+                delay = self._error_delay(request, e, attempt)
+                if delay is None:
+                    raise
+                self.limiter.retries += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._observe(request, response, start, wait, attempt)
+            delay = self._delay(request, response, attempt)
+            if delay is None:
+                return response
+            response.close()
+            self.limiter.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self.transport.close()
+
+    def __enter__(self):
+        self.transport.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.transport.__exit__(*args)
+
+
+class AsyncRateLimitedTransport(RateLimitedTransport):
+    """The asyncio counterpart of RateLimitedTransport."""
+
+    async def handle_async_request(self, request):
+        attempt = 0
+        while True:
+            wait = await self.limiter.acquire_async()
+            start = time.monotonic()
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                self._observe(request, None, start, wait, attempt, e)
+                delay = self._error_delay(request, e, attempt)
+                if delay is None:
+                    raise
+                self.limiter.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._observe(request, response, start, wait, attempt)
+            delay = self._delay(request, response, attempt)
+            if delay is None:
+                return response
+            await response.aclose()
+            self.limiter.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+    async def __aenter__(self):
+        await self.transport.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transport.__aexit__(*args)
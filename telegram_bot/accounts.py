@@ -0,0 +1,70 @@
+import os
+import time
+import sqlite3
+import threading
+
+from token_crypto import BOT_DATA_DIR, make_private_dir, seal_token, unseal_token
+
+# Chats that connect their own Todoist account are served with its token;
+# the others fall back to TODOIST_API_TOKEN, when one is configured
+ACCOUNTS_PATH = os.getenv("TODOIST_ACCOUNTS_PATH", os.path.join(BOT_DATA_DIR, "accounts.db"))
+
+
+class AccountRegistry:
+    """
+    Maps Telegram chats to the Todoist token they connected with /connect.
+    Lookups read the SQLite file directly, so every worker sees a connect or
+    disconnect as soon as it is committed. Tokens are stored sealed.
+    """
+
+    def __init__(self, path: str = ACCOUNTS_PATH):
+        if path != ":memory:":
+            make_private_dir(os.path.dirname(path))
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS accounts (chat_id INTEGER PRIMARY KEY, api_token TEXT, connected REAL)"
+        )
+        self._db.commit()
+
+    def get(self, chat_id: int):
+        """Returns the token connected for a chat, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT api_token FROM accounts WHERE chat_id = ?", (int(chat_id),)).fetchone()
+        return unseal_token(row[0]) if row else None
+
+    def connect(self, chat_id: int, api_token: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)", (int(chat_id), seal_token(api_token), time.time())
+            )
+            self._db.commit()
+
+    def disconnect(self, chat_id: int) -> bool:
+        """Forgets a chat's token; returns whether it had one."""
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM accounts WHERE chat_id = ?", (int(chat_id),))
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_accounts = None
+_accounts_lock = threading.Lock()
+
+
+def get_accounts() -> AccountRegistry:
+    """Returns the process-wide account registry, opening it on first use."""
+    global _accounts
+    with _accounts_lock:
+        if _accounts is None:
+            _accounts = AccountRegistry()
+        return _accounts
@@ -1,31 +1,140 @@
 import os
+import re
 import asyncio
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from todoist.api import create_task, find_task_by_content, complete_task
-from config.loader import load_project_mappings, find_project_section
+from todoist.api_async import (
+    create_task, create_tasks, find_task_by_content, find_similar_tasks, complete_task,
+    resolve_tasks, find_tasks_in, complete_tasks, sync_task_mirror,
+)
+from todoist.journal import TODOIST_WRITE_BEHIND, get_journal, get_flusher
+from telegram_bot.accounts import get_accounts
+from config.loader import ProjectMappingsStore, find_project_section
+from metrics import HANDLER_LATENCY
+from tenants import TENANTS
 
 logger = logging.getLogger(__name__)
 
+# Used for chats that haven't connected their own account with /connect
 TODOIST_API_TOKEN = os.getenv("TODOIST_API_TOKEN")
-PROJECT_MAPPINGS = load_project_mappings()
+PROJECT_MAPPINGS = ProjectMappingsStore()
 
+# Only an exact (normalized) name completes a task; fuzzy matches scoring at
+# least SUGGESTION_THRESHOLD are offered as suggestions, since "call mom"
+# scores well against "Call Tom"
+SUGGESTION_THRESHOLD = 0.3
+
+# "/complete section:Groceries" or "/complete project:Home section:Chores"; the
+# argument must start with a key, so a task name containing "project:" isn't one
+COMPLETE_PATTERN = re.compile(r"(project|section):\s*(.+?)(?=\s+(?:project|section):|$)", re.I)
+COMPLETE_PATTERN_START = re.compile(r"\s*(?:project|section):", re.I)
+
+def _suggestions(matches):
+    """Returns the quoted names of fuzzy matches worth suggesting."""
+    return [f"'{match.content}'" for score, match in matches if score >= SUGGESTION_THRESHOLD]
+
+def _completion_scope(text: str) -> dict:
+    """Returns {"project": ..., "section": ...} when the whole text is key:name pairs, else {}."""
+    if not COMPLETE_PATTERN_START.match(text):
+        return {}
+    return dict((kind.lower(), name.strip()) for kind, name in COMPLETE_PATTERN.findall(text))
+
+def _split_category_hint(text: str):
+    """Splits "<task> - <category hint>"; without a hint the whole text is the hint."""
+    if " - " in text:
+        task_content, category_hint = text.split(" - ", 1)
+        return task_content.strip(), category_hint.strip()
+    return text, text
+
+def _command_lines(update: Update):
+    """Returns the non-empty lines of a command message, without the command itself."""
+    lines = (update.message.text or "").split("\n")
+    first = lines[0].split(maxsplit=1)
+    lines[0] = first[1] if len(first) > 1 else ""
+    return [line.strip() for line in lines if line.strip()]
+
+def _api_token(update: Update):
+    """Returns the Todoist token for the chat: its connected account, else the default one."""
+    return get_accounts().get(update.effective_chat.id) or TODOIST_API_TOKEN
+
+async def _reply_not_connected(update: Update) -> None:
+    await update.message.reply_text(
+        "Connect your Todoist account first: /connect <API token> "
+        "(find it in Todoist under Settings > Integrations > Developer)."
+    )
+
+async def _journal_tasks(api_token: str, entries) -> None:
+    """Queues (content, project_name, section_name) entries for the write-behind flusher."""
+    # The journal fsyncs each commit, which shouldn't stall the event loop
+    await asyncio.to_thread(lambda: get_journal().append_many(api_token, entries))
+    get_flusher().wake()
+
+@HANDLER_LATENCY.time(handler="start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message when the /start command is issued."""
     await update.message.reply_html(
         "Welcome to the Todoist Bot! Add tasks by sending a message. Use /help for more commands."
     )
 
+@HANDLER_LATENCY.time(handler="help")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a message with the list of available commands."""
     await update.message.reply_text(
         "Available commands:\n"
-        "/add <task> - Add a new task\n"
-        "/complete <task> - Complete a task\n"
+        "/add <task> - Add a new task (one per line to add several)\n"
+        "/complete <task> - Complete a task (comma-separated or one per line for several, "
+        "or section:<name> / project:<name> for all of them)\n"
+        "/connect <API token> - Use your own Todoist account in this chat\n"
+        "/disconnect - Stop using your Todoist account in this chat\n"
         "/help - Show this help message"
     )
 
+@HANDLER_LATENCY.time(handler="connect")
+async def connect_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Connects the chat to a Todoist account by its API token."""
+    if len(context.args) != 1:
+        await update.message.reply_text("Please provide your Todoist API token. Usage: /connect <API token>")
+        return
+    api_token = context.args[0]
+    chat = update.effective_chat
+    logger.info(f"Received /connect command for chat {chat.id}.")
+
+    # The token shouldn't stay readable in the chat history
+    try:
+        await update.message.delete()
+    except Exception as e:
+        logger.warning(f"Could not delete the /connect message in chat {chat.id}: {e}")
+
+    if not await sync_task_mirror(api_token):
+        await chat.send_message("Todoist didn't accept that token. Please check it and try /connect again.")
+        return
+    get_accounts().connect(chat.id, api_token)
+    await chat.send_message("Connected! Tasks from this chat now go to your Todoist account.")
+
+@HANDLER_LATENCY.time(handler="disconnect")
+async def disconnect_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Disconnects the chat from its Todoist account and releases the account's state."""
+    chat_id = update.effective_chat.id
+    api_token = get_accounts().get(chat_id)
+    if api_token is None:
+        await update.message.reply_text("This chat isn't connected to a Todoist account.")
+        return
+    get_accounts().disconnect(chat_id)
+    TENANTS.evict(api_token, "disconnected")
+    dropped = 0
+    if TODOIST_WRITE_BEHIND:
+        # Journaled tasks hold the token too
+        dropped = await asyncio.to_thread(lambda: get_journal().purge(api_token))
+    if dropped:
+        await update.message.reply_text(
+            f"Disconnected. Your Todoist token has been forgotten, along with {dropped} task(s) "
+            "not yet sent to Todoist."
+        )
+    else:
+        await update.message.reply_text("Disconnected. Your Todoist token has been forgotten.")
+
+@HANDLER_LATENCY.time(handler="add")
 async def add_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Adds a new task to Todoist, automatically categorizing it."""
     full_message = " ".join(context.args)
@@ -35,26 +144,33 @@ async def add_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await update.message.reply_text("Please provide a task to add. Usage: /add <task> - <category hint>")
         return
 
+    api_token = _api_token(update)
+    if not api_token:
+        await _reply_not_connected(update)
+        return
+
+    lines = _command_lines(update)
+    if len(lines) > 1:
+        await add_tasks_batch(update, api_token, lines)
+        return
+
     # Parse the message for task content and category hint
-    if " - " in full_message:
-        parts = full_message.split(" - ", 1)
-        task_content = parts[0].strip()
-        category_hint = parts[1].strip()
-    else:
-        task_content = full_message
-        category_hint = full_message
+    task_content, category_hint = _split_category_hint(full_message)
 
     logger.info(f"Task Content: '{task_content}', Category Hint: '{category_hint}'")
 
     try:
         # Find project and section from the hint
-        project_name, section_name = find_project_section(category_hint, PROJECT_MAPPINGS)
+        project_name, section_name = find_project_section(category_hint, PROJECT_MAPPINGS.mappings)
         logger.info(f"Mapped to Project: '{project_name}', Section: '{section_name}'")
 
-        # Running synchronous function in a separate thread
-        task = await asyncio.to_thread(
-            create_task,
-            TODOIST_API_TOKEN,
+        if TODOIST_WRITE_BEHIND:
+            await _journal_tasks(api_token, [(task_content, project_name, section_name)])
+            await update.message.reply_text(f"Task '{task_content}' saved, it will appear in Todoist shortly.")
+            return
+
+        task = await create_task(
+            api_token,
             task_content,
             project_name=project_name,
             section_name=section_name
@@ -69,6 +185,37 @@ async def add_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         logger.error(f"Error in add_task_handler: {e}", exc_info=True)
         await update.message.reply_text(f"An error occurred: {e}")
 
+async def add_tasks_batch(update: Update, api_token: str, lines) -> None:
+    """Adds one task per line with a single batched request and replies with a summary."""
+    logger.info(f"Adding {len(lines)} tasks in one batch.")
+    try:
+        entries = []
+        for line in lines:
+            task_content, category_hint = _split_category_hint(line)
+            project_name, section_name = find_project_section(category_hint, PROJECT_MAPPINGS.mappings)
+            entries.append((task_content, project_name, section_name))
+
+        if TODOIST_WRITE_BEHIND:
+            await _journal_tasks(api_token, entries)
+            await update.message.reply_text(f"Saved {len(entries)} tasks, they will appear in Todoist shortly.")
+            return
+
+        tasks = await create_tasks(api_token, entries)
+
+        summary = []
+        for (task_content, project_name, section_name), task in zip(entries, tasks):
+            location = f"{project_name} / {section_name}" if section_name else project_name
+            if task:
+                summary.append(f"- '{task.content}' added to {location}")
+            else:
+                summary.append(f"- '{task_content}' failed")
+        added = sum(1 for task in tasks if task)
+        await update.message.reply_text(f"Added {added} of {len(entries)} tasks:\n" + "\n".join(summary))
+    except Exception as e:
+        logger.error(f"Error in add_tasks_batch: {e}", exc_info=True)
+        await update.message.reply_text(f"An error occurred: {e}")
+
+@HANDLER_LATENCY.time(handler="complete")
 async def complete_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Completes a task in Todoist."""
     task_content = " ".join(context.args)
@@ -77,12 +224,26 @@ async def complete_task_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("Please provide a task to complete. Usage: /complete <task>")
         return
 
+    api_token = _api_token(update)
+    if not api_token:
+        await _reply_not_connected(update)
+        return
+
+    pattern = _completion_scope(task_content)
+    if pattern:
+        await complete_tasks_matching(update, api_token, pattern.get("project"), pattern.get("section"))
+        return
+    names = [name.strip() for line in _command_lines(update) for name in line.split(",") if name.strip()]
+
     try:
-        # Running synchronous functions in a separate thread
-        task = await asyncio.to_thread(find_task_by_content, TODOIST_API_TOKEN, task_content)
+        # A list is resolved against one snapshot, so the whole-text check mustn't pull its own sync
+        task = await find_task_by_content(api_token, task_content, sync_on_miss=len(names) == 1)
+        if not task and len(names) > 1:
+            await complete_tasks_batch(update, api_token, names)
+            return
         if task:
             logger.info(f"Found task '{task.content}' to complete.")
-            success = await asyncio.to_thread(complete_task, TODOIST_API_TOKEN, task.id)
+            success = await complete_task(api_token, task.id)
             if success:
                 logger.info(f"Task '{task.content}' completed successfully.")
                 await update.message.reply_text(f"Task '{task.content}' completed!")
@@ -91,7 +252,67 @@ async def complete_task_handler(update: Update, context: ContextTypes.DEFAULT_TY
                 await update.message.reply_text(f"Failed to complete task '{task.content}'.")
         else:
             logger.warning(f"Task '{task_content}' not found for completion.")
-            await update.message.reply_text(f"Task '{task_content}' not found.")
+            suggestions = _suggestions(await find_similar_tasks(api_token, task_content))
+            if suggestions:
+                await update.message.reply_text(
+                    f"Task '{task_content}' not found. Did you mean: {', '.join(suggestions)}?"
+                )
+            else:
+                await update.message.reply_text(f"Task '{task_content}' not found.")
     except Exception as e:
         logger.error(f"Error in complete_task_handler: {e}", exc_info=True)
-        await update.message.reply_text(f"An error occurred: {e}") 
\ No newline at end of file
+        await update.message.reply_text(f"An error occurred: {e}")
+
+async def complete_tasks_batch(update: Update, api_token: str, names) -> None:
+    """Completes a list of tasks with one batched request, reporting each name."""
+    logger.info(f"Completing {len(names)} tasks in one batch.")
+    try:
+        resolved = {}
+        suggestions = {}
+        for name, (task, matches) in zip(names, await resolve_tasks(api_token, names)):
+            resolved[name] = task
+            suggestions[name] = _suggestions(matches)
+
+        task_ids = [task.id for task in resolved.values() if task]
+        results = await complete_tasks(api_token, task_ids) if task_ids else {}
+
+        summary = []
+        for name, task in resolved.items():
+            if not task and suggestions[name]:
+                summary.append(f"- '{name}' not found, did you mean: {', '.join(suggestions[name])}?")
+            elif not task:
+                summary.append(f"- '{name}' not found")
+            elif results.get(task.id):
+                summary.append(f"- '{task.content}' failed: {results[task.id]}")
+            else:
+                summary.append(f"- '{task.content}' completed")
+        completed = sum(1 for task in resolved.values() if task and not results.get(task.id))
+        await update.message.reply_text(f"Completed {completed} of {len(resolved)} tasks:\n" + "\n".join(summary))
+    except Exception as e:
+        logger.error(f"Error in complete_tasks_batch: {e}", exc_info=True)
+        await update.message.reply_text(f"An error occurred: {e}")
+
+async def complete_tasks_matching(update: Update, api_token: str, project_name: str = None,
+                                  section_name: str = None) -> None:
+    """Completes every active task in a project and/or section."""
+    where = " / ".join(name for name in (project_name, section_name) if name)
+    logger.info(f"Completing all tasks in '{where}'.")
+    try:
+        tasks = await find_tasks_in(api_token, project_name, section_name)
+        if not tasks:
+            await update.message.reply_text(f"No open tasks found in '{where}'.")
+            return
+
+        results = await complete_tasks(api_token, [task.id for task in tasks])
+
+        summary = [
+            f"- '{task.content}' failed: {results[task.id]}" if results.get(task.id) else f"- '{task.content}' completed"
+            for task in tasks
+        ]
+        completed = sum(1 for task in tasks if not results.get(task.id))
+        await update.message.reply_text(
+            f"Completed {completed} of {len(tasks)} tasks in '{where}':\n" + "\n".join(summary)
+        )
+    except Exception as e:
+        logger.error(f"Error in complete_tasks_matching: {e}", exc_info=True)
+        await update.message.reply_text(f"An error occurred: {e}")
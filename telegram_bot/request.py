@@ -0,0 +1,49 @@
+import json
+import time
+import asyncio
+
+from telegram.request import HTTPXRequest
+from metrics import UPSTREAM_LATENCY
+from ratelimit import get_limiter, retry_delay
+from tracing import record
+
+
+def _retry_after(payload: bytes):
+    """Telegram reports how long to back off in the body, not a header."""
+    try:
+        return float(json.loads(payload)["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class RateLimitedRequest(HTTPXRequest):
+    """
+    Sends Bot API calls through the bot's shared rate limiter and retries
+    429 responses after the retry_after Telegram asks for, so bursts of
+    replies slow down instead of failing.
+    """
+
+    def __init__(self, bot_token: str, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = get_limiter("telegram", bot_token)
+
+    async def do_request(self, url: str, *args, **kwargs):
+        attempt = 0
+        while True:
+            wait = await self.limiter.acquire_async()
+            start = time.monotonic()
+            code, payload = await super().do_request(url, *args, **kwargs)
+            end = time.monotonic()
+            # The URL embeds the bot token; only the Bot API method is recorded
+            method = url.rsplit("/", 1)[-1]
+            UPSTREAM_LATENCY.observe(end - start, upstream="telegram", endpoint=method, status=code)
+            record(f"telegram {method}", start, end, status=code, attempt=attempt,
+                   rate_limit_wait_ms=round(wait * 1000, 3))
+            if code != 429:
+                return code, payload
+            delay = retry_delay(self.limiter, code, _retry_after(payload), attempt)
+            if delay is None:
+                return code, payload
+            self.limiter.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from tracing import trace, record
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 25))
+WEBHOOK_DEDUP_WINDOW = float(os.getenv("WEBHOOK_DEDUP_WINDOW", 3600))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", 10000))
+# Updates one chat may have queued or running, so a flood from one user
+# can't take the whole queue from the others
+WEBHOOK_MAX_PENDING_PER_CHAT = int(os.getenv("WEBHOOK_MAX_PENDING_PER_CHAT", 50))
+
+
+class UpdateDeduplicator:
+    """Remembers recently accepted update_ids, bounded in both time and count."""
+
+    def __init__(self, window: float = WEBHOOK_DEDUP_WINDOW, maxsize: int = WEBHOOK_DEDUP_SIZE):
+        self.window = window
+        self.maxsize = maxsize
+        self._seen = OrderedDict()
+
+    def __contains__(self, update_id) -> bool:
+        self._expire()
+        return update_id in self._seen
+
+    def add(self, update_id) -> None:
+        self._seen[update_id] = time.monotonic()
+        self._seen.move_to_end(update_id)
+        self._expire()
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.window
+        while self._seen:
+            update_id, seen_at = next(iter(self._seen.items()))
+            if seen_at >= cutoff and len(self._seen) <= self.maxsize:
+                break
+            del self._seen[update_id]
+
+
+def chat_key(update_data: dict):
+    """Returns the chat an update belongs to, or None if it has no chat."""
+    for value in update_data.values():
+        if isinstance(value, dict):
+            chat = value.get("chat") or (value.get("message") or {}).get("chat")
+            if chat and "id" in chat:
+                return chat["id"]
+            if "from" in value and "id" in value["from"]:
+                return ("user", value["from"]["id"])
+    return None
+
+
+class UpdateQueue:
+    """
+    A bounded queue between the webhook endpoint and update processing.
+    The webhook only enqueues and returns; a fixed pool of consumer tasks
+    runs `process` on each update. When the queue is full, put() refuses
+    the update so the endpoint can push back on Telegram instead of piling
+    up work.
+
+    Redelivered update_ids are dropped, and updates from the same chat run
+    one at a time in arrival order while different chats run in parallel:
+    a consumer that picks up an update for a busy chat hands it to the
+    consumer already working on that chat and moves on. A chat with
+    `max_per_chat` updates pending has further ones refused, like a full
+    queue, until it catches up.
+    """
+
+    def __init__(self, process, maxsize: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS, key=chat_key,
+                 max_per_chat: int = WEBHOOK_MAX_PENDING_PER_CHAT):
+        self.process = process
+        self.maxsize = maxsize
+        self.workers = workers
+        self.key = key
+        self.max_per_chat = max_per_chat
+        self.deduplicator = UpdateDeduplicator()
+        self._queue = None
+        self._tasks = []
+        self._backlogs = {}
+        self._pending = {}
+        self.enqueued = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+        self.max_wait = 0.0
+        self._total_wait = 0.0
+
+    @property
+    def depth(self) -> int:
+        queued = self._queue.qsize() if self._queue else 0
+        return queued + sum(len(backlog) for backlog in self._backlogs.values())
+
+    async def start(self) -> None:
+        """Starts the consumer tasks on the running event loop."""
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._consume(), name=f"update-consumer-{i}") for i in range(self.workers)]
+        logger.info(f"Started {self.workers} update consumers (queue size {self.maxsize}).")
+
+    def put(self, update) -> bool:
+        """
+        Enqueues an update without waiting. Returns False when the queue is
+        full or its chat has too many updates pending; a duplicate update is
+        acknowledged (True) but not enqueued.
+        """
+        update_id = update.get("update_id")
+        if update_id in self.deduplicator:
+            self.duplicates += 1
+            logger.info(f"Dropping redelivered update {update_id}.")
+            return True
+        key = self.key(update)
+        if key is not None and self._pending.get(key, 0) >= self.max_per_chat:
+            self.throttled += 1
+            logger.warning(f"Chat {key} has {self.max_per_chat} updates pending, rejecting update.")
+            return False
+        try:
+            self._queue.put_nowait((update, time.monotonic()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Update queue full ({self.maxsize}), rejecting update.")
+            return False
+        if key is not None:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        self.deduplicator.add(update_id)
+        self.enqueued += 1
+        return True
+
+    async def _consume(self) -> None:
+        while True:
+            item = await self._queue.get()
+            key = self.key(item[0])
+            if key is None:
+                await self._run(item)
+                continue
+            backlog = self._backlogs.get(key)
+            if backlog is not None:
+                # Another consumer is working on this chat; it will run this next
+                backlog.append(item)
+                continue
+            backlog = self._backlogs[key] = deque()
+            try:
+                await self._run(item)
+                while backlog:
+                    await self._run(backlog.popleft())
+            finally:
+                del self._backlogs[key]
+
+    async def _run(self, item) -> None:
+        update, enqueued_at = item
+        started = time.monotonic()
+        wait = started - enqueued_at
+        self._total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.busy += 1
+        try:
+            # The trace starts at enqueue so a slow update shows its time spent queued
+            with trace("update", start=enqueued_at, update_id=update.get("update_id")):
+                record("queue_wait", enqueued_at, started)
+                await self.process(update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error processing update: {e}", exc_info=True)
+        finally:
+            self.busy -= 1
+            self._release(update)
+            self._queue.task_done()
+
+    def _release(self, update) -> None:
+        key = self.key(update)
+        if key is None:
+            return
+        if self._pending[key] > 1:
+            self._pending[key] -= 1
+        else:
+            del self._pending[key]
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT) -> None:
+        """Waits for queued updates to finish, then stops the consumers."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutting down with {self.depth} unprocessed update(s).")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        """Backpressure metrics for logging and monitoring."""
+        started = self.processed + self.failed + self.busy
+        return {
+            "depth": self.depth,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "busy": self.busy,
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+            "processed": self.processed,
+            "failed": self.failed,
+            "max_wait_seconds": self.max_wait,
+            "avg_wait_seconds": self._total_wait / started if started else 0.0,
+        }
@@ -0,0 +1,162 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Per-account state (caches, task mirrors, connection pools) is kept for at
+# most TENANT_MAX accounts and about TENANT_MEMORY_MB of estimated memory;
+# accounts idle for TENANT_IDLE_TIMEOUT seconds are dropped
+TENANT_MAX = int(os.getenv("TENANT_MAX", 1000))
+TENANT_MEMORY_MB = float(os.getenv("TENANT_MEMORY_MB", 512))
+TENANT_IDLE_TIMEOUT = float(os.getenv("TENANT_IDLE_TIMEOUT", 3600))
+# Accounts used this recently are never evicted, so in-flight requests keep their clients
+TENANT_EVICTION_GRACE = float(os.getenv("TENANT_EVICTION_GRACE", 60))
+TENANT_SWEEP_INTERVAL = 30
+
+
+class _Kind:
+    def __init__(self, factory, size=None, close=None):
+        self.factory = factory
+        self.size = size
+        self.close = close
+
+
+_kinds = {}
+
+
+def register_tenant_state(name: str, factory, size=None, close=None) -> None:
+    """
+    Registers a kind of per-account state. factory(api_token) builds it on
+    first use; size(state) estimates its memory in bytes, and close(state)
+    releases it when the account is evicted.
+    """
+    _kinds[name] = _Kind(factory, size, close)
+
+
+class Tenant:
+    __slots__ = ("api_token", "states", "last_used")
+
+    def __init__(self, api_token: str):
+        self.api_token = api_token
+        self.states = {}
+        self.last_used = time.monotonic()
+
+    def size(self) -> int:
+        return sum(_kinds[name].size(state) for name, state in self.states.items() if _kinds[name].size)
+
+
+class TenantRegistry:
+    """
+    Holds each account's state, least recently used first. Sweeps evict idle
+    accounts, then the least recently used ones while there are too many or
+    their estimated memory is over the cap. An evicted account starts cold
+    on its next request.
+    """
+
+    def __init__(self, max_tenants: int = TENANT_MAX, memory_limit: float = TENANT_MEMORY_MB * 1024 * 1024,
+                 idle_timeout: float = TENANT_IDLE_TIMEOUT, grace: float = TENANT_EVICTION_GRACE):
+        self.max_tenants = max_tenants
+        self.memory_limit = memory_limit
+        self.idle_timeout = idle_timeout
+        self.grace = grace
+        self.evictions = 0
+        self._tenants = OrderedDict()
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+
+    def state(self, name: str, api_token: str):
+        """Returns an account's state of the given kind, building it on first use."""
+        with self._lock:
+            tenant = self._tenants.get(api_token)
+            created = tenant is None
+            if created:
+                tenant = self._tenants[api_token] = Tenant(api_token)
+            else:
+                self._tenants.move_to_end(api_token)
+            tenant.last_used = time.monotonic()
+            state = tenant.states.get(name)
+            if state is None:
+                state = tenant.states[name] = _kinds[name].factory(api_token)
+            if (created and len(self._tenants) > self.max_tenants) or (
+                tenant.last_used - self._last_sweep > TENANT_SWEEP_INTERVAL
+            ):
+                self.sweep()
+            return state
+
+    def states(self, name: str):
+        """Returns every live state of a kind, e.g. for metrics."""
+        with self._lock:
+            return [tenant.states[name] for tenant in self._tenants.values() if name in tenant.states]
+
+    def pop_states(self, name: str):
+        """Removes and returns every live state of a kind, e.g. to close clients on shutdown."""
+        with self._lock:
+            return [tenant.states.pop(name) for tenant in self._tenants.values() if name in tenant.states]
+
+    def sweep(self) -> None:
+        with self._lock:
+            now = self._last_sweep = time.monotonic()
+            evictable = [tenant for tenant in self._tenants.values() if now - tenant.last_used > self.grace]
+            for tenant in evictable:
+                if now - tenant.last_used > self.idle_timeout:
+                    self.evict(tenant.api_token, "idle")
+            for tenant in evictable:
+                if len(self._tenants) <= self.max_tenants:
+                    break
+                if tenant.api_token in self._tenants:
+                    self.evict(tenant.api_token, "count")
+            sizes = {token: tenant.size() for token, tenant in self._tenants.items()}
+            total = sum(sizes.values())
+            for tenant in evictable:
+                if total <= self.memory_limit:
+                    break
+                if tenant.api_token in self._tenants:
+                    total -= sizes[tenant.api_token]
+                    self.evict(tenant.api_token, "memory")
+
+    def evict(self, api_token: str, reason: str = "evicted") -> None:
+        with self._lock:
+            tenant = self._tenants.pop(api_token, None)
+            if tenant is None:
+                return
+            self.evictions += 1
+        for name, state in tenant.states.items():
+            close = _kinds[name].close
+            if close is not None:
+                try:
+                    close(state)
+                except Exception as e:
+                    logger.warning(f"Failed to release {name} for an evicted account: {e}")
+        logger.info(f"Evicted account ...{str(api_token)[-4:]} ({reason}).")
+
+    def stats(self) -> dict:
+        with self._lock:
+            tenants = list(self._tenants.values())
+        return {
+            "tenants": len(tenants),
+            "estimated_bytes": sum(tenant.size() for tenant in tenants),
+            "evictions": self.evictions,
+        }
+
+
+TENANTS = TenantRegistry()
+
+
+def tenant_state(name: str, api_token: str):
+    """Returns an account's state of the given kind from the process-wide registry."""
+    return TENANTS.state(name, api_token)
+
+
+def _collect():
+    stats = TENANTS.stats()
+    yield "bot_tenants", "gauge", "Accounts with state held in memory.", [({}, stats["tenants"])]
+    yield "bot_tenant_estimated_bytes", "gauge", "Estimated memory held for accounts.", [({}, stats["estimated_bytes"])]
+    yield "bot_tenant_evictions_total", "counter", "Accounts evicted from memory.", [({}, stats["evictions"])]
+
+
+register_collector(_collect)
@@ -1,4 +1,9 @@
+import json
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, MagicMock, AsyncMock
 from telegram import Update, Message, User, Chat
 from telegram.ext import ContextTypes
@@ -7,10 +12,33 @@ import asyncio
 from telegram_bot import handlers
 from config.loader import find_project_section
 
+_token_key = patch('token_crypto.TOKEN_ENCRYPTION_KEY', "test-key")
+
+
+def setUpModule():
+    # Stored tokens are sealed; a fixed key keeps tests from writing a key file
+    _token_key.start()
+
+
+def tearDownModule():
+    _token_key.stop()
+
 class TestHandlers(unittest.TestCase):
+    def setUp(self):
+        from telegram_bot.accounts import AccountRegistry
+        self.accounts = AccountRegistry(":memory:")
+        self.addCleanup(self.accounts.close)
+        for target, value in (('telegram_bot.handlers.get_accounts', MagicMock(return_value=self.accounts)),
+                              ('telegram_bot.handlers.TODOIST_API_TOKEN', "test-token")):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def _create_mock_update_context(self, text: str):
         """Helper to create mock Update and Context objects."""
         update = MagicMock(spec=Update)
+        update.effective_chat = MagicMock(spec=Chat, id=42)
+        update.effective_chat.send_message = AsyncMock()
         update.message = MagicMock(spec=Message)
         update.message.from_user = MagicMock(spec=User)
         update.message.chat = MagicMock(spec=Chat)
@@ -41,6 +69,41 @@ class TestHandlers(unittest.TestCase):
             update.message.reply_text.assert_called_once()
         asyncio.run(run())
 
+    @patch('telegram_bot.handlers.TENANTS')
+    @patch('telegram_bot.handlers.create_task')
+    @patch('telegram_bot.handlers.sync_task_mirror', new_callable=AsyncMock, return_value=True)
+    def test_connected_chat_uses_its_own_token(self, mock_sync, mock_create_task, mock_tenants):
+        """/connect stores the chat's token and removes the message; /disconnect falls back to the default."""
+        async def run():
+            update, context = self._create_mock_update_context("/connect chat-token")
+            update.message.delete = AsyncMock()
+            await handlers.connect_handler(update, context)
+            mock_sync.assert_awaited_once_with("chat-token")
+            update.message.delete.assert_awaited_once()
+            self.assertEqual(self.accounts.get(42), "chat-token")
+
+            update, context = self._create_mock_update_context("/add buy milk - Personal")
+            await handlers.add_task_handler(update, context)
+            self.assertEqual(mock_create_task.call_args.args[0], "chat-token")
+
+            update, context = self._create_mock_update_context("/disconnect")
+            await handlers.disconnect_handler(update, context)
+            mock_tenants.evict.assert_called_once_with("chat-token", "disconnected")
+            update, context = self._create_mock_update_context("/add buy milk - Personal")
+            await handlers.add_task_handler(update, context)
+            self.assertEqual(mock_create_task.call_args.args[0], "test-token")
+        asyncio.run(run())
+
+    @patch('telegram_bot.handlers.TODOIST_API_TOKEN', None)
+    @patch('telegram_bot.handlers.create_task')
+    def test_unconnected_chat_is_asked_to_connect(self, mock_create_task):
+        async def run():
+            update, context = self._create_mock_update_context("/add buy milk")
+            await handlers.add_task_handler(update, context)
+            mock_create_task.assert_not_called()
+            self.assertIn("/connect", update.message.reply_text.call_args.args[0])
+        asyncio.run(run())
+
     @patch('telegram_bot.handlers.find_project_section')
     @patch('telegram_bot.handlers.create_task')
     def test_add_task_handler_success(self, mock_create_task, mock_find_project_section):
@@ -53,11 +116,7 @@ class TestHandlers(unittest.TestCase):
             mock_create_task.return_value = mock_task
             mock_find_project_section.return_value = ("Work", "Groceries")
 
-            async def mock_to_thread(func, *args, **kwargs):
-                return func(*args, **kwargs)
-
-            with patch('asyncio.to_thread', new=mock_to_thread):
-                await handlers.add_task_handler(update, context)
+            await handlers.add_task_handler(update, context)
 
             mock_find_project_section.assert_called_once()
             mock_create_task.assert_called_once_with(
@@ -70,6 +129,90 @@ class TestHandlers(unittest.TestCase):
 
         asyncio.run(run())
 
+    @patch('telegram_bot.handlers.create_task')
+    @patch('telegram_bot.handlers.create_tasks')
+    def test_add_task_handler_batches_lines(self, mock_create_tasks, mock_create_task):
+        """A multi-line /add creates every line in one batch and replies once."""
+        async def run():
+            update, context = self._create_mock_update_context("/add buy milk\nfix the bike - garage\n\ncall mom")
+            mock_create_tasks.return_value = [MagicMock(content="buy milk"), None, MagicMock(content="call mom")]
+
+            await handlers.add_task_handler(update, context)
+
+            mock_create_task.assert_not_called()
+            entries = mock_create_tasks.call_args.args[1]
+            self.assertEqual([entry[0] for entry in entries], ["buy milk", "fix the bike", "call mom"])
+            reply = update.message.reply_text.call_args.args[0]
+            self.assertTrue(reply.startswith("Added 2 of 3 tasks:"))
+            self.assertIn("- 'fix the bike' failed", reply)
+            update.message.reply_text.assert_called_once()
+
+        asyncio.run(run())
+
+    @patch('telegram_bot.handlers.complete_tasks')
+    @patch('telegram_bot.handlers.resolve_tasks')
+    @patch('telegram_bot.handlers.find_task_by_content')
+    def test_complete_task_handler_batches_list(self, mock_find_task, mock_resolve, mock_complete_tasks):
+        """A comma/newline list is resolved in one pass and closed in one batch."""
+        async def run():
+            update, context = self._create_mock_update_context("/complete buy milk, pay rent\nwalk dgo")
+            milk, rent, dog = (MagicMock(id=str(i), content=content) for i, content in
+                               enumerate(["buy milk", "pay rent", "walk dog"]))
+            mock_find_task.return_value = None
+            mock_resolve.return_value = [(milk, []), (rent, []), (None, [(0.7, dog), (0.2, milk)])]
+            mock_complete_tasks.return_value = {"0": None, "1": "Item not found"}
+
+            await handlers.complete_task_handler(update, context)
+
+            mock_find_task.assert_called_once_with(unittest.mock.ANY, unittest.mock.ANY, sync_on_miss=False)
+            mock_resolve.assert_called_once_with(unittest.mock.ANY, ["buy milk", "pay rent", "walk dgo"])
+            # A near miss is only suggested, never closed
+            mock_complete_tasks.assert_called_once_with(unittest.mock.ANY, ["0", "1"])
+            reply = update.message.reply_text.call_args.args[0]
+            self.assertEqual(reply, "Completed 1 of 3 tasks:\n"
+                                    "- 'buy milk' completed\n"
+                                    "- 'pay rent' failed: Item not found\n"
+                                    "- 'walk dgo' not found, did you mean: 'walk dog'?")
+
+        asyncio.run(run())
+
+    @patch('telegram_bot.handlers.complete_tasks')
+    @patch('telegram_bot.handlers.find_tasks_in')
+    def test_complete_task_handler_section_pattern(self, mock_find_in, mock_complete_tasks):
+        async def run():
+            update, context = self._create_mock_update_context("/complete project:Personal section:Groceries")
+            mock_find_in.return_value = [MagicMock(id="1", content="milk"), MagicMock(id="2", content="eggs")]
+            mock_complete_tasks.return_value = {"1": None, "2": None}
+
+            await handlers.complete_task_handler(update, context)
+
+            mock_find_in.assert_called_once_with(unittest.mock.ANY, "Personal", "Groceries")
+            reply = update.message.reply_text.call_args.args[0]
+            self.assertTrue(reply.startswith("Completed 2 of 2 tasks in 'Personal / Groceries':"))
+
+        asyncio.run(run())
+
+    @patch('telegram_bot.handlers.complete_tasks')
+    @patch('telegram_bot.handlers.find_tasks_in')
+    @patch('telegram_bot.handlers.complete_task')
+    @patch('telegram_bot.handlers.find_task_by_content')
+    def test_complete_task_name_containing_project_key(self, mock_find_task, mock_complete_task, mock_find_in,
+                                                       mock_complete_tasks):
+        """A task name with "project:" inside completes that task, not a whole project."""
+        async def run():
+            update, context = self._create_mock_update_context("/complete Email client about project: timeline")
+            mock_find_task.return_value = MagicMock(id="t1", content="Email client about project: timeline")
+            mock_complete_task.return_value = True
+
+            await handlers.complete_task_handler(update, context)
+
+            mock_find_in.assert_not_called()
+            mock_complete_tasks.assert_not_called()
+            mock_find_task.assert_called_once_with(unittest.mock.ANY, "Email client about project: timeline", sync_on_miss=True)
+            mock_complete_task.assert_called_once_with(unittest.mock.ANY, "t1")
+
+        asyncio.run(run())
+
     @patch('telegram_bot.handlers.complete_task')
     @patch('telegram_bot.handlers.find_task_by_content')
     def test_complete_task_handler_success(self, mock_find_task, mock_complete_task):
@@ -83,36 +226,65 @@ class TestHandlers(unittest.TestCase):
             mock_find_task.return_value = mock_found_task
             mock_complete_task.return_value = True
 
-            async def mock_to_thread(func, *args, **kwargs):
-                return func(*args, **kwargs)
+            await handlers.complete_task_handler(update, context)
 
-            with patch('asyncio.to_thread', new=mock_to_thread):
-                await handlers.complete_task_handler(update, context)
-
-            mock_find_task.assert_called_once_with(unittest.mock.ANY, "Finish the report")
+            mock_find_task.assert_called_once_with(unittest.mock.ANY, "Finish the report", sync_on_miss=True)
             mock_complete_task.assert_called_once_with(unittest.mock.ANY, "task123")
             update.message.reply_text.assert_called_once_with("Task 'Finish the report' completed!")
 
         asyncio.run(run())
 
+    @patch('telegram_bot.handlers.find_similar_tasks')
     @patch('telegram_bot.handlers.find_task_by_content')
-    def test_complete_task_handler_not_found(self, mock_find_task):
+    def test_complete_task_handler_not_found(self, mock_find_task, mock_find_similar):
         """Test the complete_task_handler when the task is not found."""
         async def run():
             update, context = self._create_mock_update_context("/complete Non-existent task")
             mock_find_task.return_value = None
+            mock_find_similar.return_value = []
 
-            async def mock_to_thread(func, *args, **kwargs):
-                return func(*args, **kwargs)
-
-            with patch('asyncio.to_thread', new=mock_to_thread):
-                await handlers.complete_task_handler(update, context)
+            await handlers.complete_task_handler(update, context)
             
-            mock_find_task.assert_called_once_with(unittest.mock.ANY, "Non-existent task")
+            mock_find_task.assert_called_once_with(unittest.mock.ANY, "Non-existent task", sync_on_miss=True)
             update.message.reply_text.assert_called_once_with("Task 'Non-existent task' not found.")
 
         asyncio.run(run())
 
+    @patch('telegram_bot.handlers.complete_task')
+    @patch('telegram_bot.handlers.find_similar_tasks')
+    @patch('telegram_bot.handlers.find_task_by_content')
+    def test_complete_task_handler_suggests_near_miss(self, mock_find_task, mock_find_similar, mock_complete_task):
+        """Even a confident fuzzy match is only suggested, since it may be a different task."""
+        async def run():
+            update, context = self._create_mock_update_context("/complete call mom")
+            mock_find_task.return_value = None
+            mock_find_similar.return_value = [(0.67, MagicMock(id="task123", content="Call Tom"))]
+
+            await handlers.complete_task_handler(update, context)
+
+            mock_complete_task.assert_not_called()
+            update.message.reply_text.assert_called_once_with("Task 'call mom' not found. Did you mean: 'Call Tom'?")
+        asyncio.run(run())
+
+    @patch('telegram_bot.handlers.find_similar_tasks')
+    @patch('telegram_bot.handlers.find_task_by_content')
+    def test_complete_task_handler_suggests_ambiguous_matches(self, mock_find_task, mock_find_similar):
+        """Ambiguous fuzzy matches are offered as suggestions."""
+        async def run():
+            update, context = self._create_mock_update_context("/complete report")
+            mock_find_task.return_value = None
+            mock_find_similar.return_value = [
+                (0.5, MagicMock(content="Finish the report")),
+                (0.45, MagicMock(content="Send report")),
+            ]
+
+            await handlers.complete_task_handler(update, context)
+
+            update.message.reply_text.assert_called_once_with(
+                "Task 'report' not found. Did you mean: 'Finish the report', 'Send report'?"
+            )
+        asyncio.run(run())
+
     def test_add_task_with_separator(self):
         """Test adding a task using a separator for categorization."""
         async def run():
@@ -124,14 +296,8 @@ class TestHandlers(unittest.TestCase):
             mock_task = MagicMock()
             mock_task.content = "Fix the pump"
 
-            with patch('telegram_bot.handlers.create_task') as mock_create_task, \
-                 patch('asyncio.to_thread') as mock_to_thread:
-                
+            with patch('telegram_bot.handlers.create_task') as mock_create_task:
                 mock_create_task.return_value = mock_task
-                
-                async def passthrough(func, *args, **kwargs):
-                    return func(*args, **kwargs)
-                mock_to_thread.side_effect = passthrough
 
                 await handlers.add_task_handler(update, context)
 
@@ -156,15 +322,8 @@ class TestHandlers(unittest.TestCase):
             mock_task.content = "Create a new guide for AI farming"
             
             # Patch the backend functions
-            with patch('telegram_bot.handlers.create_task') as mock_create_task, \
-                 patch('asyncio.to_thread') as mock_to_thread:
-
+            with patch('telegram_bot.handlers.create_task') as mock_create_task:
                 mock_create_task.return_value = mock_task
-                
-                # Make to_thread call the function directly for the test
-                async def passthrough(func, *args, **kwargs):
-                    return func(*args, **kwargs)
-                mock_to_thread.side_effect = passthrough
 
                 await handlers.add_task_handler(update, context)
 
@@ -253,6 +412,80 @@ class TestConfigLoader(unittest.TestCase):
         self.assertEqual(project, "Work")
         self.assertEqual(section, "Reports")
 
+    def test_compiled_matcher_matches_linear_scan(self):
+        """The compiled matcher agrees with a plain keyword scan on random input."""
+        import random
+
+        def linear_scan(text, mappings):
+            text_lower = text.lower()
+            for project_name, project_data in mappings.items():
+                for section_name, keywords in project_data.get("sections", {}).items():
+                    if any(keyword.lower() in text_lower for keyword in keywords):
+                        return project_name, section_name
+            for project_name, project_data in mappings.items():
+                if any(keyword.lower() in text_lower for keyword in project_data.get("keywords", [])):
+                    return project_name, "General"
+            return "Inbox", None
+
+        rng = random.Random(7)
+        word = lambda: "".join(rng.choice("abcde") for _ in range(rng.randint(1, 4)))
+        for _ in range(50):
+            mappings = {
+                f"P{p}": {
+                    "keywords": [word() for _ in range(3)],
+                    "sections": {f"S{s}": [word().upper() for _ in range(2)] for s in range(2)},
+                }
+                for p in range(4)
+            }
+            for _ in range(20):
+                text = " ".join(word() for _ in range(3))
+                self.assertEqual(find_project_section(text, mappings), linear_scan(text, mappings))
+
+
+class TestProjectMappingsStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/projects.json"
+        self._write({"Work": {"keywords": ["work"]}}, mtime=1_000)
+
+    def _write(self, mappings, mtime):
+        import os
+        with open(self.path, "w") as f:
+            f.write(mappings if isinstance(mappings, str) else json.dumps(mappings))
+        os.utime(self.path, (mtime, mtime))
+
+    def test_reload_swaps_in_changed_mappings(self):
+        from config.loader import ProjectMappingsStore
+        store = ProjectMappingsStore(self.path)
+        self.assertFalse(store.reload())
+
+        self._write({"Garden": {"keywords": ["plant"]}}, mtime=2_000)
+        self.assertTrue(store.reload())
+        self.assertEqual(find_project_section("plant roses", store.mappings), ("Garden", "General"))
+
+    def test_invalid_file_keeps_last_good_mappings(self):
+        from config.loader import ProjectMappingsStore
+        store = ProjectMappingsStore(self.path)
+        old_mappings = store.mappings
+
+        self._write("{not json", mtime=2_000)
+        self.assertFalse(store.reload())
+        self.assertIs(store.mappings, old_mappings)
+
+    def test_watcher_picks_up_changes(self):
+        from config.loader import ProjectMappingsStore
+        store = ProjectMappingsStore(self.path)
+        store.start_watching(interval=0.01)
+        self.addCleanup(store.stop_watching)
+
+        self._write({"Garden": {"keywords": ["plant"]}}, mtime=2_000)
+        deadline = time.monotonic() + 2
+        while "Garden" not in store.mappings and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIn("Garden", store.mappings)
+
 
 class TestTodoistApi(unittest.TestCase):
     @patch('todoist.api.TodoistAPI')
@@ -300,6 +533,1552 @@ class TestTodoistApi(unittest.TestCase):
         self.assertEqual(section_id, '67890')
         mock_api_instance.add_section.assert_not_called()
 
+    @patch('todoist.api.get_task_mirror')
+    @patch('todoist.api.get_api')
+    def test_complete_task_uses_the_sdk_method(self, mock_get_api, mock_get_mirror):
+        """The spec catches calls to methods the installed SDK doesn't have."""
+        from todoist_api_python.api import TodoistAPI
+        from todoist.api import complete_task
+        mock_get_api.return_value = MagicMock(spec=TodoistAPI)
+        mock_get_api.return_value.complete_task.return_value = True
+
+        self.assertTrue(complete_task("test-token", "t1"))
+        mock_get_api.return_value.complete_task.assert_called_once_with(task_id="t1")
+        mock_get_mirror.return_value.remove_task.assert_called_once_with("t1")
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_threads_share_one_call(self):
+        from todoist.singleflight import SingleFlight
+        flights = SingleFlight()
+        calls = []
+
+        def create():
+            calls.append(1)
+            time.sleep(0.1)
+            return "p1"
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: flights.do(("project", "garden"), create), range(8)))
+
+        self.assertEqual(results, ["p1"] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.stats(), {"calls": 1, "shared": 7, "in_flight": 0})
+
+    def test_tasks_and_threads_share_one_call(self):
+        from todoist.singleflight import SingleFlight
+        flights = SingleFlight()
+        calls = []
+
+        async def create():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "p1"
+
+        async def run():
+            tasks = [flights.do_async("key", create) for _ in range(5)]
+            thread = asyncio.to_thread(flights.do, "key", lambda: calls.append(2) or "p2")
+            return await asyncio.gather(*tasks, thread)
+
+        self.assertEqual(asyncio.run(run()), ["p1"] * 6)
+        self.assertEqual(calls, [1])
+
+    def test_errors_are_shared_and_not_cached(self):
+        from todoist.singleflight import SingleFlight
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.05)
+            raise RuntimeError("boom")
+
+        async def run():
+            return await asyncio.gather(*(flights.do_async("key", fail) for _ in range(3)), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in asyncio.run(run())))
+        self.assertEqual(flights.do("key", lambda: "ok"), "ok")
+
+    def test_concurrent_creates_add_project_once(self):
+        """Concurrent /adds for a new project create it exactly once."""
+        from todoist.api_async import _get_or_create_project_by_name
+        from todoist.cache import IdCache
+        from todoist.singleflight import SingleFlight
+        api = MagicMock()
+
+        async def no_projects():
+            await asyncio.sleep(0.05)
+            async def pages():
+                yield []
+            return pages()
+        api.get_projects = no_projects
+        api.add_project = AsyncMock(return_value=MagicMock(id="p9"))
+        cache, flights = IdCache(), SingleFlight()
+
+        async def run():
+            return await asyncio.gather(*(
+                _get_or_create_project_by_name(api, "Garden", cache, flights) for _ in range(10)
+            ))
+
+        self.assertEqual(asyncio.run(run()), ["p9"] * 10)
+        api.add_project.assert_awaited_once_with(name="Garden")
+
+
+class TestIdCache(unittest.TestCase):
+    def setUp(self):
+        from todoist.cache import get_id_cache
+        self.cache = get_id_cache("test-token")
+        self.cache.clear()
+
+    @patch('todoist.api.get_api')
+    def test_warm_create_task_skips_listing(self, MockTodoistAPI):
+        """A second /add for the same project/section only calls add_task."""
+        from todoist.api import create_task
+
+        mock_api_instance = MockTodoistAPI.return_value
+        mock_project = MagicMock(id='p1')
+        mock_project.name = 'Home 🏠'
+        mock_section = MagicMock(id='s1')
+        mock_section.name = 'General'
+        mock_api_instance.get_projects.return_value = [[mock_project]]
+        mock_api_instance.get_sections.return_value = [[mock_section]]
+
+        create_task("test-token", "first", project_name="Home", section_name="General")
+        create_task("test-token", "second", project_name="Home", section_name="General")
+
+        mock_api_instance.get_projects.assert_called_once()
+        mock_api_instance.get_sections.assert_called_once()
+        self.assertEqual(mock_api_instance.add_task.call_count, 2)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    @patch('todoist.api.TodoistAPI')
+    def test_created_project_is_cached(self, MockTodoistAPI):
+        """Projects created on a miss are stored in the cache."""
+        from todoist.api import _get_or_create_project_by_name
+
+        mock_api_instance = MockTodoistAPI.return_value
+        mock_api_instance.get_projects.return_value = [[]]
+        mock_api_instance.add_project.return_value = MagicMock(id='new1')
+
+        _get_or_create_project_by_name(mock_api_instance, "Garden", self.cache)
+        project_id = _get_or_create_project_by_name(mock_api_instance, "garden", self.cache)
+
+        self.assertEqual(project_id, 'new1')
+        mock_api_instance.add_project.assert_called_once()
+
+    @patch('todoist.api.get_api')
+    def test_stale_cached_id_is_invalidated(self, MockTodoistAPI):
+        """A rejected cached project ID is dropped and looked up again."""
+        from todoist.api import create_task
+
+        mock_api_instance = MockTodoistAPI.return_value
+        mock_project = MagicMock(id='fresh')
+        mock_project.name = 'Home'
+        mock_api_instance.get_projects.return_value = [[mock_project]]
+        self.cache.set(("project", "home"), 'stale')
+
+        stale_error = Exception("Not found")
+        stale_error.response = MagicMock(status_code=404)
+        mock_api_instance.add_task.side_effect = [stale_error, MagicMock(content="task")]
+
+        task = create_task("test-token", "task", project_name="Home")
+
+        self.assertIsNotNone(task)
+        self.assertEqual(mock_api_instance.add_task.call_args.kwargs["project_id"], 'fresh')
+        self.assertEqual(self.cache.get(("project", "home")), 'fresh')
+
+
+class TestTodoistClient(unittest.TestCase):
+    def tearDown(self):
+        from todoist.client import close_all
+        close_all()
+
+    def test_client_is_reused_per_token(self):
+        """The same token always gets the same pooled client."""
+        from todoist.client import get_api
+
+        self.assertIs(get_api("token-a"), get_api("token-a"))
+        self.assertIsNot(get_api("token-a"), get_api("token-b"))
+
+    @patch('todoist.client.POOL_SIZE', 3)
+    @patch('todoist.client.READ_TIMEOUT', 7.0)
+    def test_pool_size_and_timeouts_are_configurable(self):
+        """Pool limits and timeouts come from the module settings."""
+        from todoist.client import new_http_client, _prepare_request
+        import httpx
+
+        client = new_http_client()
+        pool = client._transport._pool
+        self.assertEqual(pool._max_connections, 3)
+        request = httpx.Request("GET", "https://example.com", extensions={"timeout": {"read": 60.0}})
+        _prepare_request(request)
+        self.assertEqual(request.extensions["timeout"]["read"], 7.0)
+        client.close()
+
+
+STUB_TASK = {
+    "id": "t1", "content": "Finish the report", "description": "", "project_id": "p1",
+    "section_id": None, "parent_id": None, "labels": [], "priority": 1, "due": None,
+    "deadline": None, "duration": None, "collapsed": False, "child_order": 1,
+    "responsible_uid": None, "assigned_by_uid": None, "completed_at": None,
+    "added_by_uid": "u1", "added_at": "2025-01-01T00:00:00Z", "updated_at": "2025-01-01T00:00:00Z",
+}
+
+
+class _StubTodoistHandler(BaseHTTPRequestHandler):
+    """Answers the REST and Sync endpoints used by todoist.api after a fixed delay."""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    requests = []
+    head_ports = []
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload=None):
+        time.sleep(self.latency)
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path))
+        self._reply(200, {"results": [STUB_TASK], "next_cursor": None})
+
+    def do_HEAD(self):
+        self.requests.append(("HEAD", self.path, self.headers.get("Authorization")))
+        self.head_ports.append(self.client_address[1])
+        self._reply(200)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.requests.append(("POST", self.path))
+        if self.path.endswith("/sync"):
+            self._reply(200, {"full_sync": True, "sync_token": "token-1", "items": [STUB_TASK]})
+        elif self.path.endswith("/close"):
+            self._reply(204)
+        else:
+            self._reply(200, STUB_TASK)
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops bursts of concurrent connects
+    request_queue_size = 128
+
+
+class TestAsyncTodoistApi(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.handler = type("Handler", (_StubTodoistHandler,), {"latency": 0.05, "requests": [], "head_ports": []})
+        cls.server = _StubServer(("127.0.0.1", 0), cls.handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        patcher = patch('todoist.client.TODOIST_BASE_URL', self.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        from todoist.client import close_all
+        self.addCleanup(close_all)
+
+    def test_prewarm_opens_authenticated_connections(self):
+        from todoist.client import prewarm, close_all_async
+
+        async def run():
+            await prewarm("warm-token", connections=3)
+            await close_all_async()
+        asyncio.run(run())
+
+        heads = [request for request in self.handler.requests if request[0] == "HEAD"]
+        self.assertEqual(heads, [("HEAD", "/api/v1/projects", "Bearer warm-token")] * 3)
+        # Concurrent, so each request held its own connection
+        self.assertEqual(len(set(self.handler.head_ports)), 3)
+
+    def test_async_operations_against_stub(self):
+        """The async API finds, completes and creates tasks over HTTP."""
+        from todoist import api_async
+        from todoist.client import close_all_async
+
+        async def run():
+            task = await api_async.find_task_by_content("async-token", " Finish the report ")
+            self.assertEqual(task.id, "t1")
+            self.assertTrue(await api_async.complete_task("async-token", task.id))
+            created = await api_async.create_task("async-token", "Finish the report")
+            self.assertEqual(created.content, "Finish the report")
+            await close_all_async()
+        asyncio.run(run())
+
+    @patch('todoist.client.POOL_SIZE', 16)
+    def test_async_client_outperforms_thread_offload(self):
+        """Concurrent creates finish sooner on the event loop than in a small thread pool."""
+        from todoist import api, api_async
+        from todoist.client import close_all_async
+        calls = 16
+
+        async def offloaded():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=4))
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                asyncio.to_thread(api.create_task, "stub-token", "Finish the report")
+                for _ in range(calls)
+            ))
+            return time.perf_counter() - start
+
+        async def native():
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                api_async.create_task("stub-token", "Finish the report")
+                for _ in range(calls)
+            ))
+            elapsed = time.perf_counter() - start
+            await close_all_async()
+            self.assertTrue(all(task.id == "t1" for task in results))
+            return elapsed
+
+        thread_elapsed = asyncio.run(offloaded())
+        async_elapsed = asyncio.run(native())
+        self.assertLess(async_elapsed, thread_elapsed)
+
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('ratelimit.BACKOFF_BASE', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _client(self, responses, limiter):
+        import httpx
+        from ratelimit import RateLimitedTransport
+        seen = []
+
+        def handler(request):
+            seen.append(request.method)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        client = httpx.Client(transport=RateLimitedTransport(httpx.MockTransport(handler), limiter))
+        self.addCleanup(client.close)
+        return client, seen
+
+    def test_bucket_allows_burst_then_waits(self):
+        from ratelimit import TokenBucket
+        bucket = TokenBucket(rate=50, burst=2)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.0)
+        start = time.monotonic()
+        self.assertGreater(bucket.acquire(), 0.0)
+        self.assertGreaterEqual(time.monotonic() - start, 0.015)
+        self.assertEqual(bucket.stats()["waited"], 1)
+
+    def test_parse_retry_after(self):
+        import email.utils
+        from ratelimit import parse_retry_after
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertAlmostEqual(parse_retry_after(email.utils.formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertIsNone(parse_retry_after("soon"))
+
+    def test_429_is_retried_after_retry_after(self):
+        import httpx
+        from ratelimit import TokenBucket
+        limiter = TokenBucket(rate=100, burst=10)
+        client, seen = self._client([httpx.Response(429, headers={"Retry-After": "0.05"}), httpx.Response(200)], limiter)
+
+        start = time.monotonic()
+        response = client.post("https://api.example/tasks")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(seen, ["POST", "POST"])
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual((limiter.stats()["throttled"], limiter.stats()["retries"]), (1, 1))
+
+    def test_server_errors_retry_only_idempotent_requests(self):
+        import httpx
+        from ratelimit import TokenBucket
+        client, seen = self._client([httpx.Response(503), httpx.Response(503), httpx.Response(200)], TokenBucket(100, 10))
+
+        self.assertEqual(client.post("https://api.example/tasks").status_code, 503)
+        self.assertEqual(client.get("https://api.example/tasks").status_code, 200)
+        self.assertEqual(seen, ["POST", "GET", "GET"])
+
+    def test_openai_retries_completions_but_not_assistant_runs(self):
+        import httpx
+        from cursor_logic.parser import _rate_limited
+        from ratelimit import RateLimitedTransport
+        seen = []
+
+        def handler(request):
+            seen.append(request.url.path)
+            return httpx.Response(503 if len(seen) % 2 else 200)
+        client = _rate_limited(httpx.Client(transport=httpx.MockTransport(handler)), RateLimitedTransport, "sk-retry")
+        self.addCleanup(client.close)
+
+        with patch('ratelimit.backoff_delay', return_value=0):
+            self.assertEqual(client.post("https://api.openai.com/v1/chat/completions").status_code, 200)
+            self.assertEqual(client.post("https://api.openai.com/v1/threads/runs").status_code, 503)
+        self.assertEqual(seen, ["/v1/chat/completions"] * 2 + ["/v1/threads/runs"])
+
+    @patch('ratelimit.RETRY_AFTER_MAX', 0.05)
+    def test_long_retry_after_is_returned_and_pause_is_capped(self):
+        import httpx
+        from ratelimit import TokenBucket
+        limiter = TokenBucket(rate=100, burst=10)
+        client, seen = self._client([httpx.Response(429, headers={"Retry-After": "900"})], limiter)
+
+        self.assertEqual(client.post("https://api.example/tasks").status_code, 429)
+        # Later callers wait out the capped pause, not the 15 minutes asked for
+        self.assertLess(limiter.acquire(), 0.1)
+
+    def test_transport_errors_are_retried(self):
+        import httpx
+        from ratelimit import TokenBucket
+        client, seen = self._client([
+            httpx.ConnectError("refused"), httpx.Response(200),
+            httpx.ReadTimeout("slow"), httpx.Response(200),
+            httpx.ReadTimeout("slow"),
+        ], TokenBucket(100, 10))
+
+        # A failed connect never reached the upstream, so even a POST is retried
+        self.assertEqual(client.post("https://api.example/tasks").status_code, 200)
+        self.assertEqual(client.get("https://api.example/tasks").status_code, 200)
+        with self.assertRaises(httpx.ReadTimeout):
+            client.post("https://api.example/tasks")
+        self.assertEqual(seen, ["POST", "POST", "GET", "GET", "POST"])
+
+    def test_endpoint_label_collapses_ids_by_position(self):
+        from ratelimit import endpoint_label
+        self.assertEqual(endpoint_label("/api/v1/tasks/AbcdEfghIjklMnop/close"), "/api/v1/tasks/:id/close")
+        self.assertEqual(endpoint_label("/api/v1/tasks"), "/api/v1/tasks")
+        self.assertEqual(endpoint_label("/v1/threads/thread_Xy/runs/run_Ab"), "/v1/threads/:id/runs/:id")
+
+    def test_telegram_retry_after_comes_from_the_body(self):
+        from telegram_bot.request import _retry_after
+        payload = json.dumps({"ok": False, "error_code": 429, "parameters": {"retry_after": 5}}).encode()
+        self.assertEqual(_retry_after(payload), 5.0)
+        self.assertIsNone(_retry_after(b"not json"))
+
+
+class TestTaskMirror(unittest.TestCase):
+    def test_full_then_delta_sync(self):
+        """A delta sync adds new tasks and drops completed ones."""
+        from todoist.mirror import TaskMirror
+
+        mirror = TaskMirror()
+        mirror.apply({"full_sync": True, "sync_token": "a", "items": [STUB_TASK]})
+        self.assertEqual(mirror.find_by_content("Finish the report").id, "t1")
+
+        new_task = dict(STUB_TASK, id="t2", content="Buy milk")
+        mirror.apply({"full_sync": False, "sync_token": "b", "items": [
+            new_task, dict(STUB_TASK, checked=True),
+        ]})
+        self.assertIsNone(mirror.find_by_content("Finish the report"))
+        self.assertEqual([task.id for task in mirror.find_by_name("milk")], ["t2"])
+        self.assertEqual(mirror.sync_token, "b")
+
+    def test_lookups_are_served_from_memory(self):
+        """Only the first lookup talks to Todoist; later hits use the mirror."""
+        handler = type("Handler", (_StubTodoistHandler,), {"requests": []})
+        server = _StubServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        from todoist.api import find_task_by_content
+        from todoist.client import close_all
+        self.addCleanup(close_all)
+        with patch('todoist.client.TODOIST_BASE_URL', f"http://127.0.0.1:{server.server_port}"):
+            self.assertEqual(find_task_by_content("mirror-token", "Finish the report").id, "t1")
+            self.assertEqual(find_task_by_content("mirror-token", "Finish the report").id, "t1")
+
+        self.assertEqual(handler.requests, [("POST", "/api/v1/sync")])
+
+
+class TestTenants(unittest.TestCase):
+    def setUp(self):
+        import tenants
+        self.closed = []
+        tenants.register_tenant_state("test_state", lambda api_token: {"token": api_token},
+                                      size=lambda state: 100, close=lambda state: self.closed.append(state["token"]))
+        self.addCleanup(tenants._kinds.pop, "test_state")
+
+    def test_least_recently_used_accounts_are_evicted_past_the_cap(self):
+        from tenants import TenantRegistry
+        registry = TenantRegistry(max_tenants=2, grace=0)
+        first = registry.state("test_state", "a")
+        registry.state("test_state", "b")
+        registry.state("test_state", "a")
+        registry.state("test_state", "c")
+
+        self.assertEqual(self.closed, ["b"])
+        self.assertIs(registry.state("test_state", "a"), first)
+
+    def test_idle_and_oversized_accounts_are_evicted_outside_the_grace_period(self):
+        from tenants import TenantRegistry
+        registry = TenantRegistry(max_tenants=10, memory_limit=250, idle_timeout=60, grace=30)
+        for api_token in ("a", "b", "c", "d"):
+            registry.state("test_state", api_token)
+        registry.sweep()
+        self.assertEqual(self.closed, [])
+
+        for tenant in registry._tenants.values():
+            tenant.last_used -= 45
+        registry._tenants["a"].last_used -= 60
+        registry.sweep()
+
+        self.assertEqual(self.closed, ["a", "b"])
+        self.assertEqual(registry.stats(), {"tenants": 2, "estimated_bytes": 200, "evictions": 2})
+
+    def test_evicted_account_releases_its_connection_pool(self):
+        import ratelimit
+        from tenants import TENANTS
+        from todoist.client import get_api
+        api = get_api("evicted-token")
+        limiter = api._client._transport.limiter
+
+        TENANTS.evict("evicted-token")
+
+        self.assertTrue(api._client.is_closed)
+        self.assertNotIn(limiter, ratelimit._limiters.values())
+        self.assertIsNot(get_api("evicted-token"), api)
+        TENANTS.evict("evicted-token")
+
+
+class TestTokenStorage(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_sealed_tokens_round_trip_and_detect_tampering(self):
+        from token_crypto import seal_token, unseal_token
+        sealed = seal_token("0123456789abcdef")
+        self.assertNotIn("0123456789abcdef", sealed)
+        self.assertEqual(sealed, seal_token("0123456789abcdef"))
+        self.assertEqual(unseal_token(sealed), "0123456789abcdef")
+        # Values stored before sealing still read back
+        self.assertEqual(unseal_token("plain-token"), "plain-token")
+        with patch('token_crypto._keys', None), patch('token_crypto.TOKEN_ENCRYPTION_KEY', "other-key"):
+            with self.assertRaises(ValueError):
+                unseal_token(sealed)
+
+    def test_tokens_are_not_stored_in_plain_text_and_purged_on_disconnect(self):
+        from telegram_bot.accounts import AccountRegistry
+        from todoist.journal import TaskJournal
+        accounts = AccountRegistry(f"{self.directory}/accounts.db")
+        self.addCleanup(accounts.close)
+        journal = TaskJournal(f"{self.directory}/journal.db")
+        self.addCleanup(journal.close)
+
+        accounts.connect(42, "secret-token")
+        journal.append_many("secret-token", [("Buy milk", None, None), ("Buy eggs", None, None)])
+        journal.append("other-token", "Call Tom")
+        self.assertEqual(accounts.get(42), "secret-token")
+        stored = [row[0] for row in accounts._db.execute("SELECT api_token FROM accounts")]
+        stored += [row[0] for row in journal._db.execute("SELECT api_token FROM pending_tasks")]
+        self.assertFalse(any("token" in value for value in stored))
+
+        self.assertEqual(journal.purge("secret-token"), 2)
+        self.assertEqual(journal.stats()["pending"], 1)
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/cache.db"
+
+    def test_workers_share_ids_and_invalidations(self):
+        """An ID cached by one worker process hits in another, and so does its invalidation."""
+        import os
+        import subprocess
+        import sys
+        from cache_backend import SQLiteBackend
+        from todoist.cache import IdCache
+        worker = (
+            "from cache_backend import SQLiteBackend\n"
+            "from todoist.cache import IdCache\n"
+            f"cache = IdCache(backend=SQLiteBackend('ids', 100, {self.path!r}))\n"
+            "cache.set(('project', 'home'), 'p1')\n"
+            "cache.set(('section', 'p1', 'chores'), 's1')\n"
+        )
+        subprocess.run([sys.executable, "-c", worker], check=True, env=dict(os.environ, PYTHONPATH=os.getcwd()))
+
+        cache = IdCache(backend=SQLiteBackend("ids", 100, self.path))
+        self.assertEqual(cache.get(("section", "p1", "chores")), "s1")
+        cache.invalidate(value="p1")
+        self.assertIsNone(IdCache(backend=SQLiteBackend("ids", 100, self.path)).get(("section", "p1", "chores")))
+
+    def test_a_listing_page_is_cached_in_one_commit(self):
+        from types import SimpleNamespace
+        from cache_backend import SQLiteBackend, _connect
+        from todoist.api import _scan_page
+        from todoist.cache import IdCache
+        cache = IdCache(backend=SQLiteBackend("ids", 100, self.path))
+        statements = []
+        _connect(self.path).db.set_trace_callback(statements.append)
+        page = [SimpleNamespace(id=f"p{i}", name=f"Project {i}") for i in range(5)]
+
+        self.assertEqual(_scan_page(page, "project 3", cache, ("project",)), "p3")
+
+        self.assertEqual(statements.count("COMMIT"), 1)
+        self.assertEqual(cache.get(("project", "project 4")), "p4")
+
+    def test_backends_are_bounded(self):
+        from cache_backend import MemoryBackend, SQLiteBackend
+        memory = MemoryBackend(maxsize=3)
+        for i in range(10):
+            memory.set(str(i), i)
+        self.assertEqual((len(memory), memory.get("0"), memory.get("9")), (3, None, 9))
+
+        shared = SQLiteBackend("bounded", 20, self.path)
+        with patch("cache_backend.CACHE_PRUNE_EVERY", 10):
+            for i in range(55):
+                shared.set(str(i), i)
+        self.assertLessEqual(len(shared), 30)
+        self.assertEqual(shared.get("54"), 54)
+
+    @patch("todoist.mirror.post_sync")
+    def test_cold_worker_starts_from_snapshot_and_sees_other_writes(self, post_sync):
+        from cache_backend import SQLiteBackend
+        from todoist.mirror import TaskMirror
+        from todoist_api_python.models import Task
+        warm = TaskMirror(backend=SQLiteBackend("mirror", 8, self.path))
+        post_sync.return_value = {"full_sync": True, "sync_token": "a", "items": [STUB_TASK]}
+        warm.sync(None, "token")
+
+        cold = TaskMirror(backend=SQLiteBackend("mirror", 8, self.path))
+        post_sync.return_value = {"full_sync": False, "sync_token": "b", "items": []}
+        cold.sync(None, "token")
+        self.assertEqual(post_sync.call_args.kwargs["sync_token"], "a")
+        self.assertEqual(cold.find_by_content("Finish the report").id, "t1")
+
+        self.assertFalse(warm.is_stale())
+        cold.add_task(Task.from_dict(dict(STUB_TASK, id="t2", content="Buy milk")))
+        self.assertFalse(cold.is_stale())
+        self.assertTrue(warm.is_stale())
+
+
+class TestBatchedWrites(unittest.TestCase):
+    def setUp(self):
+        from todoist.mirror import TaskMirror
+        self.mirror = TaskMirror()
+        self.mirror.apply({"full_sync": True, "sync_token": "a", "items": [STUB_TASK],
+                           "projects": [{"id": "p1", "name": "Personal 🏠"}], "sections": []})
+        patcher = patch('todoist.api.get_task_mirror', return_value=self.mirror)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _respond(self, sent):
+        """A fake Sync endpoint that creates projects, sections and tasks, recording each request."""
+        def respond(client, api_token, commands, **data):
+            sent.append(commands)
+            mapping, delta = {}, {"projects": [], "sections": [], "items": []}
+            for c in commands:
+                real_id = f"{c['type'][0]}{sum(len(batch) for batch in sent)}{len(mapping)}"
+                mapping[c["temp_id"]] = real_id
+                args = {k: mapping.get(v, v) for k, v in c["args"].items()}
+                if c["type"] == "item_add":
+                    delta["items"].append(dict(STUB_TASK, id=real_id, **args))
+                else:
+                    delta[c["type"].replace("_add", "s")].append(dict(args, id=real_id))
+            return dict(delta, sync_token="b", sync_status={c["uuid"]: "ok" for c in commands},
+                        temp_id_mapping=mapping)
+        return respond
+
+    @patch('todoist.mirror.post_sync')
+    def test_create_tasks_sends_one_batch(self, mock_post_sync):
+        """Known projects are reused, missing ones created once, and all tasks sent in one request."""
+        from todoist.api import create_tasks
+        sent = []
+        respond = self._respond(sent)
+
+        def fail_eggs(client, api_token, commands, **data):
+            result = respond(client, api_token, commands, **data)
+            for c in commands:
+                if c["args"].get("content") == "Buy eggs":
+                    result["sync_status"][c["uuid"]] = {"error_code": 42, "error": "Invalid argument"}
+            return result
+        mock_post_sync.side_effect = fail_eggs
+
+        tasks = create_tasks("batch-token", [
+            ("Buy milk", "Personal", "Groceries"),
+            ("Buy eggs", "Personal", "Groceries"),
+            ("Fix bike", "Garage", None),
+        ])
+
+        self.assertEqual([[c["type"] for c in batch] for batch in sent],
+                         [["project_add"], ["section_add"], ["item_add"] * 3])
+        self.assertEqual(sent[0][0]["args"], {"name": "Garage"})
+        self.assertEqual(sent[1][0]["args"], {"name": "Groceries", "project_id": "p1"})
+        self.assertEqual(tasks[1], None)
+        self.assertEqual(tasks[0].section_id, next(iter(self.mirror.sections)))
+        self.assertEqual(tasks[2].project_id, next(p for p, v in self.mirror.projects.items() if v["name"] == "Garage"))
+        self.assertEqual(self.mirror.find_by_content("Fix bike").id, tasks[2].id)
+
+    @patch('todoist.mirror.post_sync')
+    def test_section_created_with_its_project_is_cached_under_the_real_id(self, mock_post_sync):
+        from todoist.api import create_tasks
+        from todoist.cache import get_id_cache
+        sent = []
+        mock_post_sync.side_effect = self._respond(sent)
+
+        task, = create_tasks("new-project-token", [("Oil chain", "Garage", "Bikes")])
+
+        cache = get_id_cache("new-project-token")
+        self.assertEqual(cache.get(("project", "garage")), task.project_id)
+        self.assertEqual(cache.get(("section", task.project_id, "bikes")), task.section_id)
+        self.assertEqual(sent[1][0]["args"]["project_id"], task.project_id)
+
+    @patch('todoist.mirror.post_sync_async')
+    def test_concurrent_batches_share_a_new_project(self, mock_post):
+        """Two multi-line /adds for the same new project create it once."""
+        from todoist.api_async import create_tasks
+        sent = []
+        respond = self._respond(sent)
+
+        async def respond_async(client, api_token, commands, **data):
+            await asyncio.sleep(0.01)
+            return respond(client, api_token, commands, **data)
+        mock_post.side_effect = respond_async
+
+        async def add_both():
+            return await asyncio.gather(
+                create_tasks("travel-token", [("Book flights", "Travel", None), ("Pack", "Travel", "Bags")]),
+                create_tasks("travel-token", [("Renew passport", "Travel", "Bags")]),
+            )
+        with patch('todoist.api_async.get_task_mirror', return_value=self.mirror):
+            first, second = asyncio.run(add_both())
+
+        creates = [c for batch in sent for c in batch if c["type"] != "item_add"]
+        self.assertEqual([c["type"] for c in creates], ["project_add", "section_add"])
+        self.assertEqual({task.project_id for task in first + second}, {first[0].project_id})
+        self.assertEqual(first[1].section_id, second[0].section_id)
+
+    @patch('todoist.mirror.post_sync')
+    def test_complete_tasks_reports_per_item(self, mock_post_sync):
+        from todoist.api import complete_tasks
+        from todoist_api_python.models import Task
+        self.mirror.add_task(Task.from_dict(dict(STUB_TASK, id="t2", content="Buy milk")))
+
+        def respond(client, api_token, commands, **data):
+            self.assertEqual([c["type"] for c in commands], ["item_close", "item_close"])
+            return {"sync_token": "b",
+                    "sync_status": {commands[0]["uuid"]: "ok", commands[1]["uuid"]: {"error": "Item not found"}},
+                    "items": [dict(STUB_TASK, checked=True)]}
+        mock_post_sync.side_effect = respond
+
+        self.assertEqual(complete_tasks("batch-token", ["t1", "t2", "t1"]), {"t1": None, "t2": "Item not found"})
+        mock_post_sync.assert_called_once()
+        self.assertNotIn("t1", self.mirror.tasks)
+
+    def test_tasks_in_section(self):
+        from todoist.api import _tasks_in
+        self.mirror.apply({"sections": [{"id": "s1", "project_id": "p1", "name": "Groceries"}],
+                           "items": [dict(STUB_TASK, id="t2", content="Buy milk", section_id="s1")]})
+        self.assertEqual([task.id for task in _tasks_in(self.mirror, section_name="groceries")], ["t2"])
+        self.assertEqual(sorted(task.id for task in _tasks_in(self.mirror, project_name="Personal")), ["t1", "t2"])
+
+
+class TestWriteBehind(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from todoist.journal import TaskJournal
+        from todoist.mirror import TaskMirror
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/journal.db"
+        self.journal = TaskJournal(self.path)
+        self.addCleanup(self.journal.close)
+        self.mirror = TaskMirror()
+        self.mirror.apply({"full_sync": True, "sync_token": "a", "items": [], "projects": [], "sections": []})
+        for target, value in (('todoist.journal.get_task_mirror', self.mirror),
+                              ('todoist.journal.get_async_http_client', MagicMock())):
+            patcher = patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_entries_survive_a_restart(self):
+        from todoist.journal import TaskJournal
+        entry_uuid = self.journal.append("token", "Buy milk", "Personal", None)
+        reopened = TaskJournal(self.path)
+        self.addCleanup(reopened.close)
+        self.assertEqual([row["uuid"] for row in reopened.due()], [entry_uuid])
+
+    @patch('todoist.mirror.post_sync_async')
+    def test_flusher_retries_until_todoist_accepts(self, mock_post):
+        import httpx
+        from todoist.journal import JournalFlusher
+        milk = self.journal.append("token", "Buy milk")
+        eggs = self.journal.append("token", "Buy eggs")
+        flusher = JournalFlusher(self.journal)
+        sent = []
+
+        async def respond(client, api_token, commands=None, **data):
+            if commands is None:
+                # The retry re-syncs first, in case the failed attempt created projects
+                return {"sync_token": "a2"}
+            sent.append([c["uuid"] for c in commands])
+            if len(sent) == 1:
+                raise httpx.ConnectError("Todoist is down")
+            items = {c["uuid"]: c for c in commands}
+            return {"sync_token": "b", "sync_status": {milk: "ok", eggs: {"error": "Invalid argument"}},
+                    "temp_id_mapping": {items[milk]["temp_id"]: "t2"},
+                    "items": [dict(STUB_TASK, id="t2", content="Buy milk")]}
+        mock_post.side_effect = respond
+
+        with patch('todoist.journal.backoff_delay', return_value=0):
+            asyncio.run(flusher.flush())
+            self.assertEqual(self.journal.stats()["pending"], 2)
+            asyncio.run(flusher.flush())
+
+        # The journal uuids are the command uuids, so a resubmission is idempotent
+        self.assertEqual(sent, [[milk, eggs], [milk, eggs]])
+        due = self.journal.due()
+        self.assertEqual([row["uuid"] for row in due], [eggs])
+        self.assertEqual(due[0]["attempts"], 2)
+        self.assertEqual(self.mirror.find_by_content("Buy milk").id, "t2")
+
+    def test_flusher_reads_the_journal_off_the_event_loop(self):
+        from todoist.journal import JournalFlusher
+        threads = []
+        due = self.journal.due
+
+        def record_due(*args):
+            threads.append(threading.current_thread())
+            return due(*args)
+        with patch.object(self.journal, 'due', side_effect=record_due):
+            asyncio.run(JournalFlusher(self.journal).flush())
+        self.assertNotIn(threading.main_thread(), threads)
+
+    @patch('todoist.mirror.post_sync_async')
+    def test_unreadable_token_parks_only_its_rows(self, mock_post):
+        """A row sealed under another key doesn't stop the other accounts from flushing."""
+        from todoist.journal import JournalFlusher
+        self.journal.append("token", "Buy milk")
+        bad = self.journal.append("other-token", "Buy eggs")
+        self.journal._db.execute("UPDATE pending_tasks SET api_token = 'sealed:v1:AAAAAAAAAAAAAAAAAAAAAA==' "
+                                 "WHERE uuid = ?", (bad,))
+        self.journal._db.commit()
+
+        async def respond(client, api_token, commands, **data):
+            return {"sync_token": "b", "sync_status": {c["uuid"]: "ok" for c in commands},
+                    "temp_id_mapping": {commands[0]["temp_id"]: "t2"},
+                    "items": [dict(STUB_TASK, id="t2", content="Buy milk")]}
+        mock_post.side_effect = respond
+
+        asyncio.run(JournalFlusher(self.journal).flush())
+
+        self.assertEqual(self.mirror.find_by_content("Buy milk").id, "t2")
+        self.assertEqual(self.journal.stats()["pending"], 0)
+        self.assertEqual(self.journal.stats()["parked"], 1)
+
+    @patch('todoist.journal.WRITE_BEHIND_MAX_ATTEMPTS', 1)
+    def test_entries_out_of_attempts_are_parked(self):
+        entry_uuid = self.journal.append("token", "Buy milk")
+        self.journal.retry_later([entry_uuid], "boom")
+        self.assertEqual(self.journal.due(), [])
+        self.assertEqual(self.journal.stats()["parked"], 1)
+
+    def test_due_entries_are_claimed_by_one_flusher(self):
+        """A worker sharing the journal doesn't get entries another worker is submitting."""
+        from todoist.journal import TaskJournal
+        uuids = self.journal.append_many("token", [("Buy milk", None, None), ("Buy eggs", "Personal", None)])
+        other_worker = TaskJournal(self.path)
+        self.addCleanup(other_worker.close)
+
+        self.assertEqual([row["uuid"] for row in self.journal.due()], uuids)
+        self.assertEqual(other_worker.due(), [])
+        # Once the lease runs out, e.g. because the worker died, the entries are due again
+        self.journal._db.execute("UPDATE pending_tasks SET next_attempt = 0")
+        self.journal._db.commit()
+        self.assertEqual([row["uuid"] for row in other_worker.due()], uuids)
+
+    def test_due_takes_accounts_in_turn(self):
+        """One account's backlog doesn't crowd the others out of a batch."""
+        for i in range(4):
+            self.journal.append("heavy", f"h{i}")
+        self.journal.append("light", "l0")
+        self.assertEqual([row["content"] for row in self.journal.due(3)], ["h0", "l0", "h1"])
+
+    @patch('telegram_bot.handlers.get_accounts')
+    @patch('telegram_bot.handlers.create_task')
+    @patch('telegram_bot.handlers.get_flusher')
+    @patch('telegram_bot.handlers.get_journal')
+    @patch('telegram_bot.handlers.TODOIST_WRITE_BEHIND', True)
+    def test_add_replies_once_journaled(self, mock_get_journal, mock_get_flusher, mock_create_task, mock_accounts):
+        update = MagicMock()
+        update.message.text = "/add buy milk"
+        update.message.reply_text = AsyncMock()
+        context = MagicMock(args=["buy", "milk"])
+
+        asyncio.run(handlers.add_task_handler(update, context))
+
+        mock_create_task.assert_not_called()
+        entries = mock_get_journal.return_value.append_many.call_args.args[1]
+        self.assertEqual([content for content, _, _ in entries], ["buy milk"])
+        mock_get_flusher.return_value.wake.assert_called_once()
+        update.message.reply_text.assert_called_once_with("Task 'buy milk' saved, it will appear in Todoist shortly.")
+
+
+class TestTaskIndex(unittest.TestCase):
+    def setUp(self):
+        from todoist.index import TaskIndex
+        self.index = TaskIndex()
+        self.index.add("1", "Finish the  Report")
+        self.index.add("2", "Buy milk")
+        self.index.add("3", "Send report to Anna")
+
+    def test_exact_match_is_normalized(self):
+        self.assertEqual(self.index.exact("finish the report "), ["1"])
+
+    def test_substring_match(self):
+        self.assertEqual(sorted(self.index.containing("REPORT")), ["1", "3"])
+        self.assertEqual(self.index.containing("mi"), ["2"])
+
+    def test_fuzzy_search_ranks_near_misses(self):
+        score, task_id = self.index.search("finsh the reprot")[0]
+        self.assertEqual(task_id, "1")
+        self.assertGreater(score, 0.5)
+
+    def test_incremental_updates(self):
+        self.index.remove("1")
+        self.index.add("2", "Buy oat milk")
+        self.assertEqual(self.index.exact("finish the report"), [])
+        self.assertEqual(self.index.exact("buy oat milk"), ["2"])
+        self.assertEqual(self.index.containing("report"), ["3"])
+        self.assertEqual(len(self.index), 2)
+
+
+class TestParser(unittest.TestCase):
+    def setUp(self):
+        import os
+        patcher = patch.dict(os.environ, {"OPENAI_API_KEY": "key", "OPENAI_ASSISTANT_ID": "asst"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        from cursor_logic.parser import PARSE_CACHE
+        PARSE_CACHE.clear()
+
+    @patch('cursor_logic.parser.get_client')
+    def test_completion_mode_makes_one_request(self, mock_get_client):
+        from cursor_logic import parser
+        client = mock_get_client.return_value
+        client.chat.completions.create.return_value.choices = [
+            MagicMock(message=MagicMock(content='{"title": "Pay rent", "due_date": null, "priority": 1, "project": null, "section": null}'))
+        ]
+
+        result = parser.parse_task_with_ai("pay rent")
+
+        self.assertEqual(result["title"], "Pay rent")
+        client.chat.completions.create.assert_called_once()
+        prompt = client.chat.completions.create.call_args.kwargs["messages"][0]["content"]
+        self.assertIn('"pay rent"', prompt)
+        client.beta.threads.create_and_run.assert_not_called()
+
+    @patch('cursor_logic.parser.time.sleep')
+    @patch('cursor_logic.parser.get_client')
+    def test_assistant_mode_polls_with_backoff(self, mock_get_client, mock_sleep):
+        from cursor_logic import parser
+        client = mock_get_client.return_value
+        client.beta.threads.create_and_run.return_value = MagicMock(status="queued", thread_id="t", id="r")
+        client.beta.threads.runs.retrieve.side_effect = [
+            MagicMock(status="in_progress", thread_id="t", id="r") for _ in range(3)
+        ] + [MagicMock(status="completed", thread_id="t", id="r")]
+        client.beta.threads.messages.list.return_value.data = [
+            MagicMock(content=[MagicMock(text=MagicMock(value='```json\n{"title": "Pay rent"}\n```'))])
+        ]
+
+        with patch('cursor_logic.parser.OPENAI_PARSER_MODE', "assistant"):
+            result = parser.parse_task_with_ai("pay rent")
+
+        self.assertEqual(result, {"title": "Pay rent"})
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(delays, sorted(delays))
+        self.assertLess(delays[0], 1)
+
+
+class TestAsyncParser(unittest.TestCase):
+    def setUp(self):
+        import os
+        patcher = patch.dict(os.environ, {"OPENAI_API_KEY": "key", "OPENAI_ASSISTANT_ID": "asst"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        from cursor_logic.parser import PARSE_CACHE
+        PARSE_CACHE.clear()
+        self.client = MagicMock()
+
+    def _state(self, concurrency=4):
+        return patch('cursor_logic.parser._get_async_state', return_value=(self.client, asyncio.Semaphore(concurrency)))
+
+    def test_returns_structured_result(self):
+        from cursor_logic import parser
+        response = MagicMock()
+        response.choices = [MagicMock(message=MagicMock(content='{"title": "Pay rent", "priority": 1}'))]
+        self.client.chat.completions.create = AsyncMock(return_value=response)
+
+        with self._state():
+            result = asyncio.run(parser.parse_task_with_ai_async("pay rent"))
+        self.assertEqual(result["title"], "Pay rent")
+
+    def test_failures_raise_parse_error(self):
+        from cursor_logic import parser
+        self.client.chat.completions.create = AsyncMock(side_effect=RuntimeError("boom"))
+
+        with self._state(), self.assertRaises(parser.ParseError):
+            asyncio.run(parser.parse_task_with_ai_async("pay rent"))
+
+    def test_concurrency_is_capped(self):
+        from cursor_logic import parser
+        in_flight = []
+        peak = []
+        response = MagicMock()
+        response.choices = [MagicMock(message=MagicMock(content='{"title": "x"}'))]
+
+        async def create(**kwargs):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return response
+        self.client.chat.completions.create = create
+
+        async def run():
+            await asyncio.gather(*(parser.parse_task_with_ai_async(f"task {i}") for i in range(8)))
+        with self._state(concurrency=2):
+            asyncio.run(run())
+        self.assertEqual(max(peak), 2)
+
+    def test_timeout_cancels_assistant_run(self):
+        from cursor_logic import parser
+        self.client.beta.threads.create_and_run = AsyncMock(return_value=MagicMock(status="queued", thread_id="t", id="r"))
+        self.client.beta.threads.runs.retrieve = AsyncMock(return_value=MagicMock(status="in_progress", thread_id="t", id="r"))
+        self.client.beta.threads.runs.cancel = AsyncMock()
+
+        async def run():
+            with self.assertRaises(parser.ParseTimeoutError):
+                await parser.parse_task_with_ai_async("pay rent", timeout=0.2)
+            # Let the background cancellation finish
+            await asyncio.gather(*parser._background_tasks)
+
+        with self._state(), patch('cursor_logic.parser.OPENAI_PARSER_MODE', "assistant"):
+            asyncio.run(run())
+        self.client.beta.threads.runs.cancel.assert_awaited_once_with(thread_id="t", run_id="r")
+
+
+class TestParseCache(unittest.TestCase):
+    def test_normalized_text_hits_and_stats(self):
+        from cursor_logic.cache import ParseCache
+        cache = ParseCache(maxsize=2)
+        cache.set("Buy milk  tomorrow", {"title": "Buy milk"})
+
+        self.assertEqual(cache.get("buy milk tomorrow "), {"title": "Buy milk"})
+        self.assertIsNone(cache.get("pay rent"))
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+
+    def test_key_includes_date(self):
+        import datetime
+        from cursor_logic.cache import ParseCache
+        cache = ParseCache()
+        cache.set("buy milk tomorrow", {"title": "Buy milk", "due_date": "2025-01-02"})
+
+        with patch('cursor_logic.cache.datetime.date') as mock_date:
+            mock_date.today.return_value = datetime.date(2099, 1, 1)
+            self.assertIsNone(cache.get("buy milk tomorrow"))
+
+    def test_lru_eviction(self):
+        from cursor_logic.cache import ParseCache
+        cache = ParseCache(maxsize=2)
+        for text in ("a", "b"):
+            cache.set(text, {"title": text})
+        cache.get("a")
+        cache.set("c", {"title": "c"})
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+    def test_sqlite_persistence_survives_restart(self):
+        import tempfile
+        from cursor_logic.cache import ParseCache
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/parse.db"
+            ParseCache(path=path).set("pay rent", {"title": "Pay rent"})
+            self.assertEqual(ParseCache(path=path).get("pay rent"), {"title": "Pay rent"})
+
+    @patch('cursor_logic.parser.parse_task_with_completion')
+    def test_parser_skips_llm_on_hit(self, mock_parse):
+        from cursor_logic import parser
+        parser.PARSE_CACHE.clear()
+        mock_parse.return_value = {"title": "Pay rent"}
+
+        parser.parse_task_with_ai("pay rent")
+        parser.parse_task_with_ai("Pay rent")
+
+        mock_parse.assert_called_once()
+
+
+class TestRuleParser(unittest.TestCase):
+    # A Monday, so weekday arithmetic is easy to follow
+    TODAY = __import__("datetime").date(2026, 10, 12)
+
+    def _parse(self, text, mappings=None):
+        from cursor_logic.rules import parse_task_locally
+        return parse_task_locally(text, mappings, today=self.TODAY)
+
+    def test_relative_dates_and_priority(self):
+        result, confidence = self._parse("call mom next friday p1")
+        self.assertEqual(result, {"title": "Call mom", "due_date": "2026-10-23", "priority": 4,
+                                  "project": None, "section": None})
+        self.assertEqual(confidence, 1.0)
+        self.assertEqual(self._parse("finish report by friday, urgent")[0]["due_date"], "2026-10-16")
+        self.assertEqual(self._parse("pay rent in 3 days")[0]["due_date"], "2026-10-15")
+        self.assertEqual(self._parse("lunch at noon tomorrow")[0]["title"], "Lunch at noon")
+
+    def test_weekday_abbreviations_need_a_date_lead(self):
+        result, confidence = self._parse("buy sun cream")
+        self.assertEqual((result["title"], result["due_date"], confidence), ("Buy sun cream", None, 1.0))
+        self.assertEqual(self._parse("sat exam prep")[0]["title"], "Sat exam prep")
+        self.assertEqual(self._parse("submit report by fri")[0]["due_date"], "2026-10-16")
+        self.assertEqual(self._parse("wed. team sync")[0], {"title": "Team sync", "due_date": "2026-10-14",
+                                                           "priority": 1, "project": None, "section": None})
+
+    def test_impossible_date_goes_to_the_llm(self):
+        self.assertEqual(self._parse("pay rent 2026-02-30")[1], 0.0)
+
+    def test_every_priority_phrase_is_removed(self):
+        result, confidence = self._parse("ship v2 urgent, asap")
+        self.assertEqual((result["title"], result["priority"], confidence), ("Ship v2", 4, 1.0))
+        result, confidence = self._parse("ship v2 urgent, high priority")
+        self.assertEqual(result["title"], "Ship v2")
+        self.assertLess(confidence, 0.8)
+
+    def test_cut_phrase_leaves_no_space_before_punctuation(self):
+        result, _ = self._parse("review Q2 budget proposals by friday, for the Finance team")
+        self.assertEqual(result["title"], "Review Q2 budget proposals, for the Finance team")
+
+    def test_keyword_mapped_project(self):
+        mappings = {"Personal": {"keywords": [], "sections": {"Groceries": ["milk"]}}}
+        result, _ = self._parse("buy milk tomorrow", mappings)
+        self.assertEqual((result["project"], result["section"], result["due_date"]), ("Personal", "Groceries", "2026-10-13"))
+
+    def test_ambiguous_input_has_low_confidence(self):
+        from cursor_logic.rules import LOCAL_PARSE_THRESHOLD
+        for text in ("dentist every monday at 5pm", "move friday's standup to monday", "tomorrow"):
+            self.assertLess(self._parse(text)[1], LOCAL_PARSE_THRESHOLD, text)
+
+    @patch('cursor_logic.parser.parse_task_with_ai')
+    def test_parse_task_falls_back_only_when_unsure(self, mock_ai):
+        from cursor_logic import parser
+        mock_ai.return_value = {"title": "Dentist"}
+
+        self.assertEqual(parser.parse_task("buy milk p2")["priority"], 3)
+        mock_ai.assert_not_called()
+        self.assertEqual(parser.parse_task("dentist every monday at 5pm"), {"title": "Dentist"})
+        mock_ai.assert_called_once_with("dentist every monday at 5pm")
+
+
+class TestUpdateQueue(unittest.TestCase):
+    @staticmethod
+    def _update(update_id, chat_id):
+        return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": f"/add {update_id}"}}
+
+    def test_redelivered_update_is_processed_once(self):
+        from telegram_bot.update_queue import UpdateQueue
+        process = AsyncMock()
+
+        async def run():
+            queue = UpdateQueue(process, maxsize=10, workers=2)
+            await queue.start()
+            self.assertTrue(queue.put(self._update(1, 10)))
+            self.assertTrue(queue.put(self._update(1, 10)))
+            await queue.drain()
+            return queue.stats()
+        stats = asyncio.run(run())
+
+        process.assert_awaited_once()
+        self.assertEqual(stats["duplicates"], 1)
+
+    def test_same_chat_runs_in_order_other_chats_in_parallel(self):
+        from telegram_bot.update_queue import UpdateQueue
+        events = []
+
+        async def process(update_data):
+            chat_id = update_data["message"]["chat"]["id"]
+            events.append(("start", update_data["update_id"]))
+            # The first update of each chat is the slowest one
+            await asyncio.sleep(0.1 if update_data["update_id"] in (1, 3) else 0.01)
+            events.append(("end", update_data["update_id"]))
+
+        async def run():
+            queue = UpdateQueue(process, maxsize=10, workers=4)
+            await queue.start()
+            for update_id, chat_id in ((1, 10), (2, 10), (3, 20), (4, 20)):
+                queue.put(self._update(update_id, chat_id))
+            started = time.perf_counter()
+            await queue.drain()
+            return time.perf_counter() - started
+        elapsed = asyncio.run(run())
+
+        self.assertLess(events.index(("end", 1)), events.index(("start", 2)))
+        self.assertLess(events.index(("end", 3)), events.index(("start", 4)))
+        # Both chats ran side by side rather than one after the other
+        self.assertLess(elapsed, 0.2)
+
+    def test_flooding_chat_is_throttled_without_blocking_others(self):
+        from telegram_bot.update_queue import UpdateQueue
+
+        async def run():
+            release = asyncio.Event()
+
+            async def process(update_data):
+                await release.wait()
+
+            queue = UpdateQueue(process, maxsize=100, workers=2, max_per_chat=3)
+            await queue.start()
+            accepted = [queue.put(self._update(update_id, 10)) for update_id in range(5)]
+            self.assertEqual(accepted, [True, True, True, False, False])
+            self.assertTrue(queue.put(self._update(100, 20)))
+            release.set()
+            await queue.drain()
+            # Once the chat catches up it is accepted again
+            self.assertTrue(queue.put(self._update(5, 10)))
+            return queue.stats()
+        stats = asyncio.run(run())
+
+        self.assertEqual(stats["throttled"], 2)
+        self.assertEqual(stats["processed"], 4)
+
+    def test_deduplicator_is_bounded(self):
+        from telegram_bot.update_queue import UpdateDeduplicator
+        deduplicator = UpdateDeduplicator(window=60, maxsize=2)
+        for update_id in (1, 2, 3):
+            deduplicator.add(update_id)
+        self.assertNotIn(1, deduplicator)
+        self.assertIn(3, deduplicator)
+
+        expiring = UpdateDeduplicator(window=0, maxsize=10)
+        expiring.add(1)
+        time.sleep(0.001)
+        self.assertNotIn(1, expiring)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        from metrics import Histogram, render
+        histogram = Histogram("test_render_seconds", "A test histogram.", ["stage"], buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage="lookup")
+        histogram.observe(0.5, stage="lookup")
+        histogram.observe(5, stage="lookup")
+
+        text = render()
+        self.assertIn("# TYPE test_render_seconds histogram", text)
+        self.assertIn('test_render_seconds_bucket{stage="lookup",le="0.1"} 1', text)
+        self.assertIn('test_render_seconds_bucket{stage="lookup",le="1.0"} 2', text)
+        self.assertIn('test_render_seconds_bucket{stage="lookup",le="+Inf"} 3', text)
+        self.assertIn('test_render_seconds_count{stage="lookup"} 3', text)
+
+    def test_timer_wraps_async_functions(self):
+        from metrics import Histogram
+        histogram = Histogram("test_timer_seconds", "A test histogram.", ["handler"])
+
+        @histogram.time(handler="add")
+        async def handler():
+            return "done"
+
+        self.assertEqual(asyncio.run(handler()), "done")
+        self.assertEqual(histogram.count(handler="add"), 1)
+
+    def test_logged_errors_are_counted_by_type(self):
+        import logging
+        from metrics import ERRORS, ErrorCounter
+        logger = logging.getLogger("test.metrics")
+        handler = ErrorCounter()
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        try:
+            raise TimeoutError("slow")
+        except TimeoutError as e:
+            logger.error(f"Error: {e}", exc_info=True)
+
+        self.assertEqual(ERRORS.value(logger="test.metrics", type="TimeoutError"), 1)
+
+    def test_observe_overhead_is_negligible(self):
+        from metrics import UPSTREAM_LATENCY
+        start = time.perf_counter()
+        for _ in range(10_000):
+            UPSTREAM_LATENCY.observe(0.01, upstream="test", endpoint="GET /", status=200)
+        self.assertLess((time.perf_counter() - start) / 10_000, 20e-6)
+
+
+class TestTracing(unittest.TestCase):
+    def _logged_trace(self, logs):
+        self.assertEqual(len(logs.records), 1)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["event"], "slow_trace")
+        return entry
+
+    def test_slow_trace_logs_span_tree_across_threads(self):
+        from tracing import trace, span, record
+
+        @span("lookup")
+        def lookup():
+            time.sleep(0.01)
+            record("todoist GET /projects", time.monotonic() - 0.005, status=200)
+
+        async def run():
+            with trace("update", threshold=0, update_id=7):
+                with span("process_update"):
+                    await asyncio.to_thread(lookup)
+
+        with self.assertLogs("tracing", level="WARNING") as logs:
+            asyncio.run(run())
+        entry = self._logged_trace(logs)
+
+        self.assertEqual((entry["name"], entry["update_id"]), ("update", 7))
+        process_update = entry["spans"][0]
+        lookup_span = process_update["spans"][0]
+        self.assertEqual(lookup_span["name"], "lookup")
+        self.assertGreaterEqual(lookup_span["duration_ms"], 10)
+        self.assertEqual(lookup_span["spans"][0]["status"], 200)
+
+    def test_fast_trace_is_not_logged_and_spans_outside_traces_are_noops(self):
+        from tracing import trace, span, current_span
+        with span("orphan") as orphan:
+            self.assertIsNone(orphan)
+        with patch("tracing.logger") as logger:
+            with trace("update", threshold=10):
+                with span("stage") as stage:
+                    self.assertIs(current_span(), stage)
+        logger.warning.assert_not_called()
+        self.assertIsNone(current_span())
+
+    def test_update_queue_traces_queue_wait_and_failures(self):
+        from telegram_bot.update_queue import UpdateQueue
+        from tracing import span
+
+        async def process(update_data):
+            with span("handler"):
+                raise ValueError("boom")
+
+        async def run():
+            queue = UpdateQueue(process, maxsize=10, workers=1)
+            await queue.start()
+            queue.put({"update_id": 5, "message": {"chat": {"id": 1}}})
+            await queue.drain()
+
+        with patch("tracing.SLOW_UPDATE_THRESHOLD", 0), self.assertLogs("tracing", level="WARNING") as logs:
+            asyncio.run(run())
+        entry = self._logged_trace(logs)
+
+        self.assertEqual([s["name"] for s in entry["spans"]], ["queue_wait", "handler"])
+        self.assertEqual(entry["spans"][1]["error"], "ValueError")
+        self.assertEqual(entry["error"], "ValueError")
+
+
+def _import_main():
+    """Imports main with the environment it needs at import time."""
+    import importlib
+    import os
+    with patch.dict(os.environ, {"TELEGRAM_BOT_TOKEN": "123:TEST", "HOST_URL": "https://bot.example"}):
+        return importlib.import_module("main")
+
+
+async def _call_asgi(app, scope, messages):
+    """Runs an ASGI app against queued receive messages, returning what it sent."""
+    inbox = asyncio.Queue()
+    for message in messages:
+        inbox.put_nowait(message)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+    await app(scope, inbox.get, send)
+    return sent
+
+
+class TestColdStart(unittest.TestCase):
+    # Generous against the ~50 ms lazy import, well under the ~600 ms eager one
+    COLD_IMPORT_BUDGET = 0.25
+    # Importing main and building the application, which loads the Telegram
+    # stack, the handlers and the Todoist SDK: ~450 ms, the work a worker
+    # does before it can serve the first webhook
+    READY_BUDGET = 1.0
+    # Only needed by the first parse or the first non-webhook request
+    DEFERRED_PAST_READY = ("openai", "flask", "werkzeug")
+
+    def test_cold_start_is_fast_and_defers_heavy_modules(self):
+        import os
+        import subprocess
+        import sys
+        from benchmarks.cold_start import DEFERRED_MODULES
+        code = (
+            "import json, sys, time\n"
+            "started = time.perf_counter()\n"
+            "import main\n"
+            "imported = time.perf_counter()\n"
+            f"loaded = [m for m in {DEFERRED_MODULES!r} if m in sys.modules]\n"
+            "main.get_application()\n"
+            "ready = time.perf_counter()\n"
+            f"print(json.dumps([imported - started, ready - started, loaded, "
+            f"[m for m in {self.DEFERRED_PAST_READY!r} if m in sys.modules]]))\n"
+        )
+        env = dict(os.environ, TELEGRAM_BOT_TOKEN="123:TEST", HOST_URL="https://bot.example")
+        # Best of three, so one slow run on a busy machine doesn't fail the test
+        runs = [
+            json.loads(subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                      check=True).stdout)
+            for _ in range(3)
+        ]
+
+        self.assertEqual(runs[0][2], [])
+        self.assertEqual(runs[0][3], [])
+        self.assertLess(min(run[0] for run in runs), self.COLD_IMPORT_BUDGET)
+        self.assertLess(min(run[1] for run in runs), self.READY_BUDGET)
+
+
+class TestMainLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.main = _import_main()
+        self.bot = MagicMock()
+        self.bot.get_webhook_info = AsyncMock(return_value=MagicMock(url="https://bot.example/webhook"))
+        self.bot.set_webhook = AsyncMock()
+        for patcher in (
+            patch.object(self.main.application, "bot", self.bot),
+            patch.object(self.main.application, "initialize", AsyncMock()),
+            patch.object(self.main.application, "shutdown", AsyncMock()),
+            # main imports these at startup, so they are patched where they are defined
+            patch("todoist.api_async.sync_task_mirror", AsyncMock()),
+            patch("todoist.client.prewarm", AsyncMock()),
+            patch("telegram_bot.handlers.PROJECT_MAPPINGS", MagicMock()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_lifespan_initializes_once_and_skips_correct_webhook(self):
+        """Startup runs once, and set_webhook is skipped when the URL already matches."""
+        sent = asyncio.run(_call_asgi(self.main.app, {"type": "lifespan"}, [
+            {"type": "lifespan.startup"}, {"type": "lifespan.shutdown"},
+        ]))
+
+        self.assertEqual([m["type"] for m in sent], ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        self.main.application.initialize.assert_awaited_once()
+        self.bot.get_webhook_info.assert_awaited_once()
+        self.bot.set_webhook.assert_not_called()
+        self.main.application.shutdown.assert_awaited_once()
+
+    def test_lifespan_sets_outdated_webhook(self):
+        self.bot.get_webhook_info.return_value = MagicMock(url="https://old.example/webhook")
+        asyncio.run(_call_asgi(self.main.app, {"type": "lifespan"}, [
+            {"type": "lifespan.startup"}, {"type": "lifespan.shutdown"},
+        ]))
+        self.bot.set_webhook.assert_awaited_once_with(url="https://bot.example/webhook", secret_token=None)
+
+    @patch("main.WEBHOOK_SECRET", "s3cret")
+    def test_lifespan_sends_secret_for_unchanged_webhook(self):
+        """The secret isn't visible in getWebhookInfo, so it is always sent when configured."""
+        asyncio.run(_call_asgi(self.main.app, {"type": "lifespan"}, [
+            {"type": "lifespan.startup"}, {"type": "lifespan.shutdown"},
+        ]))
+        self.bot.set_webhook.assert_awaited_once_with(url="https://bot.example/webhook", secret_token="s3cret")
+
+    @staticmethod
+    def _http_scope(method, path, headers=()):
+        return {
+            "type": "http", "method": method, "path": path, "query_string": b"", "headers": list(headers),
+            "http_version": "1.1", "scheme": "http", "server": ("test", 80), "root_path": "",
+        }
+
+    def test_metrics_endpoint(self):
+        scope = self._http_scope("GET", "/metrics")
+        sent = asyncio.run(_call_asgi(self.main.app, scope, [{"type": "http.request", "body": b""}]))
+
+        self.assertEqual(sent[0]["status"], 200)
+        body = b"".join(message.get("body", b"") for message in sent[1:]).decode()
+        for name in ("bot_handler_duration_seconds", "bot_update_queue_depth", "bot_id_cache_hits_total",
+                     "bot_errors_total"):
+            self.assertIn(f"# TYPE {name} ", body)
+
+    def test_health_check_does_no_network_io(self):
+        """GET / answers without touching Telegram."""
+        scope = self._http_scope("GET", "/")
+        sent = asyncio.run(_call_asgi(self.main.app, scope, [{"type": "http.request", "body": b""}]))
+
+        self.assertEqual(sent[0]["status"], 200)
+        self.bot.get_webhook_info.assert_not_called()
+        self.main.application.initialize.assert_not_called()
+
+    def _post_updates(self, bodies, queue, headers=()):
+        """Posts webhook bodies through main.app and drains the queue afterwards."""
+        async def run():
+            await queue.start()
+            statuses = []
+            for body in bodies:
+                sent = await _call_asgi(self.main.app, self._http_scope("POST", "/webhook", headers), [
+                    {"type": "http.request", "body": body},
+                ])
+                statuses.append(sent[0]["status"])
+            await queue.drain()
+            return statuses
+        return asyncio.run(run())
+
+    def test_webhook_acks_before_processing(self):
+        """The webhook returns 200 before the update has been processed."""
+        from telegram_bot.update_queue import UpdateQueue
+        processed = []
+        acked_before_processing = []
+
+        async def process(update_data):
+            await asyncio.sleep(0.05)
+            processed.append(update_data["update_id"])
+
+        queue = UpdateQueue(process, maxsize=10, workers=2)
+        with patch.object(self.main, "update_queue", queue):
+            async def run():
+                await queue.start()
+                sent = await _call_asgi(self.main.app, self._http_scope("POST", "/webhook"), [
+                    {"type": "http.request", "body": b'{"update_id": 1}'},
+                ])
+                acked_before_processing.append(not processed)
+                await queue.drain()
+                return sent
+            sent = asyncio.run(run())
+
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(acked_before_processing, [True])
+        self.assertEqual(processed, [1])
+        self.assertEqual(queue.stats()["processed"], 1)
+
+    def test_webhook_rejects_malformed_updates_and_applies_backpressure(self):
+        from telegram_bot.update_queue import UpdateQueue
+
+        async def process(update_data):
+            await asyncio.sleep(0.01)
+
+        queue = UpdateQueue(process, maxsize=1, workers=1)
+        with patch.object(self.main, "update_queue", queue):
+            # The consumer can't run between requests, so the second valid update finds the queue full
+            statuses = self._post_updates([b"not json", b'{"no_id": 1}', b'{"update_id": 1}', b'{"update_id": 2}'], queue)
+
+        self.assertEqual(statuses, [400, 400, 200, 503])
+        self.assertEqual(queue.stats()["rejected"], 1)
+
+    def test_webhook_checks_secret_token(self):
+        from telegram_bot.update_queue import UpdateQueue
+        queue = UpdateQueue(AsyncMock(), maxsize=10, workers=1)
+        with patch.object(self.main, "update_queue", queue), \
+             patch.object(self.main, "WEBHOOK_SECRET", "s3cret"):
+            denied = self._post_updates([b'{"update_id": 1}'], queue, [(b"x-telegram-bot-api-secret-token", b"wrong")])
+            allowed = self._post_updates([b'{"update_id": 2}'], queue, [(b"x-telegram-bot-api-secret-token", b"s3cret")])
+
+        self.assertEqual((denied, allowed), ([403], [200]))
+
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -1,7 +1,15 @@
 import os
 import logging
 import re
+import uuid
 from todoist_api_python.api import TodoistAPI
+from metrics import OPERATION_LATENCY
+from tracing import span
+from todoist.cache import get_id_cache
+from todoist.singleflight import get_single_flight
+from todoist.client import get_api, get_http_client
+from todoist.mirror import get_task_mirror
+from todoist.sync import command, command_error
 
 logger = logging.getLogger(__name__)
 
@@ -12,86 +20,357 @@ def _sanitize_name(name: str) -> str:
     # Replace multiple whitespace characters with a single space
     return re.sub(r'\s+', ' ', sanitized).strip()
 
-def _get_or_create_project_by_name(api: TodoistAPI, project_name: str):
-    """Finds a project by name or creates it if it doesn't exist."""
+def _scan_page(items, sanitized_target_name: str, cache, key_prefix: tuple):
+    """
+    Returns the ID of the first project/section in a page whose sanitized name
+    matches, warming the cache with every entry it pages through.
+    """
+    found_id = None
+    # One write for the whole page, so a shared backend commits once, not per entry
+    entries = []
+    for item in items:
+        sanitized_name = _sanitize_name(item.name).lower()
+        if cache is not None:
+            entries.append((key_prefix + (sanitized_name,), item.id))
+        if found_id is None and sanitized_name == sanitized_target_name:
+            found_id = item.id
+            if cache is None:
+                break
+    if entries:
+        cache.set_many(entries)
+    return found_id
+
+def _get_or_create_project_by_name(api: TodoistAPI, project_name: str, cache=None, flights=None):
+    """
+    Finds a project by name or creates it if it doesn't exist.
+    When a cache is given, a warm lookup skips the project listing entirely.
+    """
     if not project_name:
         return None
     try:
-        projects_pages = api.get_projects()
         sanitized_target_name = _sanitize_name(project_name).lower()
+        if cache is not None:
+            project_id = cache.get(("project", sanitized_target_name))
+            if project_id:
+                return project_id
+        if flights is not None:
+            # Concurrent callers share one lookup/create instead of each adding the project
+            return flights.do(
+                ("project", sanitized_target_name),
+                lambda: _get_or_create_project_by_name(api, project_name, cache),
+            )
 
+        projects_pages = api.get_projects()
+        found_id = None
         for page in projects_pages:
-            for project in page:
-                if _sanitize_name(project.name).lower() == sanitized_target_name:
-                    return project.id
+            match = _scan_page(page, sanitized_target_name, cache, ("project",))
+            found_id = found_id or match
+            if found_id and cache is None:
+                break
+        if found_id:
+            return found_id
         # If not found, create it
         logger.info(f"Project '{project_name}' not found. Creating it.")
         new_project = api.add_project(name=project_name)
+        if cache is not None:
+            cache.set(("project", sanitized_target_name), new_project.id)
         return new_project.id
     except Exception as e:
         logger.error(f"Error handling project '{project_name}': {e}", exc_info=True)
         return None
 
-def _get_or_create_section_by_name(api: TodoistAPI, section_name: str, project_id: str):
+def _get_or_create_section_by_name(api: TodoistAPI, section_name: str, project_id: str, cache=None, flights=None):
     """Finds a section by name within a project or creates it."""
     if not section_name or not project_id:
         return None
     try:
-        sections_pages = api.get_sections(project_id=project_id)
         sanitized_target_name = _sanitize_name(section_name).lower()
+        if cache is not None:
+            section_id = cache.get(("section", project_id, sanitized_target_name))
+            if section_id:
+                return section_id
+        if flights is not None:
+            return flights.do(
+                ("section", project_id, sanitized_target_name),
+                lambda: _get_or_create_section_by_name(api, section_name, project_id, cache),
+            )
 
+        sections_pages = api.get_sections(project_id=project_id)
+        found_id = None
         for page in sections_pages:
-            for section in page:
-                if _sanitize_name(section.name).lower() == sanitized_target_name:
-                    return section.id
+            match = _scan_page(page, sanitized_target_name, cache, ("section", project_id))
+            found_id = found_id or match
+            if found_id and cache is None:
+                break
+        if found_id:
+            return found_id
         # If not found, create it
         logger.info(f"Section '{section_name}' not found in project. Creating it.")
         new_section = api.add_section(name=section_name, project_id=project_id)
+        if cache is not None:
+            cache.set(("section", project_id, sanitized_target_name), new_section.id)
         return new_section.id
     except Exception as e:
         logger.error(f"Error handling section '{section_name}': {e}", exc_info=True)
         return None
 
+def _is_stale_id_error(error: Exception) -> bool:
+    """Checks whether Todoist rejected a request because of an unknown ID."""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in (400, 403, 404)
+
 def create_task(api_token: str, task_content: str, project_name: str = None, section_name: str = None, due_string: str = None, priority: int = None):
     """
     Creates a new task in Todoist, automatically handling projects and sections.
     """
     try:
-        api = TodoistAPI(api_token)
-        project_id = None
-        if project_name:
-            project_id = _get_or_create_project_by_name(api, project_name)
-
-        section_id = None
-        if project_id and section_name:
-            section_id = _get_or_create_section_by_name(api, section_name, project_id)
-
-        task = api.add_task(
-            content=task_content,
-            project_id=project_id,
-            section_id=section_id,
-            due_string=due_string,
-            priority=priority
-        )
-        return task
+        api = get_api(api_token)
+        cache = get_id_cache(api_token)
+        flights = get_single_flight(api_token)
+        for attempt in range(2):
+            project_id = None
+            if project_name:
+                with OPERATION_LATENCY.time(operation="project_lookup"), span("get_or_create_project"):
+                    project_id = _get_or_create_project_by_name(api, project_name, cache, flights)
+
+            section_id = None
+            if project_id and section_name:
+                with OPERATION_LATENCY.time(operation="section_lookup"), span("get_or_create_section"):
+                    section_id = _get_or_create_section_by_name(api, section_name, project_id, cache, flights)
+
+            try:
+                with OPERATION_LATENCY.time(operation="add_task"), span("add_task"):
+                    task = api.add_task(
+                        content=task_content,
+                        project_id=project_id,
+                        section_id=section_id,
+                        due_string=due_string,
+                        priority=priority
+                    )
+                get_task_mirror(api_token).add_task(task)
+                return task
+            except Exception as e:
+                if attempt or not project_id or not _is_stale_id_error(e):
+                    raise
+                # The cached IDs may point at a deleted project/section; refetch once
+                logger.warning(f"Todoist rejected cached project/section IDs, retrying: {e}")
+                cache.invalidate(value=project_id)
     except Exception as e:
         logger.error(f"Error creating task: {e}", exc_info=True)
         return None
 
+def _known_ids(mirror):
+    """Returns the mirror's project IDs by sanitized name and section IDs by (project_id, sanitized name)."""
+    projects = {_sanitize_name(p["name"]).lower(): project_id for project_id, p in mirror.projects.items()}
+    sections = {
+        (s["project_id"], _sanitize_name(s["name"]).lower()): section_id
+        for section_id, s in mirror.sections.items()
+    }
+    return projects, sections
+
+def _missing_containers(entries, cache, mirror, sections: bool = False):
+    """
+    Returns (key, add_type, args) for each project the entries need that isn't
+    known yet or, with `sections`, each missing section of a known project.
+    """
+    known_projects, known_sections = _known_ids(mirror)
+    missing = {}
+    for _, project_name, section_name in entries:
+        if not project_name:
+            continue
+        name = _sanitize_name(project_name).lower()
+        project_id = cache.get(("project", name)) or known_projects.get(name)
+        if not sections:
+            if project_id is None:
+                missing.setdefault(("project", name), ("project_add", {"name": project_name}))
+        elif project_id and section_name:
+            name = _sanitize_name(section_name).lower()
+            key = ("section", project_id, name)
+            if not (cache.get(key) or known_sections.get((project_id, name))):
+                missing.setdefault(key, ("section_add", {"name": section_name, "project_id": project_id}))
+    return [(key, add_type, args) for key, (add_type, args) in missing.items()]
+
+def _known_container(key, cache, mirror):
+    if key[0] == "project":
+        return cache.get(key) or _known_ids(mirror)[0].get(key[1])
+    return cache.get(key) or _known_ids(mirror)[1].get(key[1:])
+
+def _created_container(data, entry, key, cache):
+    """Reads the real ID of a project or section created on its own; see _create_container."""
+    error = command_error(data, entry)
+    if error is not None:
+        raise RuntimeError(f"Todoist rejected {entry['type']} '{entry['args']['name']}': {error}")
+    container_id = data["temp_id_mapping"][entry["temp_id"]]
+    cache.set(key, container_id)
+    return container_id
+
+def _create_container(client, api_token, cache, mirror, key, add_type, args):
+    """Creates one project or section, unless a flight that just landed already did."""
+    known_id = _known_container(key, cache, mirror)
+    if known_id:
+        return known_id
+    logger.info(f"{add_type.split('_')[0].title()} '{args['name']}' not found. Creating it.")
+    entry = command(add_type, args, temp_id=str(uuid.uuid4()))
+    return _created_container(mirror.sync_commands(client, api_token, [entry]), entry, key, cache)
+
+def _ensure_containers(client, api_token: str, entries, cache, mirror) -> None:
+    """
+    Creates the projects, then sections, that a batch needs before the batch
+    is sent. Each create runs through the account's single-flight group under
+    the same key as _get_or_create_*, so concurrent batches and single adds
+    needing the same new project share one create.
+    """
+    flights = get_single_flight(api_token)
+    for sections in (False, True):
+        for key, add_type, args in _missing_containers(entries, cache, mirror, sections):
+            flights.do(key, lambda: _create_container(client, api_token, cache, mirror, key, add_type, args))
+
+def _add_task_commands(entries, cache, mirror, uuids=None):
+    """
+    Builds the Sync API commands adding each (content, project_name, section_name)
+    entry. Projects and sections resolve through the cache or the mirror; any
+    still missing (see _ensure_containers) are added once per batch under a temp
+    ID the task commands can refer to.
+    `uuids` optionally fixes each item command's uuid, making resubmission safe.
+    Returns (commands, item commands in entry order, created project/section commands).
+    """
+    projects, sections = _known_ids(mirror)
+    commands, items, created, resolved = [], [], [], {}
+
+    def resolve(key, known_id, add_type, args):
+        if key not in resolved:
+            resolved[key] = cache.get(key) or known_id
+            if resolved[key] is None:
+                logger.info(f"{add_type.split('_')[0].title()} '{args['name']}' not found. Creating it.")
+                entry = command(add_type, args, temp_id=str(uuid.uuid4()))
+                commands.append(entry)
+                created.append((key, entry))
+                resolved[key] = entry["temp_id"]
+        return resolved[key]
+
+    for index, (content, project_name, section_name) in enumerate(entries):
+        args = {"content": content}
+        if project_name:
+            name = _sanitize_name(project_name).lower()
+            project_id = resolve(("project", name), projects.get(name), "project_add", {"name": project_name})
+            args["project_id"] = project_id
+            if section_name:
+                name = _sanitize_name(section_name).lower()
+                args["section_id"] = resolve(
+                    ("section", project_id, name), sections.get((project_id, name)),
+                    "section_add", {"name": section_name, "project_id": project_id},
+                )
+        entry = command("item_add", args, temp_id=str(uuid.uuid4()), command_uuid=uuids[index] if uuids else None)
+        commands.append(entry)
+        items.append(entry)
+    return commands, items, created
+
+def _added_tasks(data, items, created, cache, mirror):
+    """
+    Reads a batched add's response: caches the IDs of created projects and
+    sections and returns the new Task for each item, or None where it failed.
+    """
+    mapping = data.get("temp_id_mapping", {})
+    for key, entry in created:
+        if command_error(data, entry) is None and entry["temp_id"] in mapping:
+            if key[0] == "section":
+                # A section added along with its project was keyed by the project's temp ID
+                key = (key[0], mapping.get(key[1], key[1]), key[2])
+            cache.set(key, mapping[entry["temp_id"]])
+    tasks = []
+    for entry in items:
+        error = command_error(data, entry)
+        if error:
+            logger.error(f"Failed to add task '{entry['args']['content']}': {error}")
+            if entry["args"].get("project_id"):
+                # A cached project/section may have been deleted; look it up again next time
+                cache.invalidate(value=entry["args"]["project_id"])
+        tasks.append(None if error else mirror.tasks.get(mapping.get(entry["temp_id"])))
+    return tasks
+
+def create_tasks(api_token: str, entries):
+    """
+    Creates many tasks with one batched Sync API request. `entries` holds
+    (content, project_name, section_name) tuples; missing projects and
+    sections are created in the same request. Returns a Task, or None if
+    that entry failed, for each entry.
+    """
+    try:
+        client = get_http_client(api_token)
+        cache = get_id_cache(api_token)
+        mirror = get_task_mirror(api_token)
+        if mirror.is_stale():
+            mirror.sync(client, api_token)
+        _ensure_containers(client, api_token, entries, cache, mirror)
+        commands, items, created = _add_task_commands(entries, cache, mirror)
+        data = mirror.sync_commands(client, api_token, commands)
+        return _added_tasks(data, items, created, cache, mirror)
+    except Exception as e:
+        logger.error(f"Error creating tasks: {e}", exc_info=True)
+        return [None] * len(entries)
+
+def _close_results(data, entries):
+    """Maps each closed task ID to None on success or Todoist's error."""
+    results = {}
+    for entry in entries:
+        error = command_error(data, entry)
+        if error:
+            logger.error(f"Failed to complete task {entry['args']['id']}: {error}")
+        results[entry["args"]["id"]] = error
+    return results
+
+def complete_tasks(api_token: str, task_ids):
+    """
+    Closes many tasks with one batched Sync API request. Returns a dict mapping
+    each task ID to None on success or the error Todoist reported.
+    """
+    entries = [command("item_close", {"id": task_id}) for task_id in dict.fromkeys(task_ids)]
+    try:
+        mirror = get_task_mirror(api_token)
+        data = mirror.sync_commands(get_http_client(api_token), api_token, entries)
+        return _close_results(data, entries)
+    except Exception as e:
+        logger.error(f"Error completing tasks: {e}", exc_info=True)
+        return {entry["args"]["id"]: str(e) for entry in entries}
+
+def _resolve_in(mirror, names, limit):
+    return [(mirror.find_by_content(name), mirror.search(name, limit)) for name in names]
+
+def _tasks_in(mirror, project_name: str = None, section_name: str = None):
+    """Returns the mirror's active tasks in the named project and/or section."""
+    def ids(store, name):
+        target = _sanitize_name(name).lower()
+        return {entry_id for entry_id, entry in store.items() if _sanitize_name(entry["name"]).lower() == target}
+
+    project_ids = ids(mirror.projects, project_name) if project_name else None
+    section_ids = ids(mirror.sections, section_name) if section_name else None
+    return [
+        task for task in list(mirror.tasks.values())
+        if (project_ids is None or task.project_id in project_ids)
+        and (section_ids is None or task.section_id in section_ids)
+    ]
+
+def _find_in_mirror(api_token: str, lookup):
+    """
+    Runs a lookup against the local task mirror, pulling a delta first when the
+    mirror is stale, or afterwards on a miss in case the task was added elsewhere.
+    """
+    mirror = get_task_mirror(api_token)
+    synced = mirror.is_stale()
+    if synced:
+        mirror.sync(get_http_client(api_token), api_token)
+    result = lookup(mirror)
+    if not result and not synced:
+        mirror.sync(get_http_client(api_token), api_token)
+        result = lookup(mirror)
+    return result
+
 def find_tasks_by_name(api_token: str, task_name: str):
     """
     Finds active tasks that contain the given name (case-insensitive).
     """
     try:
-        api = TodoistAPI(api_token)
-        tasks_pages = api.get_tasks()
-        found_tasks = []
-
-        for page in tasks_pages:
-            for task in page:
-                if hasattr(task, 'content') and task_name.strip().lower() in task.content.strip().lower():
-                    found_tasks.append(task)
-        return found_tasks
+        return _find_in_mirror(api_token, lambda mirror: mirror.find_by_name(task_name))
     except Exception as e:
         logger.error(f"Error finding tasks: {e}", exc_info=True)
         return []
@@ -101,23 +380,52 @@ def find_task_by_content(api_token: str, task_content: str):
     Finds an active task by its exact content.
     """
     try:
-        api = TodoistAPI(api_token)
-        tasks_pages = api.get_tasks()
-        for page in tasks_pages:
-            for task in page:
-                if task.content.strip() == task_content.strip():
-                    return task
-        return None
+        return _find_in_mirror(api_token, lambda mirror: mirror.find_by_content(task_content))
     except Exception as e:
         logger.error(f"Error finding task by content: {e}", exc_info=True)
         return None
 
+def find_similar_tasks(api_token: str, text: str, limit: int = 5):
+    """
+    Returns up to `limit` (score, task) pairs for active tasks resembling the
+    text, best first. Scores run from 0 to 1.
+    """
+    try:
+        return _find_in_mirror(api_token, lambda mirror: mirror.search(text, limit))
+    except Exception as e:
+        logger.error(f"Error searching tasks: {e}", exc_info=True)
+        return []
+
+def resolve_tasks(api_token: str, names, limit: int = 5):
+    """
+    Resolves many task names against one snapshot of the mirror. Returns, per
+    name, the exact match (or None) and up to `limit` (score, task) near misses.
+    """
+    try:
+        mirror = get_task_mirror(api_token)
+        if mirror.is_stale():
+            mirror.sync(get_http_client(api_token), api_token)
+        return _resolve_in(mirror, names, limit)
+    except Exception as e:
+        logger.error(f"Error resolving tasks: {e}", exc_info=True)
+        return [(None, []) for _ in names]
+
+def find_tasks_in(api_token: str, project_name: str = None, section_name: str = None):
+    """
+    Finds active tasks in the named project and/or section.
+    """
+    try:
+        return _find_in_mirror(api_token, lambda mirror: _tasks_in(mirror, project_name, section_name))
+    except Exception as e:
+        logger.error(f"Error finding tasks: {e}", exc_info=True)
+        return []
+
 def update_task_content(api_token: str, task_id: str, new_content: str):
     """
     Updates the content of an existing task.
     """
     try:
-        api = TodoistAPI(api_token)
+        api = get_api(api_token)
         is_success = api.update_task(task_id=task_id, content=new_content)
         return is_success
     except Exception as e:
@@ -129,8 +437,10 @@ def delete_task(api_token: str, task_id: str):
     Deletes a task.
     """
     try:
-        api = TodoistAPI(api_token)
+        api = get_api(api_token)
         is_success = api.delete_task(task_id=task_id)
+        if is_success:
+            get_task_mirror(api_token).remove_task(task_id)
         return is_success
     except Exception as e:
         logger.error(f"Error deleting task: {e}", exc_info=True)
@@ -141,8 +451,10 @@ def complete_task(api_token: str, task_id: str):
     Marks a task as complete.
     """
     try:
-        api = TodoistAPI(api_token)
-        is_success = api.close_task(task_id=task_id)
+        api = get_api(api_token)
+        is_success = api.complete_task(task_id=task_id)
+        if is_success:
+            get_task_mirror(api_token).remove_task(task_id)
         return is_success
     except Exception as e:
         logger.error(f"Error completing task: {e}", exc_info=True)
@@ -0,0 +1,290 @@
+import uuid
+import asyncio
+import logging
+from todoist_api_python.api_async import TodoistAPIAsync
+from todoist.api import (
+    _sanitize_name, _scan_page, _is_stale_id_error, _add_task_commands, _added_tasks,
+    _close_results, _resolve_in, _tasks_in, _missing_containers, _known_container, _created_container,
+)
+from todoist.sync import command
+from metrics import OPERATION_LATENCY
+from tracing import span
+from todoist.cache import get_id_cache
+from todoist.singleflight import get_single_flight
+from todoist.client import get_async_api, get_async_http_client
+from todoist.mirror import get_task_mirror
+
+logger = logging.getLogger(__name__)
+
+# Asyncio-native versions of the todoist.api operations. They share one
+# httpx.AsyncClient per token, so handlers can await Todoist I/O directly
+# instead of offloading blocking calls to the default thread pool.
+
+async def _get_or_create_project_by_name(api: TodoistAPIAsync, project_name: str, cache=None, flights=None):
+    """Finds a project by name or creates it if it doesn't exist."""
+    if not project_name:
+        return None
+    try:
+        sanitized_target_name = _sanitize_name(project_name).lower()
+        if cache is not None:
+            project_id = cache.get(("project", sanitized_target_name))
+            if project_id:
+                return project_id
+        if flights is not None:
+            # Concurrent callers share one lookup/create instead of each adding the project
+            return await flights.do_async(
+                ("project", sanitized_target_name),
+                lambda: _get_or_create_project_by_name(api, project_name, cache),
+            )
+
+        found_id = None
+        async for page in await api.get_projects():
+            match = _scan_page(page, sanitized_target_name, cache, ("project",))
+            found_id = found_id or match
+            if found_id and cache is None:
+                break
+        if found_id:
+            return found_id
+        logger.info(f"Project '{project_name}' not found. Creating it.")
+        new_project = await api.add_project(name=project_name)
+        if cache is not None:
+            cache.set(("project", sanitized_target_name), new_project.id)
+        return new_project.id
+    except Exception as e:
+        logger.error(f"Error handling project '{project_name}': {e}", exc_info=True)
+        return None
+
+async def _get_or_create_section_by_name(api: TodoistAPIAsync, section_name: str, project_id: str, cache=None, flights=None):
+    """Finds a section by name within a project or creates it."""
+    if not section_name or not project_id:
+        return None
+    try:
+        sanitized_target_name = _sanitize_name(section_name).lower()
+        if cache is not None:
+            section_id = cache.get(("section", project_id, sanitized_target_name))
+            if section_id:
+                return section_id
+        if flights is not None:
+            return await flights.do_async(
+                ("section", project_id, sanitized_target_name),
+                lambda: _get_or_create_section_by_name(api, section_name, project_id, cache),
+            )
+
+        found_id = None
+        async for page in await api.get_sections(project_id=project_id):
+            match = _scan_page(page, sanitized_target_name, cache, ("section", project_id))
+            found_id = found_id or match
+            if found_id and cache is None:
+                break
+        if found_id:
+            return found_id
+        logger.info(f"Section '{section_name}' not found in project. Creating it.")
+        new_section = await api.add_section(name=section_name, project_id=project_id)
+        if cache is not None:
+            cache.set(("section", project_id, sanitized_target_name), new_section.id)
+        return new_section.id
+    except Exception as e:
+        logger.error(f"Error handling section '{section_name}': {e}", exc_info=True)
+        return None
+
+async def create_task(api_token: str, task_content: str, project_name: str = None, section_name: str = None, due_string: str = None, priority: int = None):
+    """
+    Creates a new task in Todoist, automatically handling projects and sections.
+    """
+    try:
+        api = get_async_api(api_token)
+        cache = get_id_cache(api_token)
+        flights = get_single_flight(api_token)
+        for attempt in range(2):
+            project_id = None
+            if project_name:
+                with OPERATION_LATENCY.time(operation="project_lookup"), span("get_or_create_project"):
+                    project_id = await _get_or_create_project_by_name(api, project_name, cache, flights)
+
+            section_id = None
+            if project_id and section_name:
+                with OPERATION_LATENCY.time(operation="section_lookup"), span("get_or_create_section"):
+                    section_id = await _get_or_create_section_by_name(api, section_name, project_id, cache, flights)
+
+            try:
+                with OPERATION_LATENCY.time(operation="add_task"), span("add_task"):
+                    task = await api.add_task(
+                        content=task_content,
+                        project_id=project_id,
+                        section_id=section_id,
+                        due_string=due_string,
+                        priority=priority
+                    )
+                get_task_mirror(api_token).add_task(task)
+                return task
+            except Exception as e:
+                if attempt or not project_id or not _is_stale_id_error(e):
+                    raise
+                logger.warning(f"Todoist rejected cached project/section IDs, retrying: {e}")
+                cache.invalidate(value=project_id)
+    except Exception as e:
+        logger.error(f"Error creating task: {e}", exc_info=True)
+        return None
+
+async def _create_container(client, api_token, cache, mirror, key, add_type, args):
+    """See todoist.api._create_container."""
+    known_id = _known_container(key, cache, mirror)
+    if known_id:
+        return known_id
+    logger.info(f"{add_type.split('_')[0].title()} '{args['name']}' not found. Creating it.")
+    entry = command(add_type, args, temp_id=str(uuid.uuid4()))
+    return _created_container(await mirror.sync_commands_async(client, api_token, [entry]), entry, key, cache)
+
+async def _ensure_containers(client, api_token: str, entries, cache, mirror) -> None:
+    """See todoist.api._ensure_containers; creates run concurrently."""
+    flights = get_single_flight(api_token)
+    for sections in (False, True):
+        await asyncio.gather(*(
+            flights.do_async(key, lambda key=key, add_type=add_type, args=args: _create_container(
+                client, api_token, cache, mirror, key, add_type, args))
+            for key, add_type, args in _missing_containers(entries, cache, mirror, sections)
+        ))
+
+async def create_tasks(api_token: str, entries):
+    """See todoist.api.create_tasks."""
+    try:
+        client = get_async_http_client(api_token)
+        cache = get_id_cache(api_token)
+        mirror = get_task_mirror(api_token)
+        if mirror.is_stale():
+            await mirror.sync_async(client, api_token)
+        await _ensure_containers(client, api_token, entries, cache, mirror)
+        commands, items, created = _add_task_commands(entries, cache, mirror)
+        data = await mirror.sync_commands_async(client, api_token, commands)
+        return _added_tasks(data, items, created, cache, mirror)
+    except Exception as e:
+        logger.error(f"Error creating tasks: {e}", exc_info=True)
+        return [None] * len(entries)
+
+async def _find_in_mirror(api_token: str, lookup, sync_on_miss: bool = True):
+    """See todoist.api._find_in_mirror."""
+    mirror = get_task_mirror(api_token)
+    synced = mirror.is_stale()
+    if synced:
+        await mirror.sync_async(get_async_http_client(api_token), api_token)
+    result = lookup(mirror)
+    if not result and not synced and sync_on_miss:
+        await mirror.sync_async(get_async_http_client(api_token), api_token)
+        result = lookup(mirror)
+    return result
+
+async def sync_task_mirror(api_token: str) -> bool:
+    """Runs the initial full sync of the task mirror, e.g. at startup; returns whether it is synced."""
+    mirror = get_task_mirror(api_token)
+    if mirror.is_synced:
+        return True
+    try:
+        await mirror.sync_async(get_async_http_client(api_token), api_token)
+        logger.info(f"Task mirror synced with {len(mirror.tasks)} active tasks.")
+    except Exception as e:
+        logger.error(f"Error syncing task mirror: {e}", exc_info=True)
+    return mirror.is_synced
+
+async def find_tasks_by_name(api_token: str, task_name: str):
+    """
+    Finds active tasks that contain the given name (case-insensitive).
+    """
+    try:
+        return await _find_in_mirror(api_token, lambda mirror: mirror.find_by_name(task_name))
+    except Exception as e:
+        logger.error(f"Error finding tasks: {e}", exc_info=True)
+        return []
+
+async def find_task_by_content(api_token: str, task_content: str, sync_on_miss: bool = True):
+    """
+    Finds an active task by its exact content. With sync_on_miss off, a miss
+    in a fresh mirror is final, e.g. when a batch lookup follows anyway.
+    """
+    try:
+        return await _find_in_mirror(api_token, lambda mirror: mirror.find_by_content(task_content), sync_on_miss)
+    except Exception as e:
+        logger.error(f"Error finding task by content: {e}", exc_info=True)
+        return None
+
+async def find_similar_tasks(api_token: str, text: str, limit: int = 5):
+    """
+    Returns up to `limit` (score, task) pairs for active tasks resembling the
+    text, best first. Scores run from 0 to 1.
+    """
+    try:
+        return await _find_in_mirror(api_token, lambda mirror: mirror.search(text, limit))
+    except Exception as e:
+        logger.error(f"Error searching tasks: {e}", exc_info=True)
+        return []
+
+async def resolve_tasks(api_token: str, names, limit: int = 5):
+    """See todoist.api.resolve_tasks."""
+    try:
+        mirror = get_task_mirror(api_token)
+        if mirror.is_stale():
+            await mirror.sync_async(get_async_http_client(api_token), api_token)
+        return _resolve_in(mirror, names, limit)
+    except Exception as e:
+        logger.error(f"Error resolving tasks: {e}", exc_info=True)
+        return [(None, []) for _ in names]
+
+async def find_tasks_in(api_token: str, project_name: str = None, section_name: str = None):
+    """
+    Finds active tasks in the named project and/or section.
+    """
+    try:
+        return await _find_in_mirror(api_token, lambda mirror: _tasks_in(mirror, project_name, section_name))
+    except Exception as e:
+        logger.error(f"Error finding tasks: {e}", exc_info=True)
+        return []
+
+async def update_task_content(api_token: str, task_id: str, new_content: str):
+    """
+    Updates the content of an existing task.
+    """
+    try:
+        api = get_async_api(api_token)
+        await api.update_task(task_id=task_id, content=new_content)
+        return True
+    except Exception as e:
+        logger.error(f"Error updating task: {e}", exc_info=True)
+        return False
+
+async def delete_task(api_token: str, task_id: str):
+    """
+    Deletes a task.
+    """
+    try:
+        api = get_async_api(api_token)
+        is_success = await api.delete_task(task_id=task_id)
+        if is_success:
+            get_task_mirror(api_token).remove_task(task_id)
+        return is_success
+    except Exception as e:
+        logger.error(f"Error deleting task: {e}", exc_info=True)
+        return False
+
+async def complete_task(api_token: str, task_id: str):
+    """
+    Marks a task as complete.
+    """
+    try:
+        api = get_async_api(api_token)
+        is_success = await api.complete_task(task_id=task_id)
+        if is_success:
+            get_task_mirror(api_token).remove_task(task_id)
+        return is_success
+    except Exception as e:
+        logger.error(f"Error completing task: {e}", exc_info=True)
+        return False
+
+async def complete_tasks(api_token: str, task_ids):
+    """See todoist.api.complete_tasks."""
+    entries = [command("item_close", {"id": task_id}) for task_id in dict.fromkeys(task_ids)]
+    try:
+        mirror = get_task_mirror(api_token)
+        data = await mirror.sync_commands_async(get_async_http_client(api_token), api_token, entries)
+        return _close_results(data, entries)
+    except Exception as e:
+        logger.error(f"Error completing tasks: {e}", exc_info=True)
+        return {entry["args"]["id"]: str(e) for entry in entries}
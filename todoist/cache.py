@@ -0,0 +1,99 @@
+import os
+import json
+import threading
+import logging
+
+from cache_backend import MemoryBackend, account_key, open_cache
+from metrics import register_collector
+from tenants import TENANTS, register_tenant_state, tenant_state
+
+logger = logging.getLogger(__name__)
+
+ID_CACHE_TTL = float(os.getenv("TODOIST_ID_CACHE_TTL", 600))
+ID_CACHE_SIZE = int(os.getenv("TODOIST_ID_CACHE_SIZE", 2000))
+# Measured with tracemalloc, for the tenant memory cap
+ID_ENTRY_BYTES = 550
+
+
+class IdCache:
+    """
+    A small TTL cache mapping sanitized project/section names to Todoist IDs.
+    Keys are tuples so projects and sections can share one cache:
+    ("project", name) and ("section", project_id, name). Entries live in a
+    cache backend, which may be shared with the other workers.
+    """
+
+    def __init__(self, ttl: float = ID_CACHE_TTL, backend=None):
+        self.ttl = ttl
+        self.backend = backend if backend is not None else MemoryBackend(ID_CACHE_SIZE)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached ID for a key, or None if missing or expired."""
+        value = self.backend.get(json.dumps(key))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Stores an ID for a key, resetting its TTL."""
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """Stores (key, ID) pairs at once, e.g. a page of a project listing."""
+        # A section is tagged with its project too, so dropping the project drops it
+        self.backend.set_many(
+            [(json.dumps(key), value, (value, key[1]) if key[0] == "section" else (value,)) for key, value in items],
+            self.ttl,
+        )
+
+    def invalidate(self, key=None, value=None):
+        """
+        Drops entries by key and/or by ID. Invalidating a project ID also drops
+        the sections cached under it.
+        """
+        if key is not None:
+            self.backend.delete(json.dumps(key))
+        if value is not None:
+            self.backend.invalidate_tag(value)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns hit/miss counters for logging and metrics."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.backend)}
+
+
+def _size(cache: IdCache) -> int:
+    # A shared backend holds its entries on disk
+    return 0 if cache.backend.shared else len(cache.backend) * ID_ENTRY_BYTES
+
+
+register_tenant_state(
+    "id_cache", lambda api_token: IdCache(backend=open_cache(f"ids:{account_key(api_token)}", ID_CACHE_SIZE)), _size
+)
+
+
+def get_id_cache(api_token: str) -> IdCache:
+    """Returns the process-wide ID cache for a Todoist account."""
+    return tenant_state("id_cache", api_token)
+
+
+def _collect():
+    stats = [cache.stats() for cache in TENANTS.states("id_cache")]
+    yield "bot_id_cache_hits_total", "counter", "Project/section ID cache hits.", [({}, sum(s["hits"] for s in stats))]
+    yield "bot_id_cache_misses_total", "counter", "Project/section ID cache misses.", [({}, sum(s["misses"] for s in stats))]
+    yield "bot_id_cache_entries", "gauge", "Cached project/section IDs.", [({}, sum(s["size"] for s in stats))]
+
+
+register_collector(_collect)
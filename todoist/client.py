@@ -0,0 +1,162 @@
+import os
+import asyncio
+import weakref
+import logging
+
+import httpx
+from todoist_api_python.api import TodoistAPI
+from todoist_api_python.api_async import TodoistAPIAsync
+from todoist_api_python._core.endpoints import get_api_url
+from ratelimit import get_limiter, drop_limiter, RateLimitedTransport, AsyncRateLimitedTransport
+from tenants import TENANTS, register_tenant_state, tenant_state
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("TODOIST_POOL_SIZE", 10))
+KEEPALIVE_EXPIRY = float(os.getenv("TODOIST_KEEPALIVE_EXPIRY", 60))
+CONNECT_TIMEOUT = float(os.getenv("TODOIST_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("TODOIST_READ_TIMEOUT", 30))
+# Connections opened at startup, so the first burst of updates doesn't pay for TLS handshakes
+PREWARM_CONNECTIONS = int(os.getenv("TODOIST_PREWARM_CONNECTIONS", 2))
+# Points every Todoist call at another host, e.g. a local stub server in tests
+TODOIST_BASE_URL = os.getenv("TODOIST_BASE_URL")
+
+_DEFAULT_ORIGIN = "https://api.todoist.com"
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=READ_TIMEOUT, pool=CONNECT_TIMEOUT)
+
+
+def _prepare_request(request: httpx.Request) -> None:
+    # The SDK passes its own 60s timeout on every call; swap in ours before sending
+    request.extensions["timeout"] = _timeout().as_dict()
+    if TODOIST_BASE_URL:
+        url = str(request.url)
+        if url.startswith(_DEFAULT_ORIGIN):
+            request.url = httpx.URL(TODOIST_BASE_URL.rstrip("/") + url[len(_DEFAULT_ORIGIN):])
+            request.headers["Host"] = request.url.netloc.decode("ascii")
+
+
+async def _prepare_request_async(request: httpx.Request) -> None:
+    _prepare_request(request)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_SIZE,
+        max_keepalive_connections=POOL_SIZE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def new_http_client(api_token: str = None) -> httpx.Client:
+    """
+    Builds a keep-alive httpx client with the configured pool size and timeouts.
+    Given a token, requests go through that account's Todoist rate limiter.
+    """
+    transport = httpx.HTTPTransport(limits=_limits())
+    if api_token:
+        transport = RateLimitedTransport(transport, get_limiter("todoist", api_token))
+    return httpx.Client(
+        transport=transport,
+        timeout=_timeout(),
+        event_hooks={"request": [_prepare_request]},
+    )
+
+
+def new_async_http_client(api_token: str = None) -> httpx.AsyncClient:
+    """The asyncio counterpart of new_http_client."""
+    transport = httpx.AsyncHTTPTransport(limits=_limits())
+    if api_token:
+        transport = AsyncRateLimitedTransport(transport, get_limiter("todoist", api_token))
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=_timeout(),
+        event_hooks={"request": [_prepare_request_async]},
+    )
+
+
+def _close_api(api: TodoistAPI) -> None:
+    api._client.close()
+    limiter = getattr(api._client._transport, "limiter", None)
+    if limiter is not None:
+        drop_limiter(limiter)
+
+
+def _close_async_apis(apis) -> None:
+    # Eviction may run on any thread; each client is closed on its own loop
+    for loop, api in list(apis.items()):
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(api.close(), loop)
+
+
+# Each account gets its own connection pools, released when it is evicted.
+# httpx.AsyncClient connections are bound to the loop that opened them.
+register_tenant_state(
+    "todoist_api", lambda api_token: TodoistAPI(api_token, client=new_http_client(api_token)), close=_close_api
+)
+register_tenant_state("todoist_async_apis", lambda api_token: weakref.WeakKeyDictionary(), close=_close_async_apis)
+
+
+def get_api(api_token: str) -> TodoistAPI:
+    """
+    Returns the long-lived TodoistAPI for a token, creating it on first use.
+    All calls for the same token share one connection pool.
+    """
+    return tenant_state("todoist_api", api_token)
+
+
+def get_async_api(api_token: str) -> TodoistAPIAsync:
+    """Returns the shared TodoistAPIAsync for a token on the running event loop."""
+    loop = asyncio.get_running_loop()
+    apis = tenant_state("todoist_async_apis", api_token)
+    api = apis.get(loop)
+    if api is None:
+        api = apis[loop] = TodoistAPIAsync(api_token, client=new_async_http_client(api_token))
+    return api
+
+
+def get_http_client(api_token: str) -> httpx.Client:
+    """Returns the pooled httpx client behind get_api, for raw Sync API calls."""
+    return get_api(api_token)._client
+
+
+def get_async_http_client(api_token: str) -> httpx.AsyncClient:
+    """Returns the pooled httpx.AsyncClient behind get_async_api."""
+    return get_async_api(api_token)._client
+
+
+async def prewarm(api_token: str, connections: int = PREWARM_CONNECTIONS) -> None:
+    """
+    Opens pooled connections on the running loop's client ahead of the first
+    real requests. The requests run concurrently, so each takes its own
+    connection.
+    """
+    client = get_async_http_client(api_token)
+    headers = {"Authorization": f"Bearer {api_token}"}
+
+    async def touch():
+        try:
+            await client.head(get_api_url("projects"), headers=headers)
+        except Exception as e:
+            logger.warning(f"Failed to pre-warm Todoist connection: {e}")
+
+    count = max(1, min(connections, POOL_SIZE))
+    await asyncio.gather(*(touch() for _ in range(count)))
+    logger.info(f"Pre-warmed {count} Todoist connection(s).")
+
+
+def close_all() -> None:
+    """Closes every pooled client, e.g. on shutdown."""
+    for api in TENANTS.pop_states("todoist_api"):
+        api._client.close()
+
+
+async def close_all_async() -> None:
+    """Closes the async clients opened on the running event loop."""
+    loop = asyncio.get_running_loop()
+    for apis in TENANTS.states("todoist_async_apis"):
+        api = apis.pop(loop, None)
+        if api is not None:
+            await api.close()
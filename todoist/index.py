@@ -0,0 +1,104 @@
+import re
+import heapq
+from collections import defaultdict
+
+_WHITESPACE = re.compile(r'\s+')
+# Upper bound on tasks scored per fuzzy search; candidates come from the
+# query's rarest trigrams so common ones like " re" don't flood the search
+MAX_CANDIDATES = 2000
+
+
+def normalize(text: str) -> str:
+    """Lowercases a task name and collapses its whitespace."""
+    return _WHITESPACE.sub(' ', text).strip().lower()
+
+
+def _trigrams(normalized: str) -> set:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TaskIndex:
+    """
+    Content index over active tasks: a normalized-content hash for exact
+    matches and a trigram inverted index for substring and fuzzy matches.
+    Tasks are added and removed one at a time as the mirror changes.
+    """
+
+    def __init__(self):
+        self._content = {}
+        self._grams = {}
+        self._exact = defaultdict(dict)
+        self._postings = defaultdict(set)
+
+    def __len__(self):
+        return len(self._content)
+
+    def add(self, task_id: str, content: str) -> None:
+        if task_id in self._content:
+            self.remove(task_id)
+        normalized = normalize(content)
+        grams = _trigrams(normalized)
+        self._content[task_id] = normalized
+        self._grams[task_id] = grams
+        self._exact[normalized][task_id] = None
+        for gram in grams:
+            self._postings[gram].add(task_id)
+
+    def remove(self, task_id: str) -> None:
+        normalized = self._content.pop(task_id, None)
+        if normalized is None:
+            return
+        ids = self._exact[normalized]
+        ids.pop(task_id, None)
+        if not ids:
+            del self._exact[normalized]
+        for gram in self._grams.pop(task_id):
+            postings = self._postings[gram]
+            postings.discard(task_id)
+            if not postings:
+                del self._postings[gram]
+
+    def clear(self) -> None:
+        self._content.clear()
+        self._grams.clear()
+        self._exact.clear()
+        self._postings.clear()
+
+    def exact(self, text: str) -> list:
+        """Returns the IDs of tasks whose normalized content equals the text."""
+        return list(self._exact.get(normalize(text), ()))
+
+    def containing(self, text: str) -> list:
+        """Returns the IDs of tasks whose normalized content contains the text."""
+        target = normalize(text)
+        if len(target) < 3:
+            return [task_id for task_id, content in self._content.items() if target in content]
+        # Only the inner trigrams are guaranteed to appear in a containing string
+        grams = {target[i:i + 3] for i in range(len(target) - 2)}
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set.intersection(*postings) if postings else set()
+        return [task_id for task_id in candidates if target in self._content[task_id]]
+
+    def search(self, text: str, limit: int = 5) -> list:
+        """
+        Ranks tasks by trigram similarity to the text, returning up to `limit`
+        (score, task_id) pairs. Tasks containing the text get a bonus.
+        """
+        target = normalize(text)
+        grams = _trigrams(target)
+        postings = sorted((self._postings[gram] for gram in grams if gram in self._postings), key=len)
+        candidates = set()
+        for task_ids in postings:
+            if candidates and len(candidates) + len(task_ids) > MAX_CANDIDATES:
+                break
+            candidates.update(task_ids)
+
+        scored = []
+        for task_id in candidates:
+            task_grams = self._grams[task_id]
+            score = 2 * len(grams & task_grams) / (len(grams) + len(task_grams))
+            if target and target in self._content[task_id]:
+                score = min(1.0, score + 0.25)
+            scored.append((score, task_id))
+        return heapq.nsmallest(limit, scored, key=lambda pair: (-pair[0], pair[1]))
@@ -0,0 +1,279 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+
+from ratelimit import backoff_delay
+from todoist.api import _add_task_commands, _added_tasks
+from todoist.api_async import _ensure_containers
+from todoist.cache import get_id_cache
+from todoist.client import get_async_http_client
+from todoist.mirror import get_task_mirror
+from todoist.sync import command_error
+from token_crypto import seal_token, unseal_token
+
+logger = logging.getLogger(__name__)
+
+# With write-behind on, /add replies as soon as the task is journaled and a
+# background flusher submits it to Todoist
+TODOIST_WRITE_BEHIND = os.getenv("TODOIST_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+WRITE_BEHIND_PATH = os.getenv("TODOIST_WRITE_BEHIND_PATH", "write_behind.db")
+WRITE_BEHIND_INTERVAL = float(os.getenv("TODOIST_WRITE_BEHIND_INTERVAL", 0.5))
+WRITE_BEHIND_BATCH = int(os.getenv("TODOIST_WRITE_BEHIND_BATCH", 50))
+# Entries still failing after this many attempts are parked, not deleted
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("TODOIST_WRITE_BEHIND_MAX_ATTEMPTS", 20))
+# Entries handed to a flusher are hidden from the other workers' flushers for
+# this long, and picked up again if that worker dies before finishing them
+WRITE_BEHIND_LEASE = float(os.getenv("TODOIST_WRITE_BEHIND_LEASE", 60))
+
+
+class TaskJournal:
+    """
+    A durable SQLite journal of tasks accepted but not yet created in Todoist.
+    Account tokens are stored sealed; rows returned by due() carry them so.
+    Each entry's uuid doubles as the Sync API command uuid, so resubmitting an
+    entry whose earlier attempt did reach Todoist can't create it twice.
+    """
+
+    def __init__(self, path: str = WRITE_BEHIND_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pending_tasks ("
+            "uuid TEXT PRIMARY KEY, api_token TEXT, content TEXT, project_name TEXT, section_name TEXT, "
+            "created REAL, attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0, last_error TEXT, "
+            "parked INTEGER DEFAULT 0)"
+        )
+        self._db.commit()
+
+    def append(self, api_token: str, content: str, project_name: str = None, section_name: str = None) -> str:
+        """Durably records a task to create and returns its uuid."""
+        return self.append_many(api_token, [(content, project_name, section_name)])[0]
+
+    def append_many(self, api_token: str, entries):
+        """Durably records (content, project_name, section_name) entries in one transaction; returns their uuids."""
+        now = time.time()
+        sealed = seal_token(api_token)
+        rows = [(str(uuid.uuid4()), sealed, content, project_name, section_name, now)
+                for content, project_name, section_name in entries]
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO pending_tasks (uuid, api_token, content, project_name, section_name, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+        return [row[0] for row in rows]
+
+    def due(self, limit: int = WRITE_BEHIND_BATCH, lease: float = WRITE_BEHIND_LEASE):
+        """
+        Claims up to `limit` entries ready to be submitted, taking each
+        account's oldest entries in turn, so one account with a large backlog
+        can't fill every batch while the others wait. Claimed entries aren't
+        due again for `lease` seconds, so flushers in other workers sharing
+        the journal don't submit them too.
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two workers can't both read the same rows
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT * FROM pending_tasks WHERE parked = 0 AND next_attempt <= ? "
+                    "ORDER BY ROW_NUMBER() OVER (PARTITION BY api_token ORDER BY created, rowid), created, rowid "
+                    "LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE pending_tasks SET next_attempt = ? WHERE uuid = ?", [(now + lease, row["uuid"]) for row in rows]
+                )
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+        return rows
+
+    def remove(self, uuids) -> None:
+        with self._lock:
+            self._db.executemany("DELETE FROM pending_tasks WHERE uuid = ?", [(u,) for u in uuids])
+            self._db.commit()
+
+    def retry_later(self, uuids, error: str) -> None:
+        """Reschedules entries with backoff, parking those out of attempts."""
+        with self._lock:
+            for entry_uuid in uuids:
+                row = self._db.execute("SELECT attempts FROM pending_tasks WHERE uuid = ?", (entry_uuid,)).fetchone()
+                if row is None:
+                    continue
+                attempts = row["attempts"] + 1
+                parked = attempts >= WRITE_BEHIND_MAX_ATTEMPTS
+                if parked:
+                    logger.error(f"Giving up on journaled task {entry_uuid} after {attempts} attempts: {error}")
+                self._db.execute(
+                    "UPDATE pending_tasks SET attempts = ?, next_attempt = ?, last_error = ?, parked = ? WHERE uuid = ?",
+                    (attempts, time.time() + backoff_delay(attempts), error, int(parked), entry_uuid),
+                )
+            self._db.commit()
+
+    def park(self, uuids, error: str) -> None:
+        """Stops retrying entries that can never succeed; they stay in the journal for inspection."""
+        with self._lock:
+            self._db.executemany(
+                "UPDATE pending_tasks SET parked = 1, last_error = ? WHERE uuid = ?", [(error, u) for u in uuids]
+            )
+            self._db.commit()
+
+    def purge(self, api_token: str) -> int:
+        """Drops every entry of an account, e.g. when it disconnects; returns how many."""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM pending_tasks WHERE api_token IN (?, ?)", (seal_token(api_token), api_token)
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending, parked, oldest = self._db.execute(
+                "SELECT SUM(parked = 0), SUM(parked = 1), MIN(created) FROM pending_tasks"
+            ).fetchone()
+        return {
+            "pending": pending or 0,
+            "parked": parked or 0,
+            "oldest_age_seconds": time.time() - oldest if oldest else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class JournalFlusher:
+    """
+    Submits journaled tasks to Todoist in the background: each round takes
+    the due entries, groups them by account and sends each group as one
+    batched Sync API request. Failed entries stay in the journal and are
+    retried with backoff.
+    """
+
+    def __init__(self, journal: TaskJournal, interval: float = WRITE_BEHIND_INTERVAL,
+                 batch_size: int = WRITE_BEHIND_BATCH):
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        self.flushed = 0
+        self.failed = 0
+        self._task = None
+        self._wakeup = None
+
+    def start(self) -> None:
+        """Starts flushing on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="write-behind-flusher")
+        logger.info(f"Write-behind flusher started with {self.journal.stats()['pending']} pending task(s).")
+
+    def wake(self) -> None:
+        """Flushes without waiting for the next interval, e.g. right after an append."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                submitted = await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing the write-behind journal: {e}", exc_info=True)
+                submitted = 0
+            if submitted < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def flush(self) -> int:
+        """Submits one round of due entries; returns how many were attempted."""
+        # Journal writes wait on SQLite's lock, which another worker may hold, so they run off the loop
+        rows = await asyncio.to_thread(self.journal.due, self.batch_size)
+        by_token = {}
+        for row in rows:
+            by_token.setdefault(row["api_token"], []).append(row)
+        # Accounts are submitted concurrently, so a slow one doesn't hold up the rest
+        await asyncio.gather(*(self._submit(sealed, group) for sealed, group in by_token.items()))
+        return len(rows)
+
+    async def _submit(self, sealed_token: str, rows) -> None:
+        try:
+            api_token = unseal_token(sealed_token)
+        except ValueError as e:
+            # Retrying can't help, and the rows would otherwise hold up the account forever
+            logger.error(f"Parking {len(rows)} journaled task(s) whose token can't be read: {e}")
+            self.failed += len(rows)
+            await asyncio.to_thread(self.journal.park, [row["uuid"] for row in rows], str(e))
+            return
+
+        client = get_async_http_client(api_token)
+        cache = get_id_cache(api_token)
+        mirror = get_task_mirror(api_token)
+        try:
+            if mirror.is_stale() or any(row["attempts"] for row in rows):
+                # An earlier attempt may have created projects we never heard back about
+                await mirror.sync_async(client, api_token)
+            entries = [(row["content"], row["project_name"], row["section_name"]) for row in rows]
+            # New projects/sections are shared with concurrent /add batches for the account
+            await _ensure_containers(client, api_token, entries, cache, mirror)
+            commands, items, created = _add_task_commands(
+                entries, cache, mirror, uuids=[row["uuid"] for row in rows],
+            )
+            data = await mirror.sync_commands_async(client, api_token, commands)
+        except Exception as e:
+            logger.warning(f"Submitting {len(rows)} journaled task(s) failed, will retry: {e}")
+            self.failed += len(rows)
+            await asyncio.to_thread(self.journal.retry_later, [row["uuid"] for row in rows], str(e))
+            return
+
+        _added_tasks(data, items, created, cache, mirror)
+        done = [entry["uuid"] for entry in items if command_error(data, entry) is None]
+        failed = [entry for entry in items if command_error(data, entry) is not None]
+        await asyncio.to_thread(self.journal.remove, done)
+        for entry in failed:
+            await asyncio.to_thread(self.journal.retry_later, [entry["uuid"]], command_error(data, entry))
+        self.flushed += len(done)
+        self.failed += len(failed)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+_journal = None
+_flusher = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> TaskJournal:
+    """Returns the process-wide write-behind journal, opening it on first use."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = TaskJournal()
+        return _journal
+
+
+def get_flusher() -> JournalFlusher:
+    """Returns the process-wide flusher for get_journal()."""
+    global _flusher
+    journal = get_journal()
+    with _journal_lock:
+        if _flusher is None:
+            _flusher = JournalFlusher(journal)
+        return _flusher
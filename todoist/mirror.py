@@ -0,0 +1,248 @@
+import os
+import asyncio
+import threading
+import time
+import logging
+
+from todoist_api_python.models import Task
+from cache_backend import account_key, open_cache
+from todoist.sync import post_sync, post_sync_async
+from todoist.index import TaskIndex
+from metrics import register_collector
+from tenants import TENANTS, register_tenant_state, tenant_state
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+MIRROR_REFRESH_INTERVAL = float(os.getenv("TODOIST_MIRROR_REFRESH", 60))
+RESOURCE_TYPES = ["items", "projects", "sections"]
+# How often a worker refreshes the snapshot shared with other workers, which
+# lets a cold worker start with a delta sync instead of a full one
+MIRROR_SNAPSHOT_INTERVAL = float(os.getenv("TODOIST_MIRROR_SNAPSHOT_INTERVAL", 300))
+# A mirrored task with its index entries, measured with tracemalloc, for the tenant memory cap
+TASK_BYTES = 10_000
+
+
+class TaskMirror:
+    """
+    An in-memory copy of a Todoist account's active tasks, projects and sections.
+    The first sync downloads everything; later syncs send the stored sync_token
+    and only receive what changed since.
+
+    With a shared cache backend, workers also share a snapshot of the mirror
+    and a per-account write generation: a write made through one worker makes
+    the other workers' mirrors stale, so their next lookup syncs first.
+    """
+
+    def __init__(self, refresh_interval: float = MIRROR_REFRESH_INTERVAL, backend=None):
+        self.refresh_interval = refresh_interval
+        self.backend = backend
+        self._generation = None
+        self.sync_token = "*"
+        self.tasks = {}
+        self.index = TaskIndex()
+        self.projects = {}
+        self.sections = {}
+        self.last_sync = None
+        self._lock = threading.RLock()
+
+    @property
+    def is_synced(self) -> bool:
+        return self.last_sync is not None
+
+    @property
+    def _shared(self) -> bool:
+        return self.backend is not None and self.backend.shared
+
+    def _shared_generation(self):
+        return self.backend.counter("generation") if self._shared else None
+
+    def is_stale(self) -> bool:
+        if not self.is_synced or time.monotonic() - self.last_sync > self.refresh_interval:
+            return True
+        # Another worker wrote to the account since this mirror last synced
+        return self._shared and self._shared_generation() != self._generation
+
+    def _note_write(self) -> None:
+        if not self._shared:
+            return
+        generation = self.backend.incr("generation")
+        with self._lock:
+            # Only our own write happened since the last sync, so the mirror is still current
+            if self._generation is not None and generation == self._generation + 1:
+                self._generation = generation
+
+    def _request(self) -> dict:
+        return {"sync_token": self.sync_token, "resource_types": RESOURCE_TYPES}
+
+    def save_snapshot(self) -> None:
+        """Stores the mirror in the shared cache for other workers to start from."""
+        with self._lock:
+            snapshot = {
+                "sync_token": self.sync_token,
+                "tasks": [task.to_dict() for task in self.tasks.values()],
+                "projects": list(self.projects.values()),
+                "sections": list(self.sections.values()),
+            }
+        self.backend.set("snapshot", snapshot)
+        self.backend.set("snapshot_saved", time.time())
+
+    def load_snapshot(self) -> bool:
+        """Starts an unsynced mirror from the shared snapshot, if there is one."""
+        snapshot = self.backend.get("snapshot") if self._shared else None
+        if not snapshot:
+            return False
+        with self._lock:
+            if self.is_synced:
+                return False
+            self.tasks.clear()
+            self.index.clear()
+            for entry in snapshot["tasks"]:
+                self._add(Task.from_dict(entry))
+            self.projects = {entry["id"]: entry for entry in snapshot["projects"]}
+            self.sections = {entry["id"]: entry for entry in snapshot["sections"]}
+            self.sync_token = snapshot["sync_token"]
+        logger.info(f"Mirror loaded {len(self.tasks)} tasks from the shared snapshot.")
+        return True
+
+    def _snapshot_due(self) -> bool:
+        return self._shared and time.time() - (self.backend.get("snapshot_saved") or 0) > MIRROR_SNAPSHOT_INTERVAL
+
+    @span("mirror.apply")
+    def apply(self, data: dict, generation: int = None) -> None:
+        """
+        Applies a Sync API response, full or incremental. `generation` is the
+        shared write generation read before the request was sent.
+        """
+        with self._lock:
+            if data.get("full_sync"):
+                self.tasks.clear()
+                self.index.clear()
+                self.projects.clear()
+                self.sections.clear()
+            for item in data.get("items", []):
+                if item.get("checked") or item.get("is_deleted"):
+                    self._remove(item["id"])
+                    continue
+                try:
+                    self._add(Task.from_dict(item))
+                except Exception as e:
+                    logger.warning(f"Skipping unreadable task {item.get('id')} from sync: {e}")
+            for store, key in ((self.projects, "projects"), (self.sections, "sections")):
+                for entry in data.get(key, []):
+                    if entry.get("is_deleted") or entry.get("is_archived"):
+                        store.pop(entry["id"], None)
+                    else:
+                        store[entry["id"]] = entry
+            self.sync_token = data.get("sync_token", self.sync_token)
+            self.last_sync = time.monotonic()
+            if generation is not None:
+                self._generation = generation
+        logger.debug(f"Mirror synced ({'full' if data.get('full_sync') else 'delta'}), {len(self.tasks)} tasks.")
+
+    def sync(self, client, api_token: str) -> None:
+        generation = self._shared_generation()
+        if not self.is_synced:
+            self.load_snapshot()
+        self.apply(post_sync(client, api_token, **self._request()), generation)
+        if self._snapshot_due():
+            self.save_snapshot()
+
+    async def sync_async(self, client, api_token: str) -> None:
+        generation = self._shared_generation()
+        if not self.is_synced and self._shared:
+            await asyncio.to_thread(self.load_snapshot)
+        data = await post_sync_async(client, api_token, **self._request())
+        if data.get("full_sync"):
+            # Building tens of thousands of Task objects would stall the event loop
+            await asyncio.to_thread(self.apply, data, generation)
+        else:
+            self.apply(data, generation)
+        if self._snapshot_due():
+            await asyncio.to_thread(self.save_snapshot)
+
+    def sync_commands(self, client, api_token: str, commands: list) -> dict:
+        """
+        Submits write commands in a sync request and applies the delta that
+        comes back with them, so the mirror reflects the writes immediately.
+        """
+        generation = self._shared_generation()
+        data = post_sync(client, api_token, commands=commands, **self._request())
+        self.apply(data, generation)
+        if commands:
+            self._note_write()
+        return data
+
+    async def sync_commands_async(self, client, api_token: str, commands: list) -> dict:
+        generation = self._shared_generation()
+        data = await post_sync_async(client, api_token, commands=commands, **self._request())
+        if data.get("full_sync"):
+            await asyncio.to_thread(self.apply, data, generation)
+        else:
+            self.apply(data, generation)
+        if commands:
+            self._note_write()
+        return data
+
+    def _add(self, task) -> None:
+        self.tasks[task.id] = task
+        self.index.add(task.id, task.content)
+
+    def _remove(self, task_id: str) -> None:
+        self.tasks.pop(task_id, None)
+        self.index.remove(task_id)
+
+    def add_task(self, task) -> None:
+        """Records a task this worker created."""
+        with self._lock:
+            self._add(task)
+        self._note_write()
+
+    def remove_task(self, task_id: str) -> None:
+        """Records a task this worker completed or deleted."""
+        with self._lock:
+            self._remove(task_id)
+        self._note_write()
+
+    def find_by_content(self, task_content: str):
+        """
+        Finds an active task by its exact content, preferring a case-sensitive
+        match over one that only matches after normalization.
+        """
+        target = task_content.strip()
+        with self._lock:
+            tasks = [self.tasks[task_id] for task_id in self.index.exact(target)]
+        for task in tasks:
+            if task.content.strip() == target:
+                return task
+        return tasks[0] if tasks else None
+
+    def find_by_name(self, task_name: str):
+        """Finds active tasks that contain the given name (case-insensitive)."""
+        with self._lock:
+            return [self.tasks[task_id] for task_id in self.index.containing(task_name)]
+
+    def search(self, text: str, limit: int = 5):
+        """Returns up to `limit` (score, task) pairs ranked by similarity to the text."""
+        with self._lock:
+            return [(score, self.tasks[task_id]) for score, task_id in self.index.search(text, limit)]
+
+
+register_tenant_state(
+    "task_mirror",
+    lambda api_token: TaskMirror(backend=open_cache(f"mirror:{account_key(api_token)}", 8)),
+    lambda mirror: len(mirror.tasks) * TASK_BYTES,
+)
+
+
+def get_task_mirror(api_token: str) -> TaskMirror:
+    """Returns the process-wide task mirror for a Todoist account."""
+    return tenant_state("task_mirror", api_token)
+
+
+def _collect():
+    mirrors = TENANTS.states("task_mirror")
+    yield "bot_task_mirror_tasks", "gauge", "Active tasks held in the task mirrors.", [({}, sum(len(m.tasks) for m in mirrors))]
+
+
+register_collector(_collect)
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import concurrent.futures
+
+from tenants import register_tenant_state, tenant_state
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one. The first caller
+    runs the work; callers arriving while it is in flight wait for it and
+    share its result or exception. Threads wait with do() and asyncio tasks
+    with do_async(), and both kinds of caller can share the same flight.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Returns (future, is_leader) for the flight under a key."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = self._flights[key] = concurrent.futures.Future()
+            self.calls += 1
+            return future, True
+
+    def _land(self, key, future, result=None, error=None) -> None:
+        with self._lock:
+            del self._flights[key]
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn):
+        """Runs fn() unless a call for the key is in flight, then returns its result."""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    async def do_async(self, key, fn):
+        """The asyncio counterpart of do(); fn returns an awaitable."""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    def stats(self):
+        """Returns how many flights ran and how many callers joined one instead."""
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
+
+
+register_tenant_state("single_flight", lambda api_token: SingleFlight())
+
+
+def get_single_flight(api_token: str) -> SingleFlight:
+    """Returns the process-wide single-flight group for a Todoist account."""
+    return tenant_state("single_flight", api_token)
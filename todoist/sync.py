@@ -0,0 +1,62 @@
+import json
+import uuid
+import httpx
+from todoist_api_python._core.endpoints import get_api_url
+
+SYNC_URL = get_api_url("sync")
+
+
+def _form(data: dict) -> dict:
+    """The Sync API takes form fields, with lists/dicts JSON-encoded."""
+    return {
+        key: json.dumps(value) if isinstance(value, (list, dict)) else value
+        for key, value in data.items()
+    }
+
+
+def command(type: str, args: dict, temp_id: str = None, command_uuid: str = None) -> dict:
+    """
+    Builds a Sync API command. Its uuid identifies it in the response's
+    sync_status, and Todoist applies a given uuid only once.
+    """
+    entry = {"type": type, "uuid": command_uuid or str(uuid.uuid4()), "args": args}
+    if temp_id:
+        entry["temp_id"] = temp_id
+    return entry
+
+
+def command_error(data: dict, entry: dict):
+    """Returns the error for a command in a Sync API response, or None if it succeeded."""
+    status = data.get("sync_status", {}).get(entry["uuid"])
+    if status == "ok":
+        return None
+    if isinstance(status, dict):
+        return status.get("error") or str(status)
+    return "no status returned"
+
+
+def _headers(api_token: str) -> dict:
+    # Commands carry their own uuids, so a retried request is not applied twice
+    return {"Authorization": f"Bearer {api_token}", "X-Request-Id": str(uuid.uuid4())}
+
+
+def post_sync(client: httpx.Client, api_token: str, **data) -> dict:
+    """Posts a request to the Todoist Sync API and returns the decoded response."""
+    response = client.post(
+        SYNC_URL,
+        data=_form(data),
+        headers=_headers(api_token),
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def post_sync_async(client: httpx.AsyncClient, api_token: str, **data) -> dict:
+    """The asyncio counterpart of post_sync."""
+    response = await client.post(
+        SYNC_URL,
+        data=_form(data),
+        headers=_headers(api_token),
+    )
+    response.raise_for_status()
+    return response.json()
@@ -0,0 +1,91 @@
+import os
+import hmac
+import base64
+import hashlib
+import secrets
+import threading
+
+# Private state such as connected accounts is kept outside the app directory
+BOT_DATA_DIR = os.path.expanduser(
+    os.getenv("BOT_DATA_DIR", os.path.join(os.getenv("XDG_STATE_HOME", "~/.local/state"), "todoist-bot"))
+)
+# Todoist tokens are stored sealed with this key; without one, a random key is
+# generated on first use in BOT_DATA_DIR and shared by every worker
+TOKEN_ENCRYPTION_KEY = os.getenv("TOKEN_ENCRYPTION_KEY")
+TOKEN_KEY_PATH = os.path.join(BOT_DATA_DIR, "token.key")
+
+_PREFIX = "sealed:v1:"
+_NONCE_BYTES = 16
+
+_keys = None
+_keys_lock = threading.Lock()
+
+
+def make_private_dir(path: str) -> None:
+    """Creates a directory only this user can read, if it doesn't exist."""
+    os.makedirs(path or ".", mode=0o700, exist_ok=True)
+
+
+def _load_key() -> bytes:
+    if TOKEN_ENCRYPTION_KEY:
+        return TOKEN_ENCRYPTION_KEY.encode()
+    if not os.path.exists(TOKEN_KEY_PATH):
+        make_private_dir(os.path.dirname(TOKEN_KEY_PATH))
+        # Written aside and linked into place, so a worker racing us never reads a partial key
+        staging = f"{TOKEN_KEY_PATH}.{os.getpid()}"
+        fd = os.open(staging, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(32))
+        try:
+            os.link(staging, TOKEN_KEY_PATH)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(staging)
+    with open(TOKEN_KEY_PATH, "rb") as f:
+        return f.read()
+
+
+def _get_keys():
+    global _keys
+    with _keys_lock:
+        if _keys is None:
+            key = _load_key()
+            _keys = (hmac.new(key, b"encrypt", hashlib.sha256).digest(),
+                     hmac.new(key, b"authenticate", hashlib.sha256).digest())
+        return _keys
+
+
+def _keystream_xor(data: bytes, key: bytes, nonce: bytes) -> bytes:
+    stream = b"".join(
+        hmac.new(key, nonce + counter.to_bytes(4, "big"), hashlib.sha256).digest()
+        for counter in range(len(data) // 32 + 1)
+    )
+    return bytes(a ^ b for a, b in zip(data, stream))
+
+
+def seal_token(api_token: str):
+    """
+    Encrypts a token for storage. The nonce is derived from the token, so a
+    token always seals to the same value and stored rows can still be
+    grouped and looked up by it; the nonce doubles as the integrity check.
+    """
+    if api_token is None:
+        return None
+    encrypt_key, mac_key = _get_keys()
+    data = api_token.encode()
+    nonce = hmac.new(mac_key, data, hashlib.sha256).digest()[:_NONCE_BYTES]
+    return _PREFIX + base64.urlsafe_b64encode(nonce + _keystream_xor(data, encrypt_key, nonce)).decode()
+
+
+def unseal_token(value: str):
+    """Decrypts a sealed token; values stored before sealing are returned as is."""
+    if value is None or not value.startswith(_PREFIX):
+        return value
+    encrypt_key, mac_key = _get_keys()
+    blob = base64.urlsafe_b64decode(value[len(_PREFIX):])
+    nonce, sealed = blob[:_NONCE_BYTES], blob[_NONCE_BYTES:]
+    data = _keystream_xor(sealed, encrypt_key, nonce)
+    if not hmac.compare_digest(nonce, hmac.new(mac_key, data, hashlib.sha256).digest()[:_NONCE_BYTES]):
+        raise ValueError("Stored token failed its integrity check; was TOKEN_ENCRYPTION_KEY changed?")
+    return data.decode()
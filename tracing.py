@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import inspect
+import logging
+import functools
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+# Updates slower than this (in seconds) have their span timeline logged; 0 logs every update
+SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", 2.0))
+# Caps the spans kept per trace, e.g. for a batch that makes hundreds of calls
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 500))
+
+# The innermost open span. asyncio tasks and asyncio.to_thread() copy the
+# context, so work started from inside a span records into it.
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed stage of a trace, holding the stages and upstream calls made inside it."""
+    __slots__ = ("name", "attrs", "start", "end", "children", "root", "spans", "dropped")
+
+    def __init__(self, name: str, attrs: dict, start: float = None, root=None):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.monotonic() if start is None else start
+        self.end = None
+        self.children = []
+        self.root = root or self
+        # Only kept on the root
+        self.spans = 1
+        self.dropped = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+    def child(self, name: str, attrs: dict, start: float = None):
+        """Opens a span under this one, or returns None once the trace is full."""
+        root = self.root
+        if root.spans >= TRACE_MAX_SPANS:
+            root.dropped += 1
+            return None
+        root.spans += 1
+        span = Span(name, attrs, start, root)
+        self.children.append(span)
+        return span
+
+    def to_dict(self, origin: float) -> dict:
+        """The span and its children, with times in ms relative to `origin`."""
+        entry = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        entry.update(self.attrs)
+        if self.children:
+            entry["spans"] = [child.to_dict(origin) for child in sorted(self.children, key=lambda s: s.start)]
+        return entry
+
+
+class _SpanContext:
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def _open(self):
+        parent = _current.get()
+        return parent.child(self.name, dict(self.attrs)) if parent is not None else None
+
+    def __enter__(self):
+        self.span = self._open()
+        if self.span is not None:
+            self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is None:
+            return
+        self.span.end = time.monotonic()
+        if exc_type is not None:
+            self.span.attrs["error"] = exc_type.__name__
+        _current.reset(self.token)
+
+    def __call__(self, fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def traced_async(*args, **kwargs):
+                with type(self)(self.name, self.attrs):
+                    return await fn(*args, **kwargs)
+            return traced_async
+
+        @functools.wraps(fn)
+        def traced(*args, **kwargs):
+            with type(self)(self.name, self.attrs):
+                return fn(*args, **kwargs)
+        return traced
+
+
+class _TraceContext(_SpanContext):
+    def __init__(self, name: str, attrs: dict, start: float = None, threshold: float = None):
+        super().__init__(name, attrs)
+        self.start = start
+        self.threshold = SLOW_UPDATE_THRESHOLD if threshold is None else threshold
+
+    def _open(self):
+        return Span(self.name, dict(self.attrs), self.start)
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if self.span.duration >= self.threshold:
+            log_trace(self.span)
+
+
+def trace(name: str, start: float = None, threshold: float = None, **attrs):
+    """
+    Starts a new trace, as a context manager. `start` back-dates it to an
+    earlier time.monotonic() reading, e.g. when the update was enqueued. If
+    the trace takes `threshold` seconds or more its timeline is logged.
+    """
+    return _TraceContext(name, attrs, start, threshold)
+
+
+def span(name: str, **attrs):
+    """
+    Times a block, or a sync or async function, as a span of the current
+    trace. Outside a trace it does nothing.
+    """
+    return _SpanContext(name, attrs)
+
+
+def record(name: str, start: float, end: float = None, **attrs) -> None:
+    """Adds an already finished span, such as an upstream request, to the current trace."""
+    parent = _current.get()
+    if parent is None:
+        return
+    span = parent.child(name, attrs, start)
+    if span is not None:
+        span.end = time.monotonic() if end is None else end
+
+
+def current_span():
+    return _current.get()
+
+
+def log_trace(root: Span) -> None:
+    """Writes a trace's full span timeline as one JSON log line."""
+    entry = {"event": "slow_trace", **root.to_dict(root.start)}
+    if root.dropped:
+        entry["dropped_spans"] = root.dropped
+    logger.warning(json.dumps(entry, default=str, separators=(",", ":")))